@@ -0,0 +1,116 @@
+"""
+Serve tree reads to many concurrent asyncio readers, either by calling the
+synchronous ``Tree`` API from the coroutines (which blocks the event loop for
+every query) or through ``AsyncTree``. Reports requests per second and the
+worst delay seen by a 10 ms heartbeat task running on the same loop.
+
+Usage:
+    python -m benchmarks.bench_async [size] [readers] [requests_per_reader]
+
+Each request opens a session, loads the tree and fetches the children of a
+random node, as a web handler would. Requires aiosqlite and greenlet.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_copy import build_tree
+from tree_manager import Base, Tree
+from tree_manager.aio import AsyncTree
+from tree_manager.database import (
+    SQLITE_CONCURRENT_PRAGMAS,
+    make_async_engine,
+    make_async_sessionmaker,
+    make_engine,
+)
+
+HEARTBEAT_SECONDS = 0.01
+
+
+async def serve(readers, per_reader, request):
+    """
+    Run ``readers`` coroutines making ``per_reader`` requests each, next to a
+    heartbeat task. Returns requests per second and the worst heartbeat delay.
+    """
+    done = asyncio.Event()
+    worst_delay = 0.0
+
+    async def heartbeat():
+        nonlocal worst_delay
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            worst_delay = max(worst_delay, time.perf_counter() - start - HEARTBEAT_SECONDS)
+
+    async def reader(seed):
+        rng = random.Random(seed)
+        for _ in range(per_reader):
+            await request(rng)
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(reader(seed) for seed in range(readers)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await beat
+    return readers * per_reader / elapsed, worst_delay
+
+
+async def run_sync_api(path, tree_id, node_ids, readers, per_reader):
+    engine = make_engine(f"sqlite:///{path}", sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS)
+    Session = sessionmaker(bind=engine)
+
+    async def request(rng):
+        with Session() as session:
+            Tree.get(session, tree_id).get_child_nodes(session, rng.choice(node_ids))
+        await asyncio.sleep(0)
+
+    result = await serve(readers, per_reader, request)
+    engine.dispose()
+    return result
+
+
+async def run_async_api(path, tree_id, node_ids, readers, per_reader):
+    engine = make_async_engine(
+        f"sqlite+aiosqlite:///{path}", pool_size=readers, max_overflow=0, sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS
+    )
+    Session = make_async_sessionmaker(engine)
+
+    async def request(rng):
+        async with Session() as session:
+            tree = await AsyncTree.get(session, tree_id)
+            await tree.get_child_nodes(session, rng.choice(node_ids))
+
+    result = await serve(readers, per_reader, request)
+    await engine.dispose()
+    return result
+
+
+def main(argv):
+    size = int(argv[0]) if len(argv) > 0 else 100_000
+    readers = int(argv[1]) if len(argv) > 1 else 100
+    per_reader = int(argv[2]) if len(argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = make_engine(f"sqlite:///{path}", sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS)
+        Base.metadata.create_all(engine)
+        with sessionmaker(bind=engine)() as session:
+            tree = build_tree(session, size)
+            tree_id = tree.id
+            node_ids = [node.id for node in tree.nodes[: size // 4]]
+        engine.dispose()
+
+        print(f"{size} nodes, {readers} concurrent readers x {per_reader} requests")
+        for label, run in (("sync Tree in coroutines", run_sync_api), ("AsyncTree", run_async_api)):
+            rate, worst_delay = asyncio.run(run(path, tree_id, node_ids, readers, per_reader))
+            print(f"{label:>24}: {rate:8.0f} requests/s  worst event loop stall {worst_delay * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
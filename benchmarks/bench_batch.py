@@ -0,0 +1,55 @@
+"""
+Run the batch operations over many small trees in a WAL-mode SQLite file with
+a growing number of worker processes, and report trees per second.
+
+Usage:
+    python -m benchmarks.bench_batch [trees] [nodes_per_tree] [max_workers]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.generate import generate_tree
+from tree_manager.batch import run_batch
+from tree_manager.database import SQLITE_CONCURRENT_PRAGMAS, init_db, make_engine
+
+
+def main(argv):
+    trees = int(argv[0]) if len(argv) > 0 else 200
+    size = int(argv[1]) if len(argv) > 1 else 2000
+    max_workers = int(argv[2]) if len(argv) > 2 else os.cpu_count() or 1
+
+    directory = tempfile.mkdtemp()
+    try:
+        url = f"sqlite:///{os.path.join(directory, 'trees.db')}"
+        engine = make_engine(url, sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS)
+        init_db(engine)
+        session = sessionmaker(bind=engine)()
+        for seed in range(trees):
+            generate_tree(session, "balanced", size, seed=seed)
+        session.close()
+        engine.dispose()
+
+        print(f"{trees} trees of {size} nodes, {os.cpu_count()} CPUs")
+        workers = 1
+        while workers <= max_workers:
+            line = [f"{workers:3d} workers"]
+            for operation, options in (
+                ("check", {}),
+                ("export", {"directory": directory}),
+                ("create_tag", {"tag_name": f"nightly_{workers}"}),
+            ):
+                report = run_batch(url, operation, workers=workers, **options)
+                assert not report["errors"], report["errors"]
+                line.append(f"{operation} {trees / report['seconds']:8.1f} trees/s")
+            print("  ".join(line))
+            workers *= 2
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""
+Compare the bulk copy path of ``create_new_tree_version_from_tag`` and
+``restore_from_tag`` against the previous row-by-row implementation.
+
+Usage:
+    python -m benchmarks.bench_copy [size ...]
+
+Sizes default to 10k, 100k and 1M nodes. The row-by-row baseline commits once
+per node, so it is only run for sizes up to ``LEGACY_LIMIT``.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.generate import generate_tree
+from tree_manager import Base, Tree, TreeNode, TreeEdge
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+LEGACY_LIMIT = 10_000
+
+
+def build_tree(session, size, fanout=4):
+    return generate_tree(session, "balanced", size, fanout=fanout, name=f"bench_{size}")
+
+
+def legacy_branch(session, tree):
+    """The pre-bulk implementation: one commit per node, one edge query per node."""
+    new_tree = Tree(name=f"{tree.name}_legacy_branch")
+    session.add(new_tree)
+    session.commit()
+
+    node_mapping = {}
+    for old_node in tree.nodes:
+        new_node = TreeNode(tree_id=new_tree.id, data=old_node.data)
+        session.add(new_node)
+        session.commit()
+        node_mapping[old_node.id] = new_node.id
+
+    for old_node in tree.nodes:
+        edges = session.query(TreeEdge).filter_by(incoming_node_id=old_node.id).all()
+        for old_edge in edges:
+            session.add(
+                TreeEdge(
+                    incoming_node_id=node_mapping[old_edge.incoming_node_id],
+                    outgoing_node_id=node_mapping[old_edge.outgoing_node_id],
+                    data=old_edge.data,
+                )
+            )
+    session.commit()
+    return new_tree
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def run(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        tree = build_tree(session, size)
+        tree.create_tag(session, "v1")
+
+        results = {"size": size}
+        results["branch"] = timed(tree.create_new_tree_version_from_tag, session, "v1")
+        results["cow_branch"] = timed(tree.create_new_tree_version_from_tag, session, "v1", True)
+        results["restore"] = timed(tree.restore_from_tag, session, "v1")
+        if size <= LEGACY_LIMIT:
+            results["legacy_branch"] = timed(legacy_branch, session, tree)
+
+        session.close()
+        engine.dispose()
+    return results
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or DEFAULT_SIZES
+    for size in sizes:
+        results = run(size)
+        line = (
+            f"{size:>9} nodes  branch {results['branch']:.2f}s  cow branch {results['cow_branch'] * 1000:.1f}ms"
+            f"  restore {results['restore']:.2f}s"
+        )
+        if "legacy_branch" in results:
+            speedup = results["legacy_branch"] / results["branch"]
+            line += f"  legacy branch {results['legacy_branch']:.2f}s ({speedup:.0f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+"""
+Measure database size and branch copy time with inline payloads versus
+content-addressed (interned) payloads.
+
+Usage:
+    python -m benchmarks.bench_payloads [size] [branches]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager import Base, Tree
+from tree_manager.models import _bulk_insert_edges, _bulk_insert_nodes
+from tree_manager.payloads import intern_tree_payloads
+
+
+def payload(i):
+    return {
+        "name": f"node {i}",
+        "setting": "experimental" if i % 7 == 0 else "default",
+        "limits": {"cpu": 2 + i % 4, "memory": f"{256 * (1 + i % 8)}Mi", "replicas": 3},
+        "labels": [f"team-{i % 12}", "tier-backend", "region-eu-west-1"],
+        "description": f"Configuration block {i} for the service deployment pipeline",
+    }
+
+
+def run(path, size, branches, interned):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    tree = Tree(name="bench")
+    session.add(tree)
+    session.flush()
+    ids = _bulk_insert_nodes(session, tree.id, ({"data": payload(i), "data_hash": None} for i in range(size)))
+    _bulk_insert_edges(
+        session,
+        (
+            {"tree_id": tree.id, "incoming_node_id": ids[(i - 1) // 4], "outgoing_node_id": ids[i], "data": {"relation": "child"}, "data_hash": None}
+            for i in range(1, size)
+        ),
+    )
+    session.commit()
+    if interned:
+        intern_tree_payloads(session, tree.id)
+    tree.create_tag(session, "v1")
+
+    start = time.perf_counter()
+    for _ in range(branches):
+        tree.create_new_tree_version_from_tag(session, "v1")
+    elapsed = time.perf_counter() - start
+
+    session.close()
+    engine.dispose()
+    return os.path.getsize(path), elapsed / branches
+
+
+def main(argv):
+    size = int(argv[0]) if len(argv) > 0 else 100_000
+    branches = int(argv[1]) if len(argv) > 1 else 10
+    print(f"{size} nodes, {branches} branches")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, interned in (("inline", False), ("interned", True)):
+            db_size, branch_time = run(os.path.join(tmp, f"{label}.db"), size, branches, interned)
+            print(f"{label:>9}: {db_size / 1e6:8.1f} MB on disk  branch {branch_time * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
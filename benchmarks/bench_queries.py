@@ -0,0 +1,96 @@
+"""
+Time the read queries of a large tree on a database created without the
+model indexes and in rollback-journal mode, then again after
+``migrations.upgrade`` has created the indexes and the connections use the
+"production" storage profile.
+
+Usage:
+    python -m benchmarks.bench_queries [size] [repeat]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_copy import build_tree
+from tree_manager import Base, Tree, TreeNode
+from tree_manager.database import SQLITE_PROFILES, make_engine
+from tree_manager.migrations import set_journal_mode, upgrade
+
+MODEL_INDEXES = (
+    "ix_tree_node_tree_id",
+    "ix_tree_edge_tree_id",
+    "ix_tree_edge_incoming_node_id",
+    "ix_tree_edge_outgoing_node_id",
+    "ix_tree_tag_tag_name",
+)
+
+
+def queries(session, tree, node_ids, leaf_id, rng):
+    node_id = rng.choice(node_ids)
+    return {
+        "get_child_nodes": lambda: tree.get_child_nodes(session, node_id),
+        "get_parent_nodes": lambda: tree.get_parent_nodes(session, node_id),
+        "get_root_nodes": lambda: tree.get_root_nodes(session),
+        "traverse_tree (subtree)": lambda: tree.traverse_tree(session, node_id),
+        "get_nodes_at_depth(3)": lambda: tree.get_nodes_at_depth(session, 3),
+        "find_path (leaf to root)": lambda: tree.find_path(session, leaf_id, node_ids[0]),
+        "get_by_tag": lambda: tree.get_by_tag(session, "v1"),
+    }
+
+
+def measure(engine, tree_id, repeat):
+    session = sessionmaker(bind=engine)()
+    tree = Tree.get(session, tree_id)
+    node_ids = [id for (id,) in session.query(TreeNode.id).filter_by(tree_id=tree_id).order_by(TreeNode.id)]
+    leaf_id = node_ids[-1]
+    rng = random.Random(0)
+    totals = {}
+    for _ in range(repeat):
+        for name, query in queries(session, tree, node_ids[: len(node_ids) // 4], leaf_id, rng).items():
+            start = time.perf_counter()
+            query()
+            totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+            session.expunge_all()
+            tree = Tree.get(session, tree_id)
+    session.close()
+    return {name: total / repeat for name, total in totals.items()}
+
+
+def main(argv):
+    size = int(argv[0]) if len(argv) > 0 else 100_000
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'database.db')}"
+        engine = make_engine(url)
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for name in MODEL_INDEXES:
+                connection.execute(text(f"DROP INDEX {name}"))
+        with sessionmaker(bind=engine)() as session:
+            tree = build_tree(session, size)
+            tree.create_tag(session, "v1")
+            tree_id = tree.id
+
+        before = measure(engine, tree_id, repeat)
+        engine.dispose()
+
+        engine = make_engine(url, sqlite_pragmas=SQLITE_PROFILES["production"])
+        upgrade(engine)
+        set_journal_mode(engine, "production")
+        after = measure(engine, tree_id, repeat)
+        engine.dispose()
+
+    print(f"{size} nodes, mean of {repeat} runs")
+    for name in before:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:>26}: {before[name] * 1000:9.1f} ms -> {after[name] * 1000:8.1f} ms ({speedup:.0f}x)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""
+Compare full-copy tag snapshots against delta-encoded snapshots with periodic
+keyframes and against version-ranged snapshot rows: total snapshot bytes (or
+rows), time to tag, time to load and restore the last tag, and time to look
+up one node in it.
+
+Usage:
+    python -m benchmarks.bench_snapshots [size] [tags] [changes_per_tag]
+"""
+import random
+import sys
+import time
+from unittest import mock
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_copy import build_tree
+from tree_manager import Base, TreeNode, TreeTag, TreeTagNode
+from tree_manager import models
+
+
+def run(size, tags, changes, keyframe_interval, row_snapshots=False):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    tree = build_tree(session, size)
+    tree.row_snapshots = row_snapshots
+    node_ids = [node_id for (node_id,) in session.query(TreeNode.id).filter_by(tree_id=tree.id)]
+    rng = random.Random(0)
+
+    tag_time = 0.0
+    with mock.patch.object(models, "SNAPSHOT_KEYFRAME_INTERVAL", keyframe_interval):
+        for i in range(tags):
+            for node_id in rng.sample(node_ids, changes):
+                session.execute(
+                    update(TreeNode.__table__).where(TreeNode.id == node_id).values(data={"name": f"node {node_id}", "rev": i})
+                )
+            session.commit()
+            start = time.perf_counter()
+            tree.create_tag(session, f"v{i}")
+            tag_time += time.perf_counter() - start
+
+    stored = sum(len(snapshot) for (snapshot,) in session.query(TreeTag.snapshot).filter_by(tree_id=tree.id))
+    stored_rows = session.query(TreeTagNode).filter_by(tree_id=tree.id).count()
+    last = session.query(TreeTag).filter_by(tree_id=tree.id, tag_name=f"v{tags - 1}").one()
+
+    start = time.perf_counter()
+    last.load_snapshot(session)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    last.get_node(session, node_ids[len(node_ids) // 2])
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree.restore_from_tag(session, last.tag_name)
+    restore_time = time.perf_counter() - start
+
+    session.close()
+    engine.dispose()
+    return {
+        "stored_bytes": stored,
+        "stored_rows": stored_rows,
+        "tag_seconds": tag_time / tags,
+        "load_seconds": load_time,
+        "lookup_seconds": lookup_time,
+        "restore_seconds": restore_time,
+    }
+
+
+def main(argv):
+    size = int(argv[0]) if len(argv) > 0 else 50_000
+    tags = int(argv[1]) if len(argv) > 1 else 24
+    changes = int(argv[2]) if len(argv) > 2 else 100
+    print(f"{size} nodes, {tags} tags, {changes} changed nodes per tag")
+    variants = (
+        ("full", 1, False),
+        ("delta", models.SNAPSHOT_KEYFRAME_INTERVAL, False),
+        ("rows", models.SNAPSHOT_KEYFRAME_INTERVAL, True),
+    )
+    for label, interval, row_snapshots in variants:
+        results = run(size, tags, changes, interval, row_snapshots)
+        stored = (
+            f"{results['stored_rows']:8d} node rows"
+            if row_snapshots
+            else f"{results['stored_bytes'] / 1e6:8.1f} MB stored"
+        )
+        print(
+            f"{label:>6}: {stored}  "
+            f"tag {results['tag_seconds'] * 1000:7.1f} ms  "
+            f"load last {results['load_seconds'] * 1000:7.1f} ms  "
+            f"restore last {results['restore_seconds'] * 1000:7.1f} ms  "
+            f"get_node {results['lookup_seconds'] * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
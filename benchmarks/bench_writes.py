@@ -0,0 +1,68 @@
+"""
+Compare importing a tree through the per-row ``add_node`` / ``add_edge`` API
+against the batched ``add_nodes`` / ``add_edges`` API.
+
+Usage:
+    python -m benchmarks.bench_writes [size ...]
+
+Both runs use a file database, since commit cost is what the per-row path pays
+for. The per-row import is only run for sizes up to ``PER_ROW_LIMIT``.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager import Base, Tree
+
+DEFAULT_SIZES = [2_000, 10_000, 100_000]
+PER_ROW_LIMIT = 2_000
+
+
+def per_row_import(session, tree, size, fanout=4):
+    nodes = [tree.add_node(session, data={"name": f"node {i}", "value": i}) for i in range(size)]
+    for i in range(1, size):
+        tree.add_edge(session, nodes[(i - 1) // fanout].id, nodes[i].id, data={"relation": "child"})
+
+
+def batched_import(session, tree, size, fanout=4):
+    node_ids = tree.add_nodes(session, [{"name": f"node {i}", "value": i} for i in range(size)])
+    tree.add_edges(
+        session, [(node_ids[(i - 1) // fanout], node_ids[i], {"relation": "child"}) for i in range(1, size)]
+    )
+
+
+def run(size, import_tree):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        tree = Tree(name=f"bench_{size}")
+        session.add(tree)
+        session.commit()
+
+        start = time.perf_counter()
+        import_tree(session, tree, size)
+        elapsed = time.perf_counter() - start
+
+        session.close()
+        engine.dispose()
+    return elapsed
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or DEFAULT_SIZES
+    for size in sizes:
+        batched = run(size, batched_import)
+        line = f"{size:>9} nodes  batched {batched:.2f}s"
+        if size <= PER_ROW_LIMIT:
+            per_row = run(size, per_row_import)
+            line += f"  per row {per_row:.2f}s ({per_row / batched:.0f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
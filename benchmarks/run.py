@@ -0,0 +1,500 @@
+"""
+Timed scenarios for every ``Tree`` method on generated trees, reporting latency
+percentiles, queries per call and peak Python memory.
+
+Usage:
+    python -m benchmarks.run [--shape balanced ...] [--size 10000 ...] [--repeat 50]
+                             [--bulk-repeat 3] [--only name ...] [--output run.json]
+                             [--baseline old.json] [--url database_url] [--no-memory]
+                             [--payload-index key ...]
+
+Point scenarios (single-node reads and small writes) run ``--repeat`` times
+against random nodes; bulk scenarios (tagging, branching, restoring, diffs,
+export, import, merges and ``find_path``) run ``--bulk-repeat`` times. The session is
+cleared before every call, so no call is served from the identity map of the
+previous one.
+
+Peak memory is measured with ``tracemalloc`` in one extra call per scenario,
+outside the timed calls, since tracing slows Python down several times.
+
+``--output`` writes the results as JSON, and ``--baseline`` prints the change in
+median latency against an earlier JSON run, e.g. one taken on another commit.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload, sessionmaker
+
+from benchmarks.generate import SHAPES, generate_tree
+from tree_manager import Base, Tree, TreeNode
+from tree_manager.changelog import latest_seq, tail_changes
+from tree_manager.database import make_engine
+from tree_manager.search import create_payload_index
+
+DEFAULT_SIZES = [10_000]
+DEFAULT_REPEAT = 50
+DEFAULT_BULK_REPEAT = 3
+
+# Nodes and edges written by the batch write scenarios.
+BATCH_SIZE = 100
+
+PERCENTILES = (50, 90, 99)
+
+# Aggregates maintained by the copy of the tree the aggregate scenarios use.
+BENCH_AGGREGATES = {"descendants": "count", "height": "height"}
+
+
+class NullWriter:
+    """Binary sink for the export scenario, so the output is not kept in memory."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class Context:
+    """
+    State shared by the scenarios of one run: the tree under test, its node
+    IDs, and the tags and trees the bulk scenarios compare against.
+    """
+
+    def __init__(self, session, tree, seed):
+        self.session = session
+        self.tree_id = tree.id
+        self.rng = random.Random(seed)
+        self.counter = 0
+        self.node_ids = [id for (id,) in session.query(TreeNode.id).filter_by(tree_id=tree.id).order_by(TreeNode.id)]
+        self.root_id = self.node_ids[0]
+
+        tree.create_tag(session, "bench_v1")
+        tree.apply_changeset(
+            session,
+            {
+                "updates": {id: {"changed": True} for id in self.node_ids[1:BATCH_SIZE]},
+                "nodes": [{"name": f"new {i}"} for i in range(BATCH_SIZE)],
+                "edges": [(self.root_id, -i - 1) for i in range(BATCH_SIZE)],
+            },
+        )
+        tree.create_tag(session, "bench_v2")
+        other = tree.create_new_tree_version_from_tag(session, "bench_v1")
+        other.create_tag(session, "bench_v1")
+        self.other_tree_id = other.id
+        self.other_node_ids = [
+            id for (id,) in session.query(TreeNode.id).filter_by(tree_id=other.id).order_by(TreeNode.id)
+        ]
+        aggregated = tree.create_new_tree_version_from_tag(session, "bench_v1")
+        aggregated.enable_aggregates(session, BENCH_AGGREGATES)
+        self.aggregated_tree_id = aggregated.id
+        self.aggregated_node_ids = [
+            id for (id,) in session.query(TreeNode.id).filter_by(tree_id=aggregated.id).order_by(TreeNode.id)
+        ]
+        # A copy-on-write branch logging its writes, for the change log
+        # scenarios. It shares its nodes with the copy of bench_v1 rather
+        # than with the tree, whose shared nodes could no longer be updated.
+        logged = other.create_new_tree_version_from_tag(session, "bench_v1", copy_on_write=True)
+        logged.log_changes = True
+        session.commit()
+        self.logged_tree_id = logged.id
+        # Nodes of the copy the logged branch has copied (and no longer sees).
+        self.copied = set()
+        self.export = io.BytesIO()
+        tree.export(session, self.export)
+        self.refresh()
+
+    def refresh(self):
+        self.session.expunge_all()
+        self.tree = Tree.get(self.session, self.tree_id)
+        self.aggregated_tree = Tree.get(self.session, self.aggregated_tree_id)
+        self.logged_tree = Tree.get(self.session, self.logged_tree_id)
+
+    def node(self):
+        return self.rng.choice(self.node_ids)
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f"{prefix}_{self.counter}"
+
+
+def _on_random_node(method, *args, **kwargs):
+    """Scenario calling ``Tree.<method>(session, *args, node_id, **kwargs)`` for a random node."""
+
+    def prepare(ctx):
+        node_id = ctx.node()
+        bound = getattr(ctx.tree, method)
+        resolved = [ctx.root_id if arg is ROOT else arg for arg in args]
+        return lambda: bound(ctx.session, *resolved, node_id, **kwargs)
+
+    return prepare
+
+
+# Placeholder for the root node ID in ``_on_random_node`` arguments.
+ROOT = object()
+
+
+def _call(method, *args, **kwargs):
+    """Scenario calling ``Tree.<method>(session, *args, **kwargs)``."""
+    return lambda ctx: lambda: getattr(ctx.tree, method)(ctx.session, *args, **kwargs)
+
+
+def _create_tag(ctx):
+    name = ctx.unique("tag")
+    return lambda: ctx.tree.create_tag(ctx.session, name)
+
+
+def _add_edge(ctx):
+    # Parent before child, so the new edges never close a cycle.
+    incoming, outgoing = sorted(ctx.rng.sample(ctx.node_ids, 2))
+    return lambda: ctx.tree.add_edge(ctx.session, incoming, outgoing)
+
+
+def _add_edges(ctx):
+    new_ids = ctx.tree.add_nodes(ctx.session, [{"name": f"batch {i}"} for i in range(BATCH_SIZE)])
+    edges = [(ctx.node(), id) for id in new_ids]
+    return lambda: ctx.tree.add_edges(ctx.session, edges)
+
+
+def _apply_changeset(ctx):
+    changeset = {
+        "updates": {ctx.node(): {"changed": ctx.unique("change")} for _ in range(10)},
+        "nodes": [{"name": f"change {i}"} for i in range(10)],
+        "edges": [(ctx.node(), -i - 1) for i in range(10)],
+    }
+    return lambda: ctx.tree.apply_changeset(ctx.session, changeset)
+
+
+def _diff_trees(ctx):
+    other = Tree.get(ctx.session, ctx.other_tree_id)
+    return lambda: ctx.tree.diff_trees(ctx.session, other)
+
+
+def _export(ctx):
+    return lambda: ctx.tree.export(ctx.session, NullWriter())
+
+
+def _import(ctx):
+    ctx.export.seek(0)
+    return lambda: Tree.import_(ctx.session, ctx.export)
+
+
+def _whole_tree(**kwargs):
+    """Scenario loading every node below the root with ``get_descendants``."""
+    return lambda ctx: lambda: ctx.tree.get_descendants(ctx.session, ctx.root_id, **kwargs)
+
+
+def _find_nodes(ctx):
+    # Generated nodes carry their position as "value".
+    value = ctx.rng.randrange(len(ctx.node_ids))
+    return lambda: ctx.tree.find_nodes(ctx.session, value=value)
+
+
+def _find_nodes_under(ctx):
+    node_id, value = ctx.node(), ctx.rng.randrange(len(ctx.node_ids))
+    return lambda: ctx.tree.find_nodes(ctx.session, under=node_id, value=[value, value + 1])
+
+
+def _get_aggregates(ctx):
+    node_id = ctx.rng.choice(ctx.aggregated_node_ids)
+    return lambda: ctx.aggregated_tree.get_aggregates(ctx.session, node_id)
+
+
+def _add_edge_with_aggregates(ctx):
+    incoming, outgoing = sorted(ctx.rng.sample(ctx.aggregated_node_ids, 2))
+    return lambda: ctx.aggregated_tree.add_edge(ctx.session, incoming, outgoing)
+
+
+def _add_node_with_change_log(ctx):
+    return lambda: ctx.logged_tree.add_node(ctx.session, {"name": "added"})
+
+
+def _apply_changeset_with_change_log(ctx):
+    changeset = {
+        "nodes": [{"name": f"change {i}"} for i in range(10)],
+        "edges": [(ctx.rng.choice(ctx.other_node_ids[:BATCH_SIZE]), -i - 1) for i in range(10)],
+    }
+    return lambda: ctx.logged_tree.apply_changeset(ctx.session, changeset)
+
+
+def _apply_changeset_copy_on_write(ctx):
+    # Updates of shared nodes, which copy them and their edges into the branch
+    # and hide the originals from it.
+    picked = ctx.rng.sample([id for id in ctx.other_node_ids if id not in ctx.copied], 10)
+    ctx.copied.update(picked)
+    changeset = {"updates": {id: {"changed": ctx.unique("copy")} for id in picked}}
+    return lambda: ctx.logged_tree.apply_changeset(ctx.session, changeset)
+
+
+def _branch_copy_on_write(ctx):
+    other = Tree.get(ctx.session, ctx.other_tree_id)
+    return lambda: other.create_new_tree_version_from_tag(ctx.session, "bench_v1", copy_on_write=True)
+
+
+def _tail_changes(ctx):
+    # The latest BATCH_SIZE changes; runs after the change log scenarios.
+    since_seq = max(latest_seq(ctx.session) - BATCH_SIZE, 0)
+    return lambda: list(tail_changes(ctx.session, since_seq))
+
+
+def _enable_aggregates(ctx):
+    copy = ctx.tree.create_new_tree_version_from_tag(ctx.session, "bench_v1")
+    return lambda: copy.enable_aggregates(ctx.session, BENCH_AGGREGATES)
+
+
+def _recompute_aggregates(ctx):
+    return lambda: ctx.aggregated_tree.recompute_aggregates(ctx.session)
+
+
+def _merge(ctx):
+    branch = ctx.tree.create_new_tree_version_from_tag(ctx.session, "bench_v1")
+    branch_ids = [id for (id,) in ctx.session.query(TreeNode.id).filter_by(tree_id=branch.id).order_by(TreeNode.id)]
+    picked = ctx.rng.sample(branch_ids, 10)
+    branch.apply_changeset(
+        ctx.session,
+        {
+            "updates": {id: {"merged": ctx.unique("merge")} for id in picked},
+            "nodes": [{"name": f"merged {i}"} for i in range(10)],
+            "edges": [(id, -i - 1) for i, id in enumerate(picked)],
+        },
+    )
+    return lambda: ctx.tree.merge(ctx.session, branch, "bench_v1", resolve="source")
+
+
+def _enable_closure_index(ctx):
+    copy = ctx.tree.create_new_tree_version_from_tag(ctx.session, "bench_v1")
+    return lambda: copy.enable_closure_index(ctx.session)
+
+
+# (name, kind, prepare). ``prepare(ctx)`` runs untimed and returns the call to
+# time; "point" scenarios run ``--repeat`` times, "bulk" ones ``--bulk-repeat``.
+# The reads come first, while the tree still has its generated shape; the
+# random edges added by the write scenarios turn any shape into a DAG.
+SCENARIOS = [
+    ("get_node", "point", _on_random_node("get_node")),
+    ("get_child_nodes", "point", _on_random_node("get_child_nodes")),
+    ("get_child_nodes (raw)", "point", _on_random_node("get_child_nodes", raw=True)),
+    ("get_parent_nodes", "point", _on_random_node("get_parent_nodes")),
+    ("get_node_edges", "point", _on_random_node("get_node_edges")),
+    ("get_ancestors", "point", _on_random_node("get_ancestors")),
+    ("get_descendants", "point", _on_random_node("get_descendants")),
+    ("get_descendants (raw)", "point", _on_random_node("get_descendants", raw=True)),
+    ("get_descendants (whole tree)", "bulk", _whole_tree()),
+    ("get_descendants (whole tree, raw)", "bulk", _whole_tree(raw=True)),
+    (
+        "get_descendants (whole tree, selectinload)",
+        "bulk",
+        _whole_tree(load=selectinload(TreeNode.incoming_edges)),
+    ),
+    ("get_subtree_size", "point", _on_random_node("get_subtree_size")),
+    ("is_ancestor", "point", _on_random_node("is_ancestor", ROOT)),
+    ("traverse_tree", "point", _on_random_node("traverse_tree")),
+    # find_path reads every node within the path's length of its start node,
+    # around cycles too, so it runs with the bulk scenarios.
+    ("find_path", "bulk", _on_random_node("find_path", ROOT)),
+    ("get_root_nodes", "bulk", _call("get_root_nodes")),
+    ("get_nodes_at_depth", "bulk", _call("get_nodes_at_depth", 3)),
+    ("get_by_tag", "point", _call("get_by_tag", "bench_v1")),
+    ("node_history", "point", _on_random_node("node_history")),
+    ("subtree_history", "point", _on_random_node("subtree_history")),
+    ("get_aggregates", "point", _get_aggregates),
+    ("find_nodes", "point", _find_nodes),
+    ("find_nodes (under)", "point", _find_nodes_under),
+    ("find_edges", "point", _call("find_edges", relation="missing")),
+    ("add_node", "point", _call("add_node", {"name": "added"})),
+    ("add_edge", "point", _add_edge),
+    ("add_edge (aggregates)", "point", _add_edge_with_aggregates),
+    ("add_nodes", "point", _call("add_nodes", [{"name": "batch"}] * BATCH_SIZE)),
+    ("add_edges", "point", _add_edges),
+    ("apply_changeset", "point", _apply_changeset),
+    ("add_node (change log)", "point", _add_node_with_change_log),
+    ("apply_changeset (change log)", "point", _apply_changeset_with_change_log),
+    ("apply_changeset (copy-on-write updates)", "point", _apply_changeset_copy_on_write),
+    ("tail_changes", "point", _tail_changes),
+    ("create_tag", "bulk", _create_tag),
+    ("create_new_tree_version_from_tag", "bulk", _call("create_new_tree_version_from_tag", "bench_v1")),
+    # Off the copy of bench_v1, as the tree's shared nodes could no longer
+    # be updated or merged into.
+    ("create_new_tree_version_from_tag (copy_on_write)", "bulk", _branch_copy_on_write),
+    ("restore_from_tag", "bulk", _call("restore_from_tag", "bench_v1")),
+    ("diff_tags", "bulk", _call("diff_tags", "bench_v1", "bench_v2")),
+    ("diff_trees", "bulk", _diff_trees),
+    ("merge", "bulk", _merge),
+    ("export", "bulk", _export),
+    ("import_", "bulk", _import),
+    ("enable_closure_index", "bulk", _enable_closure_index),
+    ("enable_aggregates", "bulk", _enable_aggregates),
+    ("recompute_aggregates", "bulk", _recompute_aggregates),
+]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, queries, peak_memory):
+    latencies = sorted(latencies)
+    result = {f"p{p}_ms": percentile(latencies, p) * 1000 for p in PERCENTILES}
+    result.update(
+        {
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "calls": len(latencies),
+            "queries_per_call": sum(queries) / len(queries),
+            "peak_memory_kib": None if peak_memory is None else peak_memory / 1024,
+        }
+    )
+    return result
+
+
+def run_scenario(ctx, engine, prepare, calls, measure_memory):
+    counter = {"queries": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["queries"] += 1
+
+    latencies, queries = [], []
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        for _ in range(calls):
+            ctx.refresh()
+            call = prepare(ctx)
+            counter["queries"] = 0
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+            queries.append(counter["queries"])
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    peak_memory = None
+    if measure_memory:
+        ctx.refresh()
+        call = prepare(ctx)
+        tracemalloc.start()
+        try:
+            call()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return summarize(latencies, queries, peak_memory)
+
+
+def run(engine, shape, size, repeat, bulk_repeat, seed=0, only=None, measure_memory=True):
+    """
+    Generate a tree and run the scenarios against it.
+
+    Returns:
+        dict: ``{scenario name: summary}`` in scenario order.
+    """
+    session = sessionmaker(bind=engine)()
+    try:
+        ctx = Context(session, generate_tree(session, shape, size, seed=seed), seed)
+        results = {}
+        for name, kind, prepare in SCENARIOS:
+            if only and name not in only:
+                continue
+            calls = repeat if kind == "point" else bulk_repeat
+            results[name] = run_scenario(ctx, engine, prepare, calls, measure_memory)
+    finally:
+        session.close()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def print_results(shape, size, results, baseline=None):
+    print(f"\n{shape}, {size} nodes")
+    print(f"{'scenario':>48} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}")
+    for name, result in results.items():
+        memory = "-" if result["peak_memory_kib"] is None else f"{result['peak_memory_kib']:.0f}"
+        line = (
+            f"{name:>48} {result['p50_ms']:9.2f} {result['p90_ms']:9.2f} {result['p99_ms']:9.2f}"
+            f" {result['queries_per_call']:8.1f} {memory:>9}"
+        )
+        old = (baseline or {}).get(name)
+        if old and old["p50_ms"]:
+            line += f"  {(result['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}% vs baseline"
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark the Tree methods.")
+    parser.add_argument("--shape", nargs="+", choices=SHAPES, default=["balanced"])
+    parser.add_argument("--size", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--bulk-repeat", type=int, default=DEFAULT_BULK_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", help="run only these scenarios")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against an earlier JSON run")
+    parser.add_argument("--url", help="database to run against; a temporary SQLite file by default")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--payload-index", nargs="+", default=[], help="index these node payload keys first")
+    options = parser.parse_args(argv)
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as fp:
+            for entry in json.load(fp)["runs"]:
+                baseline[entry["shape"], entry["size"]] = entry["scenarios"]
+
+    report = {"environment": environment(), "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for shape in options.shape:
+            for size in options.size:
+                url = options.url or f"sqlite:///{os.path.join(tmp, f'{shape}_{size}.db')}"
+                engine = make_engine(url)
+                Base.metadata.create_all(engine)
+                for key in options.payload_index:
+                    create_payload_index(engine, "node", key)
+                results = run(
+                    engine,
+                    shape,
+                    size,
+                    options.repeat,
+                    options.bulk_repeat,
+                    seed=options.seed,
+                    only=options.only,
+                    measure_memory=not options.no_memory,
+                )
+                engine.dispose()
+                report["runs"].append({"shape": shape, "size": size, "scenarios": results})
+                print_results(shape, size, results, baseline.get((shape, size)))
+
+    if options.output:
+        with open(options.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,7 +4,11 @@ setup(
     name="tree-manager",
     version="0.1.0",
     packages=find_packages(),
-    install_requires=["sqlalchemy"],
+    install_requires=["sqlalchemy>=2.0"],
+    extras_require={
+        "msgpack": ["msgpack"],
+        "async": ["sqlalchemy[asyncio]>=2.0", "aiosqlite"],
+    },
     description="A tree structure management library for SQL databases.",
     author="Your Name",
     author_email="saswatxenon@gmail.com",
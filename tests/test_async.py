@@ -0,0 +1,71 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from tree_manager import Base, Tree
+from tree_manager.database import SQLITE_CONCURRENT_PRAGMAS
+
+HAS_ASYNC = all(importlib.util.find_spec(name) for name in ("aiosqlite", "greenlet"))
+
+
+@unittest.skipUnless(HAS_ASYNC, "aiosqlite and greenlet are required")
+class TestAsyncTree(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from tree_manager.database import make_async_engine, make_async_sessionmaker
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = make_async_engine(
+            f"sqlite+aiosqlite:///{os.path.join(self.tmp.name, 'trees.db')}",
+            sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS,
+        )
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.Session = make_async_sessionmaker(self.engine)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        self.tmp.cleanup()
+
+    async def test_same_methods_as_tree(self):
+        from tree_manager.aio import AsyncTree
+
+        async with self.Session() as session:
+            session.add(Tree(name="Async Tree"))
+            await session.commit()
+            tree = await AsyncTree.get(session, 1)
+            self.assertEqual(tree.name, "Async Tree")
+
+            root = await tree.add_node(session, {"name": "Root"})
+            child_ids = await tree.add_nodes(session, [{"name": "Child 1"}, {"name": "Child 2"}])
+            await tree.add_edges(session, [(root.id, child_id) for child_id in child_ids])
+            children = await tree.get_child_nodes(session, root.id)
+            self.assertEqual([node.data["name"] for node in children], ["Child 1", "Child 2"])
+            self.assertEqual(len((await tree.traverse_tree(session, root.id))["nodes"]), 3)
+
+            await tree.create_tag(session, "v1")
+            branch = await tree.create_new_tree_version_from_tag(session, "v1", copy_on_write=True)
+            self.assertIsInstance(branch, AsyncTree)
+            diff = await tree.diff_trees(session, branch)
+            self.assertEqual(diff["nodes"], {"added": [], "removed": [], "modified": []})
+
+    async def test_concurrent_readers(self):
+        import asyncio
+        from tree_manager.aio import AsyncTree
+
+        async with self.Session() as session:
+            session.add(Tree(name="Async Tree"))
+            await session.commit()
+            tree = await AsyncTree.get(session, 1)
+            node_ids = await tree.add_nodes(session, [{"name": f"Node {i}"} for i in range(5)])
+            await tree.add_edges(session, [(node_ids[0], node_id) for node_id in node_ids[1:]])
+
+        async def reader():
+            async with self.Session() as session:
+                tree = await AsyncTree.get(session, 1)
+                return len(await tree.get_child_nodes(session, node_ids[0]))
+
+        self.assertEqual(await asyncio.gather(*(reader() for _ in range(10))), [4] * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
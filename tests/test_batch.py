@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeEdge, TreeTag
+from tree_manager.batch import check_tree, run_batch
+
+
+def count_nodes(session, tree):
+    return len(tree.nodes)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.url = f"sqlite:///{os.path.join(self.directory, 'trees.db')}"
+        self.engine = create_engine(self.url)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.tree_ids = []
+        for i in range(5):
+            tree = Tree(name=f"Tree {i}")
+            self.session.add(tree)
+            self.session.commit()
+            ids = tree.add_nodes(self.session, [{"name": f"Node {j}"} for j in range(i + 2)])
+            tree.add_edges(self.session, [(ids[0], child) for child in ids[1:]])
+            self.tree_ids.append(tree.id)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_create_tag(self):
+        seen = []
+        for workers in (1, 2):
+            report = run_batch(
+                self.url,
+                "create_tag",
+                tree_ids=self.tree_ids + [999],
+                workers=workers,
+                chunk_size=2,
+                progress=lambda done, total: seen.append((done, total)),
+                tag_name="nightly",
+            )
+            self.assertEqual(sorted(report["results"]), [] if workers == 2 else self.tree_ids)
+            self.assertEqual(report["errors"][999], "ValueError: No tree found with ID: 999.")
+        # The second run finds every tag already there.
+        self.assertEqual(len(report["errors"]), 6)
+        self.assertIn("already exists", report["errors"][self.tree_ids[0]])
+        self.assertEqual(seen[-1], (6, 6))
+        self.assertEqual(self.session.query(TreeTag).filter_by(tag_name="nightly").count(), 5)
+
+    def test_export_diff_and_custom_operations(self):
+        report = run_batch(self.url, "export", workers=2, directory=self.directory)
+        self.assertEqual(report["errors"], {})
+        self.assertEqual(report["results"][self.tree_ids[2]]["nodes"], 4)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"tree_{self.tree_ids[2]}.ndjson")))
+
+        for tree_id in self.tree_ids:
+            tree = Tree.get(self.session, tree_id)
+            tree.create_tag(self.session, "v1")
+            tree.add_node(self.session, {"name": "Extra"})
+            tree.create_tag(self.session, "v2")
+        report = run_batch(self.url, "diff_tags", workers=2, tag_a="v1", tag_b="v2")
+        self.assertEqual(report["results"][self.tree_ids[0]]["nodes"], {"added": 1, "removed": 0, "modified": 0})
+
+        report = run_batch(self.url, count_nodes, tree_ids=self.tree_ids, workers=2)
+        self.assertEqual([report["results"][tree_id] for tree_id in self.tree_ids], [3, 4, 5, 6, 7])
+
+        with self.assertRaises(ValueError):
+            run_batch("sqlite://", "check")
+        with self.assertRaises(ValueError):
+            run_batch(self.url, "vacuum")
+
+    def test_check(self):
+        tree = Tree.get(self.session, self.tree_ids[1])
+        other = Tree.get(self.session, self.tree_ids[2])
+        stray = TreeEdge(
+            tree_id=tree.id, incoming_node_id=tree.nodes[0].id, outgoing_node_id=other.nodes[0].id, data={}
+        )
+        self.session.add(stray)
+        self.session.commit()
+        self.assertEqual(len(check_tree(self.session, tree)), 1)
+        self.assertEqual(check_tree(self.session, other), [])
+
+        report = run_batch(self.url, "check", workers=2)
+        self.assertEqual(list(report["errors"]), [tree.id])
+        self.assertIn(f"Edge {stray.id}", report["errors"][tree.id])
+        self.assertEqual(len(report["results"]), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from collections import Counter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from benchmarks.generate import SHAPES, edge_pairs, generate_tree
+from benchmarks.run import SCENARIOS, run
+from tree_manager import Base, TreeEdge
+from tree_manager.aio import TREE_METHODS
+
+
+class TestGenerator(unittest.TestCase):
+    def test_shapes(self):
+        self.assertEqual(list(edge_pairs("balanced", 6, fanout=2)), [(0, 1), (0, 2), (1, 3), (1, 4), (2, 5)])
+        self.assertEqual(list(edge_pairs("chain", 4)), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(list(edge_pairs("wide", 4)), [(0, 1), (0, 2), (0, 3)])
+
+        dag = list(edge_pairs("dag", 1000, seed=1))
+        self.assertEqual(dag, list(edge_pairs("dag", 1000, seed=1)))
+        self.assertTrue(all(parent < child for parent, child in dag))
+        self.assertEqual(len(set(dag)), len(dag))
+        parents = Counter(child for _, child in dag)
+        self.assertEqual(set(parents), set(range(1, 1000)))
+        self.assertGreater(max(parents.values()), 1)
+
+        with self.assertRaises(ValueError):
+            list(edge_pairs("ring", 10))
+
+    def test_generate_tree(self):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        for shape in SHAPES:
+            tree = generate_tree(session, shape, 50)
+            self.assertEqual(len(tree.nodes), 50)
+            self.assertEqual(
+                session.query(TreeEdge).filter_by(tree_id=tree.id).count(), len(list(edge_pairs(shape, 50)))
+            )
+            self.assertEqual(len(tree.get_root_nodes(session)), 1)
+        session.close()
+        engine.dispose()
+
+
+class TestRunner(unittest.TestCase):
+    def test_every_tree_method_has_a_scenario(self):
+        names = {name.split(" ")[0] for name, _, _ in SCENARIOS}
+        self.assertEqual(set(TREE_METHODS) - names, set())
+        self.assertIn("import_", names)
+
+    def test_run(self):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        results = run(engine, "balanced", 60, repeat=2, bulk_repeat=1, measure_memory=False)
+        self.assertEqual(list(results), [name for name, _, _ in SCENARIOS])
+        self.assertEqual(results["get_node"]["calls"], 2)
+        self.assertEqual(results["get_node"]["queries_per_call"], 1)
+        self.assertEqual(results["export"]["calls"], 1)
+        self.assertLessEqual(results["get_child_nodes"]["p50_ms"], results["get_child_nodes"]["p99_ms"])
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
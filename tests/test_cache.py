@@ -0,0 +1,97 @@
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeGraphCache, set_graph_cache
+
+
+class TestTreeGraphCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+        self.cache = TreeGraphCache(max_trees=2)
+        set_graph_cache(self.cache)
+
+    def tearDown(self):
+        set_graph_cache(None)
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def _build_tree(self):
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+
+        nodes = [tree.add_node(self.session, data={"name": f"Node {i}"}) for i in range(1, 5)]
+        for parent, child in [(0, 1), (0, 2), (1, 3)]:
+            tree.add_edge(self.session, incoming_node_id=nodes[parent].id, outgoing_node_id=nodes[child].id)
+        return tree, nodes
+
+    def _count_queries(self, fn):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            result = fn()
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        return result, len(statements)
+
+    def test_lookups_match_database(self):
+        tree, nodes = self._build_tree()
+
+        def lookups():
+            return (
+                [node.id for node in tree.get_child_nodes(self.session, nodes[0].id)],
+                [node.id for node in tree.get_parent_nodes(self.session, nodes[3].id)],
+                sorted(edge.id for edge in tree.get_node_edges(self.session, nodes[1].id)),
+                tree.get_child_nodes(self.session, nodes[3].id),
+            )
+
+        cached = lookups()
+        set_graph_cache(None)
+        self.assertEqual(lookups(), cached)
+        self.assertEqual(cached[:2], ([nodes[1].id, nodes[2].id], [nodes[1].id]))
+
+    def test_hits_are_served_from_memory(self):
+        tree, nodes = self._build_tree()
+        tree.get_child_nodes(self.session, nodes[0].id)
+
+        children, queries = self._count_queries(lambda: tree.get_child_nodes(self.session, nodes[0].id))
+        self.assertEqual(queries, 0)
+        self.assertEqual(len(children), 2)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_add_edge_invalidates(self):
+        tree, nodes = self._build_tree()
+        self.assertEqual(tree.get_child_nodes(self.session, nodes[2].id), [])
+
+        tree.add_edge(self.session, incoming_node_id=nodes[2].id, outgoing_node_id=nodes[3].id)
+        self.assertEqual([node.id for node in tree.get_child_nodes(self.session, nodes[2].id)], [nodes[3].id])
+        self.assertEqual(len(tree.get_parent_nodes(self.session, nodes[3].id)), 2)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_lru_eviction(self):
+        trees = [self._build_tree() for _ in range(3)]
+        for tree, nodes in trees:
+            tree.get_child_nodes(self.session, nodes[0].id)
+        trees[2][0].get_child_nodes(self.session, trees[2][1][0].id)
+        trees[0][0].get_child_nodes(self.session, trees[0][1][0].id)
+
+        self.assertEqual(self.cache.stats(), {"trees": 2, "hits": 1, "misses": 4, "evictions": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
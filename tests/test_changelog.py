@@ -0,0 +1,132 @@
+import io
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeChange, TreeGraphCache
+from tree_manager.changelog import compact_changes, latest_seq, tail_changes
+
+
+class TestChangeLog(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def _build_tree(self, **options):
+        tree = Tree(name="Test Tree", log_changes=True, **options)
+        self.session.add(tree)
+        self.session.commit()
+        root = tree.add_node(self.session, {"name": "Root"})
+        ids = tree.add_nodes(self.session, [{"name": "Child 1"}, {"name": "Child 2"}])
+        edge = tree.add_edge(self.session, root.id, ids[0], {"relation": "child"})
+        tree.apply_changeset(
+            self.session, {"updates": {ids[1]: {"name": "Child 2 (changed)"}}, "edges": [(root.id, ids[1])]}
+        )
+        return tree, root.id, ids, edge.id
+
+    def test_tail(self):
+        for options in ({}, {"intern_payloads": True}):
+            tree, root_id, ids, edge_id = self._build_tree(**options)
+            changes = list(tail_changes(self.session, tree_id=tree.id))
+            self.assertEqual(
+                [change.op for change in changes], ["add_node", "apply_changeset", "add_edge", "apply_changeset"]
+            )
+            self.assertEqual(changes[0].payload, {"id": root_id, "data": {"name": "Root"}})
+            self.assertEqual(
+                changes[1].payload["nodes"], [{"id": ids[0], "data": {"name": "Child 1"}}, {"id": ids[1], "data": {"name": "Child 2"}}]
+            )
+            self.assertEqual(
+                changes[2].payload,
+                {"id": edge_id, "incoming_node_id": root_id, "outgoing_node_id": ids[0], "data": {"relation": "child"}},
+            )
+            self.assertEqual(changes[3].payload["updates"], [{"id": ids[1], "data": {"name": "Child 2 (changed)"}}])
+            self.assertEqual(len(changes[3].payload["edges"]), 1)
+            self.assertEqual([change.seq for change in changes], sorted(change.seq for change in changes))
+
+        # Resuming returns only the later changes, across batches.
+        self.assertEqual(
+            [change.seq for change in tail_changes(self.session, changes[1].seq, batch_size=1)],
+            [change.seq for change in changes[2:]],
+        )
+        self.assertEqual(latest_seq(self.session), changes[-1].seq)
+
+        # Branches, restores, imports and merges are logged for a reload.
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1")
+        restored = tree.restore_from_tag(self.session, "v1")
+        export = io.BytesIO()
+        tree.export(self.session, export)
+        export.seek(0)
+        imported = Tree.import_(self.session, export)
+        branch.add_node(self.session, {"name": "Branch node"})
+        tree.merge(self.session, branch)
+        ops = [(change.tree_id, change.op) for change in tail_changes(self.session, changes[-1].seq)]
+        self.assertEqual(
+            ops,
+            [
+                (branch.id, "create_tree"),
+                (restored.id, "create_tree"),
+                (imported.id, "create_tree"),
+                (branch.id, "add_node"),
+                (tree.id, "merge"),
+            ],
+        )
+        created = next(tail_changes(self.session, changes[-1].seq))
+        self.assertEqual(created.payload["source"], "branch")
+        self.assertEqual(created.payload["origin_tree_id"], tree.id)
+
+        # Trees without the flag, and failed writes, log nothing.
+        plain = Tree(name="Plain")
+        self.session.add(plain)
+        self.session.commit()
+        plain.add_node(self.session, {"name": "Node"})
+        seq = latest_seq(self.session)
+        with self.assertRaises(ValueError):
+            tree.add_edges(self.session, [(root_id, -1)])
+        self.assertEqual(latest_seq(self.session), seq)
+
+    def test_compact(self):
+        tree, root_id, ids, edge_id = self._build_tree()
+        seqs = [change.seq for change in tail_changes(self.session)]
+        self.assertEqual(compact_changes(self.session, seqs[2]), 2)
+        self.assertEqual(compact_changes(self.session, seqs[1]), 0)
+        self.assertEqual([change.seq for change in tail_changes(self.session, seqs[1])], seqs[2:])
+        with self.assertRaises(ValueError):
+            list(tail_changes(self.session, seqs[0]))
+
+        # Sequence numbers are not reused once everything is compacted.
+        self.assertEqual(compact_changes(self.session, latest_seq(self.session) + 10), 2)
+        self.assertEqual(list(tail_changes(self.session, seqs[-1])), [])
+        tree.add_node(self.session, {"name": "Later"})
+        (change,) = tail_changes(self.session, seqs[-1])
+        self.assertGreater(change.seq, seqs[-1] + 1)
+        self.assertEqual(self.session.query(TreeChange).filter(TreeChange.tree_id.is_(None)).count(), 1)
+
+    def test_cache_sync(self):
+        tree, root_id, ids, edge_id = self._build_tree()
+        other, *_ = self._build_tree()
+        cache = TreeGraphCache()
+        self.assertIsNone(cache.sync(self.session))
+        self.assertEqual(cache.graph(self.session, tree).child_ids(root_id), ids)
+
+        # Writes from another process only reach the cache through the log.
+        writer = sessionmaker(bind=self.engine)()
+        Tree.get(writer, tree.id).add_node(writer, {"name": "Unlinked"})
+        self.assertEqual(cache.sync(self.session), set())
+        added = Tree.get(writer, tree.id).add_nodes(writer, [{"name": "Child 3"}])
+        Tree.get(writer, tree.id).add_edge(writer, root_id, added[0])
+        Tree.get(writer, other.id).apply_changeset(writer, {"updates": {other.nodes[0].id: {"name": "Renamed"}}})
+        writer.close()
+        self.assertEqual(cache.sync(self.session), {tree.id})
+        self.assertEqual(cache.graph(self.session, tree).child_ids(root_id), ids + added)
+
+        compact_changes(self.session, latest_seq(self.session) + 1)
+        self.assertEqual(cache.sync(self.session), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeClosure
+from tree_manager.closure import check_closure, rebuild_closure
+from tree_manager.migrations import upgrade
+
+
+class TestClosureIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def _build_tree(self, closure_indexed):
+        tree = Tree(name="Test Tree", closure_indexed=closure_indexed)
+        self.session.add(tree)
+        self.session.commit()
+
+        nodes = [tree.add_node(self.session, data={"name": f"Node {i}"}) for i in range(1, 7)]
+        for parent, child in [(0, 1), (0, 2), (1, 3), (1, 4), (4, 5)]:
+            tree.add_edge(self.session, incoming_node_id=nodes[parent].id, outgoing_node_id=nodes[child].id)
+        return tree, nodes
+
+    def _answers(self, tree, nodes):
+        return (
+            [node.id for node in tree.get_ancestors(self.session, nodes[5].id)],
+            [node.id for node in tree.get_descendants(self.session, nodes[1].id)],
+            tree.get_subtree_size(self.session, nodes[0].id),
+            tree.get_subtree_size(self.session, nodes[2].id),
+            tree.is_ancestor(self.session, nodes[0].id, nodes[5].id),
+            tree.is_ancestor(self.session, nodes[2].id, nodes[5].id),
+            tree.is_ancestor(self.session, nodes[5].id, nodes[5].id),
+        )
+
+    def test_maintained_on_write(self):
+        tree, nodes = self._build_tree(closure_indexed=True)
+
+        self.assertEqual(check_closure(self.session, tree.id), {"missing": [], "unexpected": []})
+        self.assertEqual(
+            self._answers(tree, nodes),
+            (
+                [nodes[4].id, nodes[1].id, nodes[0].id],
+                [nodes[3].id, nodes[4].id, nodes[5].id],
+                6,
+                1,
+                True,
+                False,
+                False,
+            ),
+        )
+
+    def test_shortcut_edge(self):
+        # a -> b -> c -> d, then a -> d: the pair (a, d) moves up to depth 1.
+        for upsert in (True, False):
+            with mock.patch.dict("tree_manager.models.UPSERT_DIALECTS", clear=not upsert):
+                trees, results = [], []
+                for closure_indexed in (True, False):
+                    tree = Tree(name="Chain", closure_indexed=closure_indexed)
+                    self.session.add(tree)
+                    self.session.commit()
+                    ids = tree.add_nodes(self.session, [{"name": name} for name in "abcd"])
+                    tree.add_edges(self.session, [(ids[0], ids[1]), (ids[1], ids[2]), (ids[2], ids[3])])
+                    tree.add_edge(self.session, ids[0], ids[3])
+                    trees.append(tree)
+                    results.append([node.data["name"] for node in tree.get_ancestors(self.session, ids[3])])
+                self.assertEqual(check_closure(self.session, trees[0].id), {"missing": [], "unexpected": []})
+                self.assertEqual(results[0], results[1])
+                self.assertEqual(results[0][-1], "b")
+
+    def test_unindexed_tree_gives_same_answers(self):
+        indexed, indexed_nodes = self._build_tree(closure_indexed=True)
+        plain, plain_nodes = self._build_tree(closure_indexed=False)
+
+        positions = {node.id: i for i, node in enumerate(indexed_nodes)}
+        plain_positions = {node.id: i for i, node in enumerate(plain_nodes)}
+        expected = self._answers(indexed, indexed_nodes)
+        actual = self._answers(plain, plain_nodes)
+        self.assertEqual([positions[id] for id in expected[0]], [plain_positions[id] for id in actual[0]])
+        self.assertEqual([positions[id] for id in expected[1]], [plain_positions[id] for id in actual[1]])
+        self.assertEqual(expected[2:], actual[2:])
+        self.assertEqual(self.session.query(TreeClosure).filter_by(tree_id=plain.id).count(), 0)
+
+    def test_copies_keep_index(self):
+        tree, nodes = self._build_tree(closure_indexed=True)
+        tree.create_tag(self.session, "v1.0")
+
+        for copy in (
+            tree.create_new_tree_version_from_tag(self.session, "v1.0"),
+            tree.restore_from_tag(self.session, "v1.0"),
+        ):
+            self.assertTrue(copy.closure_indexed)
+            self.assertEqual(check_closure(self.session, copy.id), {"missing": [], "unexpected": []})
+            root = copy.get_root_nodes(self.session)[0]
+            self.assertEqual(copy.get_subtree_size(self.session, root.id), 6)
+
+    def test_rebuild_and_check(self):
+        tree, nodes = self._build_tree(closure_indexed=False)
+        self.assertEqual(rebuild_closure(self.session, tree.id), 6 + 5 + 4)
+        self.assertTrue(tree.closure_indexed)
+
+        self.session.query(TreeClosure).filter_by(ancestor_id=nodes[0].id, descendant_id=nodes[5].id).delete()
+        problems = check_closure(self.session, tree.id)
+        self.assertEqual(problems["missing"], [(nodes[0].id, nodes[5].id, 3)])
+        self.assertEqual(problems["unexpected"], [])
+
+
+class TestMigrations(unittest.TestCase):
+    def test_upgrade_adds_missing_schema(self):
+        engine = create_engine("sqlite:///:memory:")
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE tree (id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+                "created_at TIMESTAMP, PRIMARY KEY (id))"
+            ))
+            connection.execute(text("INSERT INTO tree (name) VALUES ('Legacy Tree')"))
+
+        changes = upgrade(engine)
+        self.assertIn("tree.closure_indexed", changes["columns"])
+        self.assertIn("tree_closure", inspect(engine).get_table_names())
+        self.assertEqual(upgrade(engine), {"columns": [], "indexes": [], "edges_backfilled": 0})
+
+        session = sessionmaker(bind=engine)()
+        self.assertFalse(session.query(Tree).one().closure_indexed)
+        session.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
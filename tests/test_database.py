@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree
+from tree_manager.database import SQLITE_CONCURRENT_PRAGMAS, init_db, make_engine
+from tree_manager.migrations import set_journal_mode, upgrade
+
+
+class TestEngineFactory(unittest.TestCase):
+    def test_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{os.path.join(tmp, 'trees.db')}"
+            engine = make_engine(url, pool_size=2, sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS)
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+            self.assertEqual(engine.pool.size(), 2)
+            engine.dispose()
+
+    def test_memory_url_ignores_pool_size(self):
+        engine = make_engine("sqlite:///:memory:", pool_size=5)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+
+    def test_init_db_production_profile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(f"sqlite:///{os.path.join(tmp, 'trees.db')}")
+            init_db(engine, profile="production")
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+                self.assertEqual(connection.exec_driver_sql("PRAGMA cache_size").scalar(), -65536)
+            indexes = [index["name"] for index in inspect(engine).get_indexes("tree_node")]
+            self.assertIn("ix_tree_node_tree_id", indexes)
+            engine.dispose()
+
+        with self.assertRaises(ValueError):
+            init_db(make_engine("sqlite:///:memory:"), profile="fast")
+
+    def test_upgrade_adds_indexes_to_existing_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(f"sqlite:///{os.path.join(tmp, 'database.db')}")
+            with engine.begin() as connection:
+                connection.execute(text(
+                    "CREATE TABLE tree_edge (id INTEGER NOT NULL, incoming_node_id INTEGER NOT NULL, "
+                    "outgoing_node_id INTEGER NOT NULL, data JSON, created_at TIMESTAMP, PRIMARY KEY (id))"
+                ))
+
+            changes = upgrade(engine)
+            self.assertIn("ix_tree_edge_incoming_node_id", changes["indexes"])
+            self.assertIn("ix_tree_edge_outgoing_node_id", changes["indexes"])
+            self.assertEqual(set_journal_mode(engine, "production"), "wal")
+            self.assertIsNone(set_journal_mode(engine, "default"))
+            engine.dispose()
+
+    def test_upgrade_backfills_edge_trees(self):
+        engine = make_engine("sqlite:///:memory:")
+        with engine.begin() as connection:
+            for statement in (
+                "CREATE TABLE tree (id INTEGER NOT NULL, name VARCHAR NOT NULL, created_at TIMESTAMP, PRIMARY KEY (id))",
+                "CREATE TABLE tree_node (id INTEGER NOT NULL, tree_id INTEGER NOT NULL, data JSON, "
+                "created_at TIMESTAMP, PRIMARY KEY (id))",
+                "CREATE TABLE tree_edge (id INTEGER NOT NULL, incoming_node_id INTEGER NOT NULL, "
+                "outgoing_node_id INTEGER NOT NULL, data JSON, created_at TIMESTAMP, PRIMARY KEY (id))",
+                "CREATE INDEX ix_tree_edge_incoming_node_id ON tree_edge (incoming_node_id)",
+                "INSERT INTO tree (id, name) VALUES (1, 'Legacy'), (2, 'Other')",
+                "INSERT INTO tree_node (id, tree_id, data) VALUES (1, 1, '{}'), (2, 1, '{}'), (3, 2, '{}'), (4, 2, '{}')",
+                "INSERT INTO tree_edge (incoming_node_id, outgoing_node_id, data) VALUES (1, 2, '{}'), (3, 4, '{}')",
+            ):
+                connection.execute(text(statement))
+
+        changes = upgrade(engine)
+        self.assertIn("tree_edge.tree_id", changes["columns"])
+        self.assertEqual(changes["edges_backfilled"], 2)
+        self.assertIn("ix_tree_edge_tree_id", changes["indexes"])
+        self.assertIn("ix_tree_edge_incoming_node_id", changes["indexes"])
+        indexes = {index["name"]: index["column_names"] for index in inspect(engine).get_indexes("tree_edge")}
+        self.assertEqual(indexes["ix_tree_edge_incoming_node_id"], ["incoming_node_id", "tree_id"])
+        self.assertEqual(upgrade(engine)["edges_backfilled"], 0)
+
+        session = sessionmaker(bind=engine)()
+        state = Tree.get(session, 2).diff_trees(session, Tree.get(session, 1))
+        self.assertEqual(len(state["edges"]["removed"]), 1)
+        self.assertEqual(len(state["edges"]["added"]), 1)
+        session.close()
+        engine.dispose()
+
+    def test_bulk_insert_holds_write_lock(self):
+        # The IDs of a batch insert come from max(id), which another
+        # connection must not be able to move before the batch commits.
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trees.db")
+            engine = make_engine(f"sqlite:///{path}")
+            Base.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            tree = Tree(name="Tree")
+            session.add(tree)
+            session.commit()
+            other = sqlite3.connect(path, timeout=0)
+            errors = []
+
+            def insert_concurrently(connection, cursor, statement, parameters, context, executemany):
+                if statement.startswith("SELECT coalesce(max(tree_node.id)") and not errors:
+                    try:
+                        other.execute("INSERT INTO tree_node (tree_id, data) VALUES (?, '{}')", (tree.id,))
+                        errors.append(None)
+                    except sqlite3.OperationalError as exc:
+                        errors.append(str(exc))
+
+            event.listen(engine, "before_cursor_execute", insert_concurrently)
+            try:
+                ids = tree.add_nodes(session, [{"name": "A"}, {"name": "B"}])
+            finally:
+                event.remove(engine, "before_cursor_execute", insert_concurrently)
+                other.close()
+                session.close()
+                engine.dispose()
+            self.assertEqual(errors, ["database is locked"])
+            self.assertEqual(ids, [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
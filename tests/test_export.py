@@ -0,0 +1,111 @@
+import io
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree
+from tree_manager import export
+
+
+class TestExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        cls.other_engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        Base.metadata.create_all(cls.other_engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+        cls.OtherSession = sessionmaker(bind=cls.other_engine)
+
+    def setUp(self):
+        self.session = self.Session()
+        self.other_session = self.OtherSession()
+
+    def tearDown(self):
+        for session in (self.session, self.other_session):
+            session.rollback()
+            session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.other_engine.dispose()
+
+    def _build_tree(self, intern_payloads=False):
+        tree = Tree(name="Test Tree", intern_payloads=intern_payloads)
+        self.session.add(tree)
+        self.session.commit()
+
+        node_ids = tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(1, 6)])
+        tree.add_edges(
+            self.session,
+            [
+                (node_ids[0], node_ids[1], {"relation": "child"}),
+                (node_ids[0], node_ids[2]),
+                (node_ids[2], node_ids[3]),
+            ],
+        )
+        return tree, node_ids
+
+    def _shape(self, session, tree):
+        root = tree.get_root_nodes(session)[0]
+        result = tree.traverse_tree(session, root.id)
+        return (
+            [(node["data"], node["depth"]) for node in result["nodes"]],
+            sorted(edge["data"].get("relation", "") for edge in result["edges"]),
+            sorted(node.data["name"] for node in tree.get_root_nodes(session)),
+        )
+
+    def _round_trip(self, tree, format, **kwargs):
+        fp = io.BytesIO()
+        counts = tree.export(self.session, fp, format=format, **kwargs)
+        fp.seek(0)
+        return counts, Tree.import_(self.other_session, fp)
+
+    def test_ndjson_round_trip_between_databases(self):
+        tree, _ = self._build_tree()
+        with mock.patch("tree_manager.models.BULK_BATCH_SIZE", 2):
+            with mock.patch("tree_manager.export.BULK_BATCH_SIZE", 2):
+                counts, copy = self._round_trip(tree, "ndjson")
+
+        self.assertEqual(counts, {"nodes": 5, "edges": 3})
+        self.assertEqual(copy.name, "Test Tree")
+        self.assertEqual(len(copy.nodes), 5)
+        self.assertEqual(self._shape(self.other_session, copy), self._shape(self.session, tree))
+
+    @unittest.skipUnless(export.msgpack, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        tree, _ = self._build_tree(intern_payloads=True)
+        counts, copy = self._round_trip(tree, "msgpack")
+
+        self.assertEqual(counts, {"nodes": 5, "edges": 3})
+        self.assertTrue(copy.intern_payloads)
+        self.assertEqual(self._shape(self.other_session, copy), self._shape(self.session, tree))
+
+    def test_export_tag(self):
+        tree, node_ids = self._build_tree()
+        tree.create_tag(self.session, "v1")
+        tree.add_node(self.session, data={"name": "Later"})
+
+        counts, copy = self._round_trip(tree, "ndjson", tag_name="v1")
+        self.assertEqual(counts, {"nodes": 5, "edges": 3})
+        self.assertEqual(copy.name, "Test Tree_v1")
+        self.assertNotIn("Later", [node.data["name"] for node in copy.nodes])
+
+    def test_import_rejects_bad_streams(self):
+        with self.assertRaises(ValueError):
+            Tree.import_(self.other_session, io.BytesIO(b'{"type": "node", "id": 1, "data": {}}\n'))
+        stream = io.BytesIO(
+            b'{"type": "tree", "version": 1, "name": "Broken"}\n'
+            b'{"type": "node", "id": 1, "data": {}}\n'
+            b'{"type": "edge", "id": 1, "incoming_node_id": 1, "outgoing_node_id": 2, "data": {}}\n'
+        )
+        with self.assertRaises(ValueError):
+            Tree.import_(self.other_session, stream)
+        self.assertEqual(self.other_session.query(Tree).filter_by(name="Broken").count(), 0)
+        with self.assertRaises(ValueError):
+            self._build_tree()[0].export(self.session, io.BytesIO(), format="xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, LoggingSink, MemorySink, PrometheusFileSink, Tree, set_instrumentation
+
+
+class RecordingSink:
+    def __init__(self):
+        self.calls = []
+
+    def record(self, call):
+        self.calls.append(call)
+
+
+class TestInstrumentation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+        self.tree = Tree(name="Test Tree")
+        self.session.add(self.tree)
+        self.session.commit()
+        self.node_ids = self.tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(4)])
+        self.tree.add_edges(self.session, [(self.node_ids[0], id) for id in self.node_ids[1:]])
+        self.sink = RecordingSink()
+        set_instrumentation(self.sink)
+
+    def tearDown(self):
+        set_instrumentation(None)
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def test_counts_statements_rows_and_objects(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            children = self.tree.get_child_nodes(self.session, self.node_ids[0])
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        (call,) = self.sink.calls
+        self.assertEqual(call["method"], "get_child_nodes")
+        self.assertEqual(call["tree_id"], self.tree.id)
+        self.assertEqual(call["statements"], len(statements))
+        # The three edges and their child nodes are loaded by a single query.
+        self.assertEqual(call["statements"], 1)
+        self.assertEqual(call["rows"], 3)
+        self.assertEqual(call["objects"], 6)
+        self.assertEqual(len(children), 3)
+        self.assertIsNone(call["error"])
+        self.assertGreater(call["seconds"], 0)
+
+    def test_nested_calls_count_once(self):
+        self.tree.add_nodes(self.session, [{"name": "More"}])
+        Tree.get(self.session, self.tree.id)
+        self.assertEqual([call["method"] for call in self.sink.calls], ["add_nodes", "get"])
+        self.assertIsNone(self.sink.calls[1]["tree_id"])
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            self.tree.add_edges(self.session, [(self.node_ids[0], 10**9)])
+        self.assertEqual(self.sink.calls[0]["error"], "ValueError")
+
+    def test_disabled(self):
+        set_instrumentation(None)
+        self.tree.get_root_nodes(self.session)
+        self.assertEqual(self.sink.calls, [])
+
+    def test_memory_sink(self):
+        sink = MemorySink()
+        set_instrumentation(sink)
+        for _ in range(3):
+            self.tree.get_root_nodes(self.session)
+        stats = sink.stats()["get_root_nodes"]
+        self.assertEqual(stats["calls"], 3)
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["statements"], 3)
+        self.assertEqual(stats["objects"], 3)
+        sink.reset()
+        self.assertEqual(sink.stats(), {})
+
+    def test_logging_sink(self):
+        set_instrumentation(LoggingSink())
+        with self.assertLogs("tree_manager") as logs:
+            self.tree.get_root_nodes(self.session)
+        self.assertIn(f"Tree.get_root_nodes tree={self.tree.id}: 1 statements", logs.output[0])
+
+        set_instrumentation(LoggingSink(min_seconds=60))
+        with self.assertNoLogs("tree_manager"):
+            self.tree.get_root_nodes(self.session)
+
+    def test_prometheus_file_sink(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tree_manager.prom")
+            sink = PrometheusFileSink(path, interval=3600)
+            set_instrumentation(sink)
+            self.tree.get_root_nodes(self.session)
+            self.tree.get_root_nodes(self.session)
+            with open(path) as fp:
+                self.assertIn('tree_manager_calls_total{method="get_root_nodes"} 1\n', fp.read())
+            sink.write()
+            with open(path) as fp:
+                text = fp.read()
+            self.assertIn("# TYPE tree_manager_calls_total counter", text)
+            self.assertIn('tree_manager_calls_total{method="get_root_nodes"} 2\n', text)
+            self.assertIn('tree_manager_statements_total{method="get_root_nodes"} 2\n', text)
+            self.assertEqual(os.listdir(tmp), ["tree_manager.prom"])
+
+
+if __name__ == "__main__":
+    unittest.main()
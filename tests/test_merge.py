@@ -0,0 +1,154 @@
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeEdge, TreeNode
+
+
+class TestMerge(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def _build(self, copy_on_write=False, **options):
+        tree = Tree(name="Test Tree", **options)
+        self.session.add(tree)
+        self.session.commit()
+        ids = tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(6)])
+        tree.add_edges(
+            self.session,
+            [(ids[0], ids[1]), (ids[0], ids[2]), (ids[1], ids[3]), (ids[1], ids[4]), (ids[4], ids[5])],
+        )
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=copy_on_write)
+        copies = {
+            node.origin_id or node.id: node.id
+            for node in self.session.query(TreeNode).filter(branch._node_filter())
+        }
+        return tree, branch, ids, [copies[id] for id in ids]
+
+    def _remove(self, tree, node_id):
+        self.session.query(TreeEdge).filter(
+            tree._edge_filter(), (TreeEdge.incoming_node_id == node_id) | (TreeEdge.outgoing_node_id == node_id)
+        ).delete(synchronize_session=False)
+        self.session.query(TreeNode).filter_by(id=node_id).delete(synchronize_session=False)
+        self.session.commit()
+
+    def _state(self, tree):
+        names = {node.id: node.data["name"] for node in self.session.query(TreeNode).filter(tree._node_filter())}
+        edges = self.session.query(TreeEdge).filter(tree._edge_filter())
+        return sorted(names.values()), sorted((names[edge.incoming_node_id], names[edge.outgoing_node_id]) for edge in edges)
+
+    def test_clean_merge(self):
+        for options in ({}, {"intern_payloads": True, "closure_indexed": True}):
+            tree, branch, ids, copies = self._build(**options)
+            self.assertEqual((branch.origin_tree_id, branch.origin_tag_id), (tree.id, tree.tags[0].id))
+
+            branch.apply_changeset(
+                self.session,
+                {
+                    "updates": {copies[3]: {"name": "Node 3 (branch)"}},
+                    "nodes": [{"name": "Node 6"}],
+                    "edges": [(copies[2], -1)],
+                },
+            )
+            self._remove(branch, copies[5])
+            tree.apply_changeset(self.session, {"updates": {ids[1]: {"name": "Node 1 (tree)"}}})
+
+            report = tree.merge(self.session, branch, "v1")
+            self.assertEqual(report["conflicts"], [])
+            self.assertTrue(report["applied"])
+            self.assertEqual(report["nodes"], {"added": 1, "modified": 1, "removed": 1})
+            self.assertEqual(report["edges"], {"added": 1, "modified": 0, "removed": 1})
+            nodes, edges = self._state(tree)
+            self.assertEqual(
+                nodes, ["Node 0", "Node 1 (tree)", "Node 2", "Node 3 (branch)", "Node 4", "Node 6"]
+            )
+            self.assertIn(("Node 2", "Node 6"), edges)
+            self.assertNotIn("Node 5", [name for edge in edges for name in edge])
+            self.assertEqual(
+                [node.id for node in tree.get_descendants(self.session, ids[2])],
+                [tree.find_nodes(self.session, name="Node 6")[0].id],
+            )
+
+            # Merging again finds nothing new.
+            report = tree.merge(self.session, branch)
+            self.assertEqual(report["nodes"], {"added": 0, "modified": 0, "removed": 0})
+            self.assertEqual(len(tree.nodes), 6)
+
+    def test_copy_on_write_branch(self):
+        tree, branch, ids, copies = self._build(copy_on_write=True)
+        self.assertEqual(copies, ids)
+        added = branch.add_node(self.session, {"name": "Node 6"})
+        branch.add_edge(self.session, ids[5], added.id)
+        report = tree.merge(self.session, branch)
+        self.assertEqual(report["nodes"]["added"], 1)
+        self.assertIn(("Node 5", "Node 6"), self._state(tree)[1])
+
+        # The branch's update copies the node, so the tree can take it; not
+        # while another branch still reads the node in place.
+        branch.apply_changeset(self.session, {"updates": {ids[1]: {"name": "Node 1 (branch)"}}})
+        tree.create_tag(self.session, "v2")
+        sibling = tree.create_new_tree_version_from_tag(self.session, "v2", copy_on_write=True)
+        with self.assertRaises(ValueError):
+            tree.merge(self.session, branch)
+        sibling.apply_changeset(self.session, {"updates": {ids[1]: {"name": "Node 1 (sibling)"}}})
+        report = tree.merge(self.session, branch)
+        self.assertEqual(report["nodes"]["modified"], 1)
+        self.assertIn(("Node 1 (branch)", "Node 4"), self._state(tree)[1])
+        self.assertIn(("Node 1 (sibling)", "Node 4"), self._state(sibling)[1])
+
+    def test_conflicts(self):
+        results = {}
+        for resolve in (None, "source", "branch"):
+            tree, branch, ids, copies = self._build()
+            tree.apply_changeset(
+                self.session, {"updates": {ids[3]: {"name": "Node 3 (tree)"}, ids[2]: {"name": "Node 2 (tree)"}}}
+            )
+            branch.apply_changeset(self.session, {"updates": {copies[3]: {"name": "Node 3 (branch)"}}})
+            self._remove(branch, copies[2])
+            # The tree adds an edge to a node the branch removes.
+            tree.add_edge(self.session, ids[5], ids[4])
+            self._remove(branch, copies[4])
+
+            report = tree.merge(self.session, branch, "v1", resolve=resolve)
+            conflicts = sorted((conflict["type"], conflict["id"]) for conflict in report["conflicts"])
+            self.assertEqual(conflicts, [("branch_removed", ids[2]), ("dangling", ids[4]), ("modified", ids[3])])
+            modified = next(conflict for conflict in report["conflicts"] if conflict["type"] == "modified")
+            self.assertEqual(modified["base"]["data"], {"name": "Node 3"})
+            self.assertEqual(modified["source"]["data"], {"name": "Node 3 (tree)"})
+            self.assertEqual(modified["branch"]["data"], {"name": "Node 3 (branch)"})
+            self.assertEqual(report["applied"], resolve is not None)
+            results[resolve] = self._state(tree)[0]
+
+        self.assertEqual(results[None], ["Node 0", "Node 1", "Node 2 (tree)", "Node 3 (tree)", "Node 4", "Node 5"])
+        self.assertEqual(results["source"], results[None])
+        self.assertEqual(results["branch"], ["Node 0", "Node 1", "Node 3 (branch)", "Node 4", "Node 5"])
+
+    def test_errors(self):
+        tree, branch, ids, copies = self._build()
+        with self.assertRaises(ValueError):
+            tree.merge(self.session, branch, resolve="newest")
+        with self.assertRaises(ValueError):
+            branch.merge(self.session, tree)
+        with self.assertRaises(ValueError):
+            tree.merge(self.session, branch, "v9")
+        cow = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+        with self.assertRaises(ValueError):
+            cow.merge(self.session, branch, "v1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree, TreeBlob, TreeNode
+from tree_manager.payloads import intern_tree_payloads
+
+
+class TestInternedPayloads(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def _build_tree(self, intern_payloads, relation="child"):
+        tree = Tree(name="Test Tree", intern_payloads=intern_payloads)
+        self.session.add(tree)
+        self.session.commit()
+
+        root = tree.add_node(self.session, data={"name": "Root", "setting": "default"})
+        children = [tree.add_node(self.session, data={"name": "Child", "setting": "custom"}) for _ in range(3)]
+        for child in children:
+            tree.add_edge(self.session, incoming_node_id=root.id, outgoing_node_id=child.id, data={"relation": relation})
+        return tree, root, children
+
+    def _blob_count(self):
+        return self.session.query(TreeBlob).count()
+
+    def test_identical_payloads_stored_once(self):
+        tree, root, children = self._build_tree(intern_payloads=True)
+        before = self._blob_count()
+        self._build_tree(intern_payloads=True)
+        self._build_tree(intern_payloads=True, relation="sibling")
+
+        self.assertEqual(self._blob_count() - before, 1)
+        self.assertEqual(len({child.data_hash for child in children}), 1)
+        self.assertIsNone(children[0]._data)
+        self.assertEqual(children[0].data, {"name": "Child", "setting": "custom"})
+        self.assertEqual(tree.get_child_nodes(self.session, root.id)[0].data["setting"], "custom")
+        self.assertEqual(root.incoming_edges[0].data, {"relation": "child"})
+
+        traversal = tree.traverse_tree(self.session, root.id)
+        self.assertEqual(traversal["nodes"][0]["data"], {"name": "Root", "setting": "default"})
+        self.assertEqual(traversal["edges"][0]["data"], {"relation": "child"})
+
+    def test_copies_and_snapshots_reference_hashes(self):
+        tree, root, children = self._build_tree(intern_payloads=True)
+        tag = tree.create_tag(self.session, "v1.0")
+        blobs = self._blob_count()
+
+        stored = json.loads(tag.snapshot)
+        self.assertTrue(all("data_hash" in node and "data" not in node for node in stored["nodes"]))
+        state = tag.load_snapshot(self.session)
+        self.assertEqual(state["nodes"][0], {"id": root.id, "data": {"name": "Root", "setting": "default"}})
+
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1.0")
+        restored_tree = tree.restore_from_tag(self.session, "v1.0")
+        self.assertEqual(self._blob_count(), blobs)
+        for copy in (branch, restored_tree):
+            self.assertTrue(copy.intern_payloads)
+            self.assertTrue(all(node.data_hash for node in copy.nodes))
+            copy_root = copy.get_root_nodes(self.session)[0]
+            self.assertEqual(copy_root.data["name"], "Root")
+            self.assertEqual(
+                [node.data["name"] for node in copy.get_child_nodes(self.session, copy_root.id)], ["Child"] * 3
+            )
+
+    def test_intern_existing_tree(self):
+        tree, root, children = self._build_tree(intern_payloads=False)
+        self.assertIsNone(root.data_hash)
+
+        counts = intern_tree_payloads(self.session, tree.id)
+        self.assertEqual(counts, {"nodes": 4, "edges": 3})
+        self.session.expire_all()
+
+        node = self.session.get(TreeNode, children[1].id)
+        self.assertIsNotNone(node.data_hash)
+        self.assertEqual(node.data, {"name": "Child", "setting": "custom"})
+        self.assertTrue(tree.intern_payloads)
+        self.assertEqual(intern_tree_payloads(self.session, tree.id), {"nodes": 0, "edges": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree
+from tree_manager.migrations import upgrade
+from tree_manager.search import create_payload_index, drop_payload_index
+
+
+class TestPayloadSearch(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def _build_tree(self, **options):
+        tree = Tree(name="Test Tree", **options)
+        self.session.add(tree)
+        self.session.commit()
+
+        settings = ["default", "custom", "custom", "custom", "experimental", "experimental", "test"]
+        ids = tree.add_nodes(
+            self.session,
+            [
+                {"setting": setting, "level": i // 3, "config": {"mode": "fast" if i % 2 else "safe"}}
+                for i, setting in enumerate(settings)
+            ],
+        )
+        tree.add_edges(
+            self.session,
+            [
+                (ids[0], ids[1], {"relation": "child"}),
+                (ids[0], ids[2], {"relation": "child"}),
+                (ids[1], ids[3], {"relation": "grandchild"}),
+                (ids[1], ids[4], {"relation": "grandchild"}),
+                (ids[2], ids[5], {"relation": "grandchild", "weight": 2}),
+                (ids[0], ids[6], {"relation": "child"}),
+            ],
+        )
+        return tree, ids
+
+    def _search(self, tree, ids):
+        def positions(nodes):
+            return [ids.index(node.id) for node in nodes]
+
+        return (
+            positions(tree.find_nodes(self.session, setting="experimental")),
+            positions(tree.find_nodes(self.session, under=ids[1], setting="experimental")),
+            positions(tree.find_nodes(self.session, under=ids[0], setting=["default", "test"])),
+            positions(tree.find_nodes(self.session, config__mode="fast", level=1)),
+            positions(tree.find_nodes(self.session, level=0, missing=None)),
+            positions(edge.outgoing_node for edge in tree.find_edges(self.session, relation="grandchild")),
+            positions(edge.outgoing_node for edge in tree.find_edges(self.session, under=ids[2], weight=2)),
+            positions(edge.outgoing_node for edge in tree.find_edges(self.session, under=ids[1], relation="child")),
+        )
+
+    def test_find(self):
+        for options in ({}, {"intern_payloads": True}, {"closure_indexed": True}):
+            tree, ids = self._build_tree(**options)
+            self.assertEqual(self._search(tree, ids), ([4, 5], [4], [6], [3, 5], [0, 1, 2], [3, 4, 5], [5], []))
+
+        # Nodes of the base tree are found in a copy-on-write branch, nodes of
+        # the branch only there.
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+        added = branch.add_node(self.session, {"setting": "experimental"})
+        self.assertEqual(
+            [node.id for node in branch.find_nodes(self.session, setting="experimental")], [ids[4], ids[5], added.id]
+        )
+        self.assertEqual(len(tree.find_nodes(self.session, setting="experimental")), 2)
+
+        with self.assertRaises(ValueError):
+            tree.find_nodes(self.session, **{"name') OR 1=1 --": "x"})
+        with self.assertRaises(ValueError):
+            tree.find_nodes(self.session, config={"mode": "fast"})
+
+    def test_payload_index(self):
+        tree, ids = self._build_tree()
+        names = create_payload_index(self.engine, "node", "setting")
+        self.assertEqual(names, ["ix_tree_node_data_setting", "ix_tree_blob_data_setting"])
+        create_payload_index(self.engine, "node", "setting")
+        create_payload_index(self.engine, "edge", "setting")
+        # Upgrades leave the indexes alone.
+        self.assertEqual(upgrade(self.engine)["indexes"], [])
+
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append((args[2], args[3])))
+        nodes = tree.find_nodes(self.session, setting="experimental")
+        self.assertEqual([node.id for node in nodes], [ids[4], ids[5]])
+        with self.engine.connect() as connection:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statements[-1][0], statements[-1][1]).all()
+        self.assertIn("USING INDEX ix_tree_node_data_setting", " ".join(row[-1] for row in plan))
+
+        self.assertEqual(drop_payload_index(self.engine, "node", "setting"), ["ix_tree_node_data_setting"])
+        names = drop_payload_index(self.engine, "edge", "setting")
+        self.assertEqual(names, ["ix_tree_edge_data_setting", "ix_tree_blob_data_setting"])
+        self.assertEqual(drop_payload_index(self.engine, "edge", "setting"), [])
+        with self.assertRaises(ValueError):
+            create_payload_index(self.engine, "blob", "setting")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree
+from tree_manager.tagview import TagNode, clear_tag_views
+
+
+class TestTagView(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+        clear_tag_views()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def _build_tree(self, intern_payloads=False):
+        tree = Tree(name="Test Tree", intern_payloads=intern_payloads)
+        self.session.add(tree)
+        self.session.commit()
+        ids = tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(6)])
+        tree.add_edges(
+            self.session,
+            [(ids[0], ids[1], {"relation": "child"}), (ids[0], ids[2]), (ids[1], ids[3]), (ids[1], ids[4]), (ids[3], ids[5])],
+        )
+        return tree, ids
+
+    def _count_queries(self, fn):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            result = fn()
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        return result, len(statements)
+
+    def test_matches_tree_at_tag_time(self):
+        tree, ids = self._build_tree()
+        tree.create_tag(self.session, "v1")
+        expected = {
+            "children": [node.id for node in tree.get_child_nodes(self.session, ids[1])],
+            "parents": [node.id for node in tree.get_parent_nodes(self.session, ids[3])],
+            "edges": sorted(edge.id for edge in tree.get_node_edges(self.session, ids[1])),
+            "roots": [node.id for node in tree.get_root_nodes(self.session)],
+            "depth_2": [node.id for node in tree.get_nodes_at_depth(self.session, 2)],
+            "path": [node.id for node, _ in tree.find_path(self.session, ids[5], ids[2])],
+            "traversal": tree.traverse_tree(self.session, ids[1]),
+        }
+
+        new_id = tree.add_node(self.session, {"name": "Later"}).id
+        tree.apply_changeset(self.session, {"updates": {ids[0]: {"name": "Renamed"}}, "edges": [(ids[2], new_id)]})
+
+        view = tree.tag_view(self.session, "v1")
+        self.assertEqual(view.get_node(self.session, ids[0]), TagNode(ids[0], {"name": "Node 0"}))
+        self.assertIsNone(view.get_node(self.session, new_id))
+        self.assertEqual([node.id for node in view.get_child_nodes(self.session, ids[1])], expected["children"])
+        self.assertEqual([node.id for node in view.get_parent_nodes(self.session, ids[3])], expected["parents"])
+        self.assertEqual(sorted(edge.id for edge in view.get_node_edges(self.session, ids[1])), expected["edges"])
+        self.assertEqual([node.id for node in view.get_root_nodes(self.session)], expected["roots"])
+        self.assertEqual([node.id for node in view.get_nodes_at_depth(self.session, 2)], expected["depth_2"])
+        self.assertEqual(view.get_child_nodes(self.session, ids[2]), [])
+        self.assertEqual(view.traverse_tree(self.session, ids[1]), expected["traversal"])
+
+        path = view.find_path(self.session, ids[5], ids[2])
+        self.assertEqual([node.id for node, _ in path], expected["path"])
+        self.assertEqual(path[-1][1], None)
+        self.assertEqual(path[-2][1].data, {})
+        self.assertEqual(view.find_path(self.session, ids[0], new_id), [])
+
+    def test_index_is_built_once_per_tag(self):
+        tree, ids = self._build_tree()
+        for i in range(3):
+            tree.add_node(self.session, {"name": f"Extra {i}"})
+            tree.create_tag(self.session, f"v{i}")
+
+        tree_id = tree.id
+        view, queries = self._count_queries(lambda: tree.tag_view(self.session, "v2"))
+        self.assertEqual(queries, 1)
+        children, queries = self._count_queries(lambda: view.get_child_nodes(self.session, ids[0]))
+        self.assertGreater(queries, 1)
+        self.assertEqual(len(children), 2)
+        self.assertEqual(len(view.get_root_nodes(self.session)), 4)
+        self.assertEqual(view.tree_id, tree_id)
+
+        again = tree.tag_view(self.session, "v2")
+        _, queries = self._count_queries(lambda: again.find_path(self.session, ids[5], ids[2]))
+        self.assertEqual(queries, 0)
+
+    def test_reused_tag_id(self):
+        tree, ids = self._build_tree()
+        tag = tree.create_tag(self.session, "v1")
+        tag_id = tag.id
+        self.assertEqual(len(tree.tag_view(self.session, "v1").get_root_nodes(self.session)), 1)
+
+        # Deleted through the delete-orphan cascade of Tree.tags.
+        tree.tags.remove(tag)
+        self.session.commit()
+        tree.add_node(self.session, {"name": "Extra"})
+        replacement = tree.create_tag(self.session, "v2")
+        self.assertGreater(replacement.id, tag_id)
+
+        # Databases created before AUTOINCREMENT can hand the ID out again.
+        self.session.execute(
+            text("UPDATE tree_tag SET id = :old WHERE id = :new"), {"old": tag_id, "new": replacement.id}
+        )
+        self.session.commit()
+        self.assertEqual(len(tree.tag_view(self.session, "v2").get_root_nodes(self.session)), 2)
+
+    def test_interned_payloads(self):
+        tree, ids = self._build_tree(intern_payloads=True)
+        tree.create_tag(self.session, "v1")
+        view = tree.tag_view(self.session, "v1")
+        self.assertEqual(view.get_node(self.session, ids[4]).data, {"name": "Node 4"})
+        self.assertEqual(view.get_node_edges(self.session, ids[0])[0].data, {"relation": "child"})
+
+    def test_missing_tag(self):
+        tree, _ = self._build_tree()
+        with self.assertRaises(ValueError):
+            tree.tag_view(self.session, "missing")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
+import random
 import unittest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from tree_manager import Base, Tree, TreeNode, TreeEdge, TreeTag
+from unittest import mock
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import selectinload, sessionmaker
+from tree_manager import Base, Tree, TreeNode, TreeEdge, TreeTag, TreeTagChange, TreeTagNode
+from tree_manager.models import EdgeRow, NodeRow
 
 
 class TestTreeManager(unittest.TestCase):
@@ -35,6 +38,7 @@ class TestTreeManager(unittest.TestCase):
         edge = TreeEdge(incoming_node_id=node1.id, outgoing_node_id=node2.id, data={"relation": "child"})
         self.session.add(edge)
         self.session.commit()
+        self.assertEqual(edge.tree_id, tree.id)
 
         tag = tree.create_tag(self.session, "v1.0", description="Initial version")
         self.assertEqual(tag.tag_name, "v1.0")
@@ -95,6 +99,18 @@ class TestTreeManager(unittest.TestCase):
         self.assertEqual(len(node1.incoming_edges), 1)
         self.assertEqual(len(node2.outgoing_edges), 1)
 
+        # Both endpoints must belong to the tree, as for add_edges.
+        other = Tree(name="Other Tree")
+        self.session.add(other)
+        self.session.commit()
+        foreign = other.add_node(self.session, data={})
+        for incoming, outgoing in [(node1.id, foreign.id), (foreign.id, node1.id), (node1.id, -1)]:
+            with self.assertRaises(ValueError):
+                tree.add_edge(self.session, incoming, outgoing)
+            with self.assertRaises(ValueError):
+                tree.add_edges(self.session, [(incoming, outgoing)])
+        self.assertEqual(len(node1.incoming_edges), 1)
+
     def test_get_root_nodes(self):
         tree = Tree(name="Test Tree")
         self.session.add(tree)
@@ -133,5 +149,618 @@ class TestTreeManager(unittest.TestCase):
         self.assertEqual(path[2][0].data["name"], "Node 2")
         self.assertEqual(path[3][0].data["name"], "Node 1")
 
+    def test_create_new_tree_version_from_tag(self):
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+
+        root = tree.add_node(self.session, data={"name": "Root"})
+        child1 = tree.add_node(self.session, data={"name": "Child 1"})
+        child2 = tree.add_node(self.session, data={"name": "Child 2"})
+        tree.add_edge(self.session, incoming_node_id=root.id, outgoing_node_id=child1.id, data={"relation": "child"})
+        tree.add_edge(self.session, incoming_node_id=root.id, outgoing_node_id=child2.id, data={"relation": "child"})
+        tree.create_tag(self.session, "v1.0")
+
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1.0")
+        self.assertEqual(branch.name, "Test Tree_v1.0_branch")
+        self.assertEqual(len(branch.nodes), 3)
+        self.assertTrue(all(node.id not in (root.id, child1.id, child2.id) for node in branch.nodes))
+
+        branch_roots = branch.get_root_nodes(self.session)
+        self.assertEqual([node.data["name"] for node in branch_roots], ["Root"])
+        children = branch.get_child_nodes(self.session, branch_roots[0].id)
+        self.assertEqual(sorted(node.data["name"] for node in children), ["Child 1", "Child 2"])
+        self.assertTrue(all(node.tree_id == branch.id for node in children))
+        self.assertEqual(len(tree.get_child_nodes(self.session, root.id)), 2)
+
+    def test_restore_from_tag_remaps_edges(self):
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+
+        root = tree.add_node(self.session, data={"name": "Root"})
+        child = tree.add_node(self.session, data={"name": "Child"})
+        grandchild = tree.add_node(self.session, data={"name": "Grandchild"})
+        tree.add_edge(self.session, incoming_node_id=root.id, outgoing_node_id=child.id)
+        tree.add_edge(self.session, incoming_node_id=child.id, outgoing_node_id=grandchild.id)
+        tree.create_tag(self.session, "v1.0")
+
+        restored_tree = tree.restore_from_tag(self.session, "v1.0")
+        restored_root = restored_tree.get_root_nodes(self.session)[0]
+        path = restored_tree.traverse_tree(self.session, restored_root.id)
+        self.assertEqual([node["data"]["name"] for node in path["nodes"]], ["Root", "Child", "Grandchild"])
+        self.assertTrue(all(edge.incoming_node.tree_id == restored_tree.id for edge in restored_root.incoming_edges))
+
+    def _build_sample_tree(self):
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+
+        nodes = [tree.add_node(self.session, data={"name": f"Node {i}"}) for i in range(1, 7)]
+        for parent, child in [(0, 1), (0, 2), (1, 3), (1, 4), (4, 5)]:
+            tree.add_edge(self.session, incoming_node_id=nodes[parent].id, outgoing_node_id=nodes[child].id)
+        return tree, nodes
+
+    def test_traverse_tree(self):
+        tree, nodes = self._build_sample_tree()
+
+        result = tree.traverse_tree(self.session, nodes[1].id)
+        self.assertEqual(
+            [(node["data"]["name"], node["depth"]) for node in result["nodes"]],
+            [("Node 2", 0), ("Node 4", 1), ("Node 5", 1), ("Node 6", 2)],
+        )
+        self.assertEqual(len(result["edges"]), 3)
+        self.assertEqual(len(result["nodes"][0]["edges"]), 2)
+
+    def test_get_nodes_at_depth(self):
+        tree, nodes = self._build_sample_tree()
+
+        self.assertEqual([node.id for node in tree.get_nodes_at_depth(self.session, 0)], [nodes[0].id])
+        self.assertEqual(
+            [node.data["name"] for node in tree.get_nodes_at_depth(self.session, 2)], ["Node 4", "Node 5"]
+        )
+        self.assertEqual(tree.get_nodes_at_depth(self.session, 5), [])
+
+    def test_find_path_unconnected(self):
+        tree, nodes = self._build_sample_tree()
+        other = tree.add_node(self.session, data={"name": "Island"})
+
+        self.assertEqual(tree.find_path(self.session, nodes[5].id, other.id), [])
+        path = tree.find_path(self.session, nodes[2].id, nodes[2].id)
+        self.assertEqual(path, [(nodes[2], None)])
+
+    def test_ladder_dag(self):
+        # Every rung doubles the number of walks between the ends of the
+        # ladder, so queries enumerating walks instead of nodes never finish.
+        tree = Tree(name="Ladder")
+        self.session.add(tree)
+        self.session.commit()
+        rungs = 40
+        left = tree.add_nodes(self.session, [{"side": "left", "rung": i} for i in range(rungs)])
+        right = tree.add_nodes(self.session, [{"side": "right", "rung": i} for i in range(rungs)])
+        tree.add_edges(
+            self.session,
+            [
+                (side[i], other[i + 1])
+                for i in range(rungs - 1)
+                for side in (left, right)
+                for other in (left, right)
+            ],
+        )
+        island = tree.add_node(self.session, {"name": "Island"})
+
+        # Reload the rows the commit expired, so only find_path is counted.
+        self.session.refresh(tree)
+        island_id = island.id
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            self.assertEqual(tree.find_path(self.session, left[0], island_id), [])
+            path = tree.find_path(self.session, left[0], right[-1])
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        # One statement per call.
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(len(path), rungs)
+        self.assertEqual([node.data["rung"] for node, _ in path], list(range(rungs)))
+        for (node, edge), (next_node, _) in zip(path, path[1:]):
+            self.assertEqual((edge.incoming_node_id, edge.outgoing_node_id), (node.id, next_node.id))
+        self.assertEqual(
+            [node.id for node in tree.get_nodes_at_depth(self.session, rungs - 1)], [left[-1], right[-1]]
+        )
+
+    def test_python_fallback_matches_recursive_queries(self):
+        tree, nodes = self._build_sample_tree()
+
+        def summary():
+            traversal = tree.traverse_tree(self.session, nodes[0].id)
+            return (
+                sorted((node["id"], node["depth"]) for node in traversal["nodes"]),
+                [node.id for node in tree.get_nodes_at_depth(self.session, 2)],
+                [(node.id, edge.id if edge else None) for node, edge in tree.find_path(self.session, nodes[5].id, nodes[2].id)],
+            )
+
+        expected = summary()
+        with mock.patch("tree_manager.models.RECURSIVE_CTE_DIALECTS", ()):
+            self.assertEqual(summary(), expected)
+        self.assertEqual(len(expected[2]), 5)
+
+    def test_raw_rows_and_loader_options(self):
+        tree, nodes = self._build_sample_tree()
+        interned = Tree(name="Interned", intern_payloads=True)
+        self.session.add(interned)
+        self.session.commit()
+        ids = interned.add_nodes(self.session, [{"name": "Root"}, {"name": "Child"}])
+        interned.add_edges(self.session, [(ids[0], ids[1], {"relation": "child"})])
+
+        def reads(tree, root_id, leaf_id, raw, mode=None):
+            def rows(result):
+                return [row and (row.id, row.data) for row in result]
+
+            def run():
+                return (
+                    rows([tree.get_node(self.session, root_id, raw=raw)]),
+                    rows(tree.get_root_nodes(self.session, raw=raw)),
+                    rows(tree.get_child_nodes(self.session, root_id, raw=raw)),
+                    rows(tree.get_parent_nodes(self.session, leaf_id, raw=raw)),
+                    rows(tree.get_node_edges(self.session, root_id, raw=raw)),
+                    rows(tree.get_ancestors(self.session, leaf_id, raw=raw)),
+                    rows(tree.get_descendants(self.session, root_id, raw=raw)),
+                    rows(tree.get_nodes_at_depth(self.session, 1, raw=raw)),
+                    rows(tree.find_nodes(self.session, raw=raw, name="Root")),
+                    rows(tree.find_edges(self.session, raw=raw)),
+                    [rows(step) for step in tree.find_path(self.session, leaf_id, root_id, raw=raw)],
+                )
+
+            if mode is None:
+                return run()
+            with mock.patch("tree_manager.models.RECURSIVE_CTE_DIALECTS", mode):
+                return run()
+
+        for tree, root_id, leaf_id in ((tree, nodes[0].id, nodes[5].id), (interned, ids[0], ids[1])):
+            expected = reads(tree, root_id, leaf_id, raw=False)
+            self.session.expunge_all()
+            self.assertEqual(reads(tree, root_id, leaf_id, raw=True), expected)
+            self.assertEqual(len(self.session.identity_map), 0)
+            self.assertEqual(reads(tree, root_id, leaf_id, raw=True, mode=()), expected)
+        self.assertIsInstance(tree.get_node(self.session, ids[0], raw=True), NodeRow)
+        self.assertIsInstance(tree.find_edges(self.session, raw=True)[0], EdgeRow)
+        self.assertEqual(tree.find_edges(self.session, raw=True)[0].data, {"relation": "child"})
+        self.assertIsNone(tree.get_node(self.session, -1, raw=True))
+
+        # Loader options load the relationships up front: reading them later
+        # issues no queries.
+        tree, nodes = self._build_sample_tree()
+        root_id = nodes[0].id
+        self.session.expunge_all()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        children = tree.get_child_nodes(self.session, root_id, load=selectinload(TreeNode.incoming_edges))
+        descendants = tree.get_descendants(
+            self.session, root_id, load=[selectinload(TreeNode.outgoing_edges), selectinload(TreeNode.incoming_edges)]
+        )
+        event.listen(self.engine, "before_cursor_execute", listener)
+        try:
+            # ``incoming_edges`` holds the edges whose incoming node is the node.
+            self.assertEqual([len(node.incoming_edges) for node in children], [2, 0])
+            self.assertEqual([len(node.outgoing_edges) for node in descendants], [1] * 5)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", listener)
+        self.assertEqual(statements, [])
+
+    def test_delta_snapshots(self):
+        tree, nodes = self._build_sample_tree()
+        first = tree.create_tag(self.session, "v1")
+
+        nodes[3].data = {"name": "Node 4", "setting": "changed"}
+        new_node = tree.add_node(self.session, data={"name": "Node 7"})
+        tree.add_edge(self.session, incoming_node_id=nodes[2].id, outgoing_node_id=new_node.id)
+        second = tree.create_tag(self.session, "v2")
+
+        self.assertEqual(first.snapshot_format, "full")
+        self.assertEqual(second.snapshot_format, "delta")
+        self.assertEqual(second.parent_tag_id, first.id)
+        self.assertLess(len(second.snapshot), len(first.snapshot))
+
+        state = second.load_snapshot(self.session)
+        self.assertEqual(len(state["nodes"]), 7)
+        self.assertEqual(len(state["edges"]), 6)
+        self.assertIn({"id": nodes[3].id, "data": {"name": "Node 4", "setting": "changed"}}, state["nodes"])
+        self.assertEqual(len(first.load_snapshot(self.session)["nodes"]), 6)
+
+        restored_tree = tree.restore_from_tag(self.session, "v2")
+        self.assertEqual(len(restored_tree.nodes), 7)
+        self.assertEqual(
+            sorted(node.data["name"] for node in restored_tree.get_nodes_at_depth(self.session, 1)),
+            ["Node 2", "Node 3"],
+        )
+
+    def test_snapshot_keyframes(self):
+        tree, nodes = self._build_sample_tree()
+        with mock.patch("tree_manager.models.SNAPSHOT_KEYFRAME_INTERVAL", 3):
+            tags = []
+            for i in range(5):
+                tree.add_node(self.session, data={"name": f"Extra {i}"})
+                tags.append(tree.create_tag(self.session, f"v{i}"))
+
+        self.assertEqual([tag.snapshot_format for tag in tags], ["full", "delta", "delta", "full", "delta"])
+        self.assertEqual([tag.delta_depth for tag in tags], [0, 1, 2, 0, 1])
+        self.assertEqual([len(tag.load_snapshot(self.session)["nodes"]) for tag in tags], [7, 8, 9, 10, 11])
+
+    def test_row_snapshots(self):
+        tree, nodes = self._build_sample_tree()
+        tree.row_snapshots = True
+        first = tree.create_tag(self.session, "v1")
+        tree.row_snapshots = False
+        as_json = tree.create_tag(self.session, "j1")
+        tree.row_snapshots = True
+
+        nodes[3].data = {"name": "Node 4", "setting": "changed"}
+        new_node = tree.add_node(self.session, data={"name": "Node 7"})
+        tree.add_edge(self.session, incoming_node_id=nodes[2].id, outgoing_node_id=new_node.id)
+        second = tree.create_tag(self.session, "v2")
+        third = tree.create_tag(self.session, "v3")
+
+        self.assertEqual([first.snapshot_format, as_json.snapshot_format], ["rows", "delta"])
+        self.assertEqual(first.load_snapshot(self.session), as_json.load_snapshot(self.session))
+        self.assertEqual(second.load_snapshot(self.session), third.load_snapshot(self.session))
+        self.assertEqual(len(second.load_snapshot(self.session)["edges"]), 6)
+        # Unchanged nodes keep the row written by the first tag.
+        self.assertEqual(self.session.query(TreeTagNode).filter_by(tree_id=tree.id).count(), 8)
+
+        self.assertEqual(first.get_node(self.session, nodes[3].id), {"id": nodes[3].id, "data": {"name": "Node 4"}})
+        self.assertEqual(second.get_node(self.session, nodes[3].id)["data"]["setting"], "changed")
+        self.assertIsNone(first.get_node(self.session, new_node.id))
+        self.assertEqual(as_json.get_node(self.session, nodes[0].id), {"id": nodes[0].id, "data": {"name": "Node 1"}})
+
+        subset = second.load_snapshot(self.session, node_ids=[nodes[0].id, nodes[1].id, nodes[3].id])
+        self.assertEqual([node["id"] for node in subset["nodes"]], [nodes[0].id, nodes[1].id, nodes[3].id])
+        self.assertEqual(
+            [(edge["incoming_node_id"], edge["outgoing_node_id"]) for edge in subset["edges"]],
+            [(nodes[0].id, nodes[1].id), (nodes[1].id, nodes[3].id)],
+        )
+
+        restored = tree.restore_from_tag(self.session, "v1")
+        self.assertTrue(restored.row_snapshots)
+        self.assertEqual(sorted(node.data["name"] for node in restored.nodes), [f"Node {i}" for i in range(1, 7)])
+
+    def test_node_history(self):
+        for row_snapshots in (False, True):
+            tree, nodes = self._build_sample_tree()
+            tree.row_snapshots = row_snapshots
+            tree.create_tag(self.session, "v1")
+            nodes[3].data = {"name": "Node 4", "setting": "changed"}
+            tree.create_tag(self.session, "v2")
+            new_node = tree.add_node(self.session, data={"name": "Node 7"})
+            tree.add_edge(self.session, incoming_node_id=nodes[1].id, outgoing_node_id=new_node.id)
+            tree.create_tag(self.session, "v3")
+            tree.create_tag(self.session, "v4")
+
+            history = tree.node_history(self.session, nodes[3].id)
+            self.assertEqual(
+                history,
+                [
+                    {"tag": "v1", "change": "added", "data": {"name": "Node 4"}},
+                    {"tag": "v2", "change": "modified", "data": {"name": "Node 4", "setting": "changed"}},
+                ],
+            )
+            subtree = tree.subtree_history(self.session, nodes[1].id)
+            self.assertEqual(
+                [(entry["tag"], entry["node_id"], entry["change"]) for entry in subtree],
+                [("v1", nodes[i].id, "added") for i in (1, 3, 4, 5)]
+                + [("v2", nodes[3].id, "modified"), ("v3", new_node.id, "added")],
+            )
+            self.assertEqual(tree.node_history(self.session, nodes[0].id)[0]["tag"], "v1")
+            self.assertEqual(len(tree.node_history(self.session, nodes[0].id)), 1)
+
+            # Tags created before the change index are indexed on first use.
+            self.session.query(TreeTagChange).filter_by(tree_id=tree.id).delete()
+            self.session.query(TreeTag).filter_by(tree_id=tree.id).update({"changes_indexed": False})
+            self.session.commit()
+            self.assertEqual(tree.node_history(self.session, nodes[3].id), history)
+            self.assertEqual(tree.subtree_history(self.session, nodes[1].id), subtree)
+
+    def test_aggregates(self):
+        tree, nodes = self._build_sample_tree()
+        ids = [node.id for node in nodes]
+        tree.enable_aggregates(self.session, {"size": "count", "height": "height", "weight": ("sum", "weight")})
+        self.assertEqual(tree.get_aggregates(self.session, ids[0]), {"size": 5, "height": 3, "weight": 0})
+        self.assertEqual(tree.get_aggregates(self.session, ids[5]), {"size": 0, "height": 0, "weight": 0})
+
+        def recomputed():
+            values = {id: tree.get_aggregates(self.session, id) for id in ids}
+            tree.recompute_aggregates(self.session)
+            self.assertEqual({id: tree.get_aggregates(self.session, id) for id in ids}, values)
+            return values
+
+        changes = tree.apply_changeset(
+            self.session,
+            {
+                "updates": {ids[5]: {"weight": 2}, ids[2]: {"weight": 1.5}},
+                "nodes": [{"weight": 10}, {"weight": "heavy"}],
+                "edges": [(ids[5], -1), (-1, -2)],
+            },
+        )
+        ids.extend(changes["nodes"])
+        values = recomputed()
+        self.assertEqual(values[ids[0]], {"size": 7, "height": 5, "weight": 13.5})
+        self.assertEqual(values[ids[4]], {"size": 3, "height": 3, "weight": 12})
+
+        # A second path from node 1 to node 6 counts its subtree twice.
+        tree.add_edge(self.session, ids[2], ids[5])
+        tree.apply_changeset(self.session, {"updates": {ids[6]: {"weight": 20}}})
+        added = tree.add_node(self.session, {"weight": 1})
+        tree.add_edge(self.session, ids[7], added.id)
+        ids.append(added.id)
+        # An edge closing a cycle is left out.
+        tree.add_edge(self.session, ids[5], ids[1])
+        values = recomputed()
+        self.assertEqual(values[ids[0]], {"size": 12, "height": 6, "weight": 47.5})
+        self.assertEqual(values[ids[2]], {"size": 4, "height": 4, "weight": 24.5})
+
+        # Edges added in both directions close cycles across changesets;
+        # updates and a recompute leave out the same edges.
+        rng = random.Random(6)
+        graph = Tree(name="Cycles")
+        self.session.add(graph)
+        self.session.commit()
+        graph_ids = graph.add_nodes(self.session, [{} for _ in range(30)])
+        graph.enable_aggregates(self.session, {"c": "count", "h": "height"})
+        for _ in range(8):
+            graph.add_edges(self.session, [tuple(rng.sample(graph_ids, 2)) for _ in range(6)])
+            graph.add_edge(self.session, *rng.sample(graph_ids, 2))
+        incremental = {id: graph.get_aggregates(self.session, id) for id in graph_ids}
+        graph.recompute_aggregates(self.session)
+        self.assertEqual({id: graph.get_aggregates(self.session, id) for id in graph_ids}, incremental)
+
+        # A failed add_edge leaves neither the edge nor changed aggregates behind.
+        edge_count = self.session.query(TreeEdge).count()
+        with self.assertRaises(ValueError):
+            graph.add_edge(self.session, graph_ids[0], ids[0])
+        with mock.patch("tree_manager.models._aggregates_add_edge", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                graph.add_edge(self.session, graph_ids[0], graph_ids[1])
+        self.assertEqual(self.session.query(TreeEdge).count(), edge_count)
+        self.assertEqual({id: graph.get_aggregates(self.session, id) for id in graph_ids}, incremental)
+
+        tree.create_tag(self.session, "v1")
+        restored = tree.restore_from_tag(self.session, "v1")
+        self.assertEqual(restored.aggregates, tree.aggregates)
+        root = restored.get_root_nodes(self.session)[0]
+        self.assertEqual(restored.get_aggregates(self.session, root.id), values[ids[0]])
+
+        tree.enable_aggregates(self.session, {})
+        self.assertIsNone(tree.aggregates)
+        self.assertEqual(tree.get_aggregates(self.session, ids[0]), {})
+        with self.assertRaises(ValueError):
+            tree.enable_aggregates(self.session, {"size": "average"})
+        with self.assertRaises(ValueError):
+            tree.enable_aggregates(self.session, {"size": ("count", "weight")})
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+        with self.assertRaises(ValueError):
+            branch.enable_aggregates(self.session, {"size": "count"})
+
+    def test_copy_on_write_branch(self):
+        tree, nodes = self._build_sample_tree()
+        tree.create_tag(self.session, "v1")
+
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+        self.assertEqual(branch.base_tree_id, tree.id)
+        self.assertEqual(branch.nodes, [])
+        self.assertEqual([node.id for node in branch.get_root_nodes(self.session)], [nodes[0].id])
+        self.assertEqual(
+            [node["id"] for node in branch.traverse_tree(self.session, nodes[0].id)["nodes"]],
+            [node["id"] for node in tree.traverse_tree(self.session, nodes[0].id)["nodes"]],
+        )
+
+        base_only = tree.add_node(self.session, data={"name": "Base only"})
+        tree.add_edge(self.session, incoming_node_id=nodes[2].id, outgoing_node_id=base_only.id)
+        branch_only = branch.add_node(self.session, data={"name": "Branch only"})
+        branch.add_edge(self.session, incoming_node_id=nodes[5].id, outgoing_node_id=branch_only.id)
+
+        self.assertEqual([node.id for node in tree.get_child_nodes(self.session, nodes[2].id)], [base_only.id])
+        self.assertEqual(branch.get_child_nodes(self.session, nodes[2].id), [])
+        self.assertEqual([node.id for node in branch.get_child_nodes(self.session, nodes[5].id)], [branch_only.id])
+        self.assertEqual(tree.get_child_nodes(self.session, nodes[5].id), [])
+        self.assertEqual(
+            [node.id for node in branch.get_descendants(self.session, nodes[4].id)], [nodes[5].id, branch_only.id]
+        )
+        self.assertEqual([node.id for node in branch.get_nodes_at_depth(self.session, 4)], [branch_only.id])
+        self.assertEqual(len(branch.find_path(self.session, nodes[2].id, branch_only.id)), 6)
+        self.assertEqual(tree.find_path(self.session, nodes[2].id, branch_only.id), [])
+
+        snapshot = branch.create_tag(self.session, "b1").load_snapshot(self.session)
+        self.assertEqual(len(snapshot["nodes"]), 7)
+        self.assertEqual(len(snapshot["edges"]), 6)
+
+        copied = branch.create_new_tree_version_from_tag(self.session, "b1")
+        self.assertEqual(
+            sorted(node.data["name"] for node in copied.nodes),
+            sorted(node["data"]["name"] for node in snapshot["nodes"]),
+        )
+        with self.assertRaises(ValueError):
+            branch.enable_closure_index(self.session)
+
+    def test_copy_on_write_updates(self):
+        tree, nodes = self._build_sample_tree()
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+
+        # The base tree cannot change what the branch shares with it.
+        with self.assertRaises(ValueError):
+            tree.apply_changeset(self.session, {"updates": {nodes[0].id: {"v": 999}}})
+        self.assertEqual(branch.get_root_nodes(self.session)[0].data, {"name": "Node 1"})
+        later = tree.add_node(self.session, {"name": "Later"})
+        tree.apply_changeset(self.session, {"updates": {later.id: {"name": "Later (changed)"}}})
+
+        # The branch gets its own copy, joined to the edges it sees.
+        result = branch.apply_changeset(
+            self.session,
+            {"updates": {nodes[1].id: {"name": "Node 2 (branch)"}}, "nodes": [{}], "edges": [(nodes[1].id, -1)]},
+        )
+        copy_id = result["copies"][nodes[1].id]
+        self.assertEqual(branch.get_node(self.session, copy_id).data, {"name": "Node 2 (branch)"})
+        self.assertEqual(
+            [node.id for node in branch.get_child_nodes(self.session, nodes[0].id)], [nodes[2].id, copy_id]
+        )
+        self.assertEqual(
+            [node.id for node in branch.get_child_nodes(self.session, copy_id)],
+            [nodes[3].id, nodes[4].id, result["nodes"][0]],
+        )
+        self.assertEqual(branch.get_child_nodes(self.session, nodes[1].id), [])
+        self.assertEqual(len(branch.create_tag(self.session, "b1").load_snapshot(self.session)["nodes"]), 7)
+        self.assertEqual(tree.get_node(self.session, nodes[1].id).data, {"name": "Node 2"})
+        self.assertEqual(
+            [node.id for node in tree.get_child_nodes(self.session, nodes[0].id)], [nodes[1].id, nodes[2].id]
+        )
+        # Once no branch sees the original, the base tree can change it again.
+        tree.apply_changeset(self.session, {"updates": {nodes[1].id: {"name": "Node 2 (tree)"}}})
+        self.assertEqual(branch.get_node(self.session, copy_id).data, {"name": "Node 2 (branch)"})
+
+        # Its own nodes are updated in place, until a branch of it shares them.
+        self.assertEqual(branch.apply_changeset(self.session, {"updates": {copy_id: {"name": "Again"}}})["copies"], {})
+        nested = branch.create_new_tree_version_from_tag(self.session, "b1", copy_on_write=True)
+        self.assertEqual(
+            [node.id for node in nested.get_child_nodes(self.session, nodes[0].id)], [nodes[2].id, copy_id]
+        )
+        with self.assertRaises(ValueError):
+            branch.apply_changeset(self.session, {"updates": {copy_id: {"name": "Shared"}}})
+        result = nested.apply_changeset(self.session, {"updates": {copy_id: {"name": "Nested"}}})
+        nested_copy = result["copies"][copy_id]
+        self.assertEqual(
+            [node.id for node in nested.get_child_nodes(self.session, nodes[0].id)], [nodes[2].id, nested_copy]
+        )
+        self.assertEqual(
+            [node.id for node in branch.get_child_nodes(self.session, nodes[0].id)], [nodes[2].id, copy_id]
+        )
+        self.assertEqual(branch.get_node(self.session, copy_id).data, {"name": "Again"})
+
+    def test_copy_on_write_branch_after_delete(self):
+        tree, nodes = self._build_sample_tree()
+        scratch = Tree(name="Scratch")
+        self.session.add(scratch)
+        self.session.commit()
+        scratch.add_nodes(self.session, [{}, {}, {}])
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+
+        # IDs of deleted rows below the branch's watermark are not handed out again.
+        self.session.delete(scratch)
+        self.session.commit()
+        later = tree.add_node(self.session, {"name": "Later"})
+        later_ids = tree.add_nodes(self.session, [{}, {}])
+        self.assertGreater(min([later.id] + later_ids), branch.base_max_node_id)
+        self.assertEqual([node.id for node in branch.get_root_nodes(self.session)], [nodes[0].id])
+
+    def test_diff_tags(self):
+        tree, nodes = self._build_sample_tree()
+        tree.create_tag(self.session, "v1")
+
+        nodes[3].data = {"name": "Node 4", "setting": "changed"}
+        new_node = tree.add_node(self.session, data={"name": "Node 7"})
+        edge = tree.add_edge(self.session, incoming_node_id=nodes[2].id, outgoing_node_id=new_node.id)
+        tree.create_tag(self.session, "v2")
+
+        diff = tree.diff_tags(self.session, "v1", "v2")
+        self.assertEqual(diff["nodes"]["added"], [{"id": new_node.id, "data": {"name": "Node 7"}}])
+        self.assertEqual(diff["nodes"]["removed"], [])
+        self.assertEqual(
+            diff["nodes"]["modified"],
+            [
+                (
+                    {"id": nodes[3].id, "data": {"name": "Node 4"}},
+                    {"id": nodes[3].id, "data": {"name": "Node 4", "setting": "changed"}},
+                )
+            ],
+        )
+        self.assertEqual([entry["id"] for entry in diff["edges"]["added"]], [edge.id])
+
+        reverse = tree.diff_tags(self.session, "v2", "v1")
+        self.assertEqual(reverse["nodes"]["removed"], diff["nodes"]["added"])
+        self.assertEqual(tree.diff_tags(self.session, "v2", "v2"), tree.diff_tags(self.session, "v1", "v1"))
+        with self.assertRaises(ValueError):
+            tree.diff_tags(self.session, "v1", "missing")
+
+    def test_diff_trees(self):
+        tree, nodes = self._build_sample_tree()
+        tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, "v1", copy_on_write=True)
+        branch_node = branch.add_node(self.session, data={"name": "Branch only"})
+        branch.add_edge(self.session, incoming_node_id=nodes[5].id, outgoing_node_id=branch_node.id)
+        base_node = tree.add_node(self.session, data={"name": "Base only"})
+
+        with mock.patch("tree_manager.models.BULK_BATCH_SIZE", 2):
+            changes = list(tree.iter_diff_trees(self.session, branch))
+        self.assertEqual(
+            [(kind, change) for kind, change, _, _ in changes],
+            [("nodes", "added"), ("nodes", "removed"), ("edges", "added")],
+        )
+        self.assertEqual(changes[0][3], {"id": branch_node.id, "data": {"name": "Branch only"}})
+        self.assertEqual(changes[1][2]["id"], base_node.id)
+        self.assertEqual(changes[2][3]["outgoing_node_id"], branch_node.id)
+        self.assertEqual(tree.diff_trees(self.session, tree)["nodes"], {"added": [], "removed": [], "modified": []})
+
+
+    def test_add_nodes_and_edges(self):
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+
+        node_ids = tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(4)])
+        self.assertEqual(len(node_ids), 4)
+        self.assertEqual(
+            [self.session.get(TreeNode, id).data["name"] for id in node_ids], [f"Node {i}" for i in range(4)]
+        )
+
+        edge_ids = tree.add_edges(
+            self.session,
+            [
+                (node_ids[0], node_ids[1]),
+                (node_ids[0], node_ids[2], {"relation": "child"}),
+                (node_ids[2], node_ids[3]),
+            ],
+        )
+        self.assertEqual([self.session.get(TreeEdge, id).outgoing_node_id for id in edge_ids], node_ids[1:])
+        self.assertEqual(self.session.get(TreeEdge, edge_ids[0]).data, {})
+        self.assertEqual([node.id for node in tree.get_root_nodes(self.session)], [node_ids[0]])
+
+        other = Tree(name="Other Tree")
+        self.session.add(other)
+        self.session.commit()
+        stranger = other.add_node(self.session, data={"name": "Stranger"})
+        with self.assertRaises(ValueError):
+            tree.add_edges(self.session, [(node_ids[3], node_ids[0]), (node_ids[3], stranger.id)])
+        self.assertEqual(len(tree.get_child_nodes(self.session, node_ids[3])), 0)
+
+    def test_apply_changeset(self):
+        tree, nodes = self._build_sample_tree()
+        tree.enable_closure_index(self.session)
+
+        result = tree.apply_changeset(
+            self.session,
+            {
+                "updates": {nodes[0].id: {"name": "Root"}},
+                "nodes": [{"name": "Node 7"}, {"name": "Node 8"}],
+                "edges": [(nodes[5].id, -1), (-1, -2, {"relation": "child"})],
+            },
+        )
+        self.assertEqual(len(result["nodes"]), 2)
+        self.assertEqual(len(result["edges"]), 2)
+        self.assertEqual(tree.get_node(self.session, nodes[0].id).data, {"name": "Root"})
+        self.assertEqual(
+            [node.data["name"] for node in tree.get_ancestors(self.session, result["nodes"][1])],
+            ["Node 7", "Node 6", "Node 5", "Node 2", "Root"],
+        )
+
+        branch_tag = tree.create_tag(self.session, "v1")
+        branch = tree.create_new_tree_version_from_tag(self.session, branch_tag.tag_name, copy_on_write=True)
+        with self.assertRaises(ValueError):
+            tree.apply_changeset(self.session, {"updates": {nodes[0].id: {"name": "Changed"}}})
+        with self.assertRaises(ValueError):
+            tree.apply_changeset(self.session, {"nodes": [{}], "edges": [(nodes[0].id, -2)]})
+        self.assertEqual(len(tree.nodes), 8)
+
+
 if __name__ == "__main__":
     unittest.main()
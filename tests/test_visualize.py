@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tree_manager import Base, Tree
+from visualize_tree import collapse, load_graph, spanning_forest, tree_layout, visualize_tree_by_id
+
+
+class TestVisualize(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(cls.engine)
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.Session()
+        self.directory = tempfile.mkdtemp()
+        tree = Tree(name="Test Tree")
+        self.session.add(tree)
+        self.session.commit()
+        self.ids = tree.add_nodes(self.session, [{"name": f"Node {i}"} for i in range(7)])
+        ids = self.ids
+        tree.add_edges(
+            self.session,
+            [(ids[0], ids[1], {"relation": "child"}), (ids[0], ids[2]), (ids[1], ids[3]), (ids[1], ids[4]),
+             (ids[2], ids[5]), (ids[2], ids[6]), (ids[3], ids[6])],
+        )
+        self.tree = tree
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def test_layout(self):
+        ids = self.ids
+        labels, edges = load_graph(self.session, self.tree)
+        self.assertEqual(labels[ids[3]], "Node 3")
+        self.assertEqual(edges[0], (ids[0], ids[1], "child"))
+
+        roots, children, depth = spanning_forest(labels, edges)
+        self.assertEqual(roots, [ids[0]])
+        # Node 6 has two parents and is placed under the first one reached.
+        self.assertEqual(children[ids[2]], [ids[5], ids[6]])
+        self.assertNotIn(ids[3], children)
+        self.assertEqual(depth[ids[6]], 2)
+
+        shown, hidden = collapse(roots, children)
+        self.assertEqual(hidden, {})
+        positions = tree_layout(roots, shown)
+        self.assertEqual([positions[id] for id in (ids[3], ids[4], ids[5], ids[6])], [(0, -2), (1, -2), (2, -2), (3, -2)])
+        self.assertEqual(positions[ids[1]], (0.5, -1))
+        self.assertEqual(positions[ids[0]], (1.5, 0))
+
+        shown, hidden = collapse(roots, children, max_nodes=4)
+        self.assertEqual(shown, {ids[0]: [ids[1], ids[2]]})
+        self.assertEqual(hidden, {ids[1]: 2, ids[2]: 2})
+        self.assertEqual(collapse(roots, children, max_depth=1)[1], {ids[1]: 2, ids[2]: 2})
+
+        roots, children, _ = spanning_forest(labels, edges, root_id=ids[1])
+        self.assertEqual(sorted(tree_layout(roots, children)), sorted([ids[1], ids[3], ids[4], ids[6]]))
+
+    def test_render(self):
+        self.tree.create_tag(self.session, "v1")
+        self.tree.add_node(self.session, {"name": "Later"})
+        labels, _ = load_graph(self.session, self.tree, tag_name="v1")
+        self.assertEqual(len(labels), 7)
+
+        svg = os.path.join(self.directory, "tree.svg")
+        self.assertEqual(visualize_tree_by_id(self.Session(), self.tree.id, output=svg, tag_name="v1"), svg)
+        with open(svg) as fp:
+            self.assertIn("<svg", fp.read())
+
+        png = os.path.join(self.directory, "figures", "subtree.png")
+        output = visualize_tree_by_id(self.Session(), self.tree.id, output=png, root_id=self.ids[1], max_nodes=2)
+        self.assertEqual(output, png)
+        self.assertGreater(os.path.getsize(png), 0)
+        self.assertIsNone(visualize_tree_by_id(self.Session(), self.tree.id, output=png, root_id=-1))
+
+
+if __name__ == "__main__":
+    unittest.main()
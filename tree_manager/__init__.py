@@ -3,10 +3,32 @@ from .models import (
     TreeNode,
     TreeEdge,
     TreeTag,
+    TreeTagChange,
+    TreeTagNode,
+    TreeTagEdge,
+    TreeClosure,
+    TreeAggregate,
+    TreeOverride,
+    TreeBlob,
+    TreeChange,
     Base,  
 )
+from .cache import (
+    TreeGraphCache,
+    set_graph_cache,
+)
+from .instrumentation import (
+    LoggingSink,
+    MemorySink,
+    PrometheusFileSink,
+    set_instrumentation,
+)
+from .aio import AsyncTree
 from .database import (
     init_db,
+    make_engine,
+    make_async_engine,
+    make_async_sessionmaker,
     SessionLocal,
     engine,
 )
@@ -16,8 +38,26 @@ __all__ = [
     "TreeNode",
     "TreeEdge",
     "TreeTag",
+    "TreeTagChange",
+    "TreeTagNode",
+    "TreeTagEdge",
+    "TreeClosure",
+    "TreeAggregate",
+    "TreeOverride",
+    "TreeBlob",
+    "TreeChange",
     "Base",  
+    "TreeGraphCache",
+    "set_graph_cache",
+    "LoggingSink",
+    "MemorySink",
+    "PrometheusFileSink",
+    "set_instrumentation",
+    "AsyncTree",
     "init_db",
+    "make_engine",
+    "make_async_engine",
+    "make_async_sessionmaker",
     "SessionLocal",
     "engine",
 ]
@@ -0,0 +1,114 @@
+"""
+asyncio facade over ``Tree``, built on SQLAlchemy's asyncio extension.
+
+    from tree_manager.aio import AsyncTree
+    from tree_manager.database import make_async_engine, make_async_sessionmaker
+
+    engine = make_async_engine("sqlite+aiosqlite:///database.db", pool_size=20)
+    Session = make_async_sessionmaker(engine)
+
+    async with Session() as session:
+        tree = await AsyncTree.get(session, 1)
+        children = await tree.get_child_nodes(session, node_id)
+
+Each method runs the matching ``Tree`` method through ``AsyncSession.run_sync``,
+so queries are awaited on the async driver instead of blocking the event loop.
+Returned nodes and edges are plain loaded objects; relationships they did not
+load (e.g. ``edge.outgoing_node``) must be read inside ``session.run_sync``,
+or loaded up front by passing loader options as ``load``. With ``raw=True``
+the read methods return plain ``NodeRow`` / ``EdgeRow`` tuples instead.
+Use sessions from ``make_async_sessionmaker``, which don't expire objects on
+commit.
+"""
+from tree_manager.models import Tree
+
+# Tree methods that take the session as their first argument. Methods marked
+# True return a Tree, which is wrapped in an AsyncTree.
+TREE_METHODS = {
+    "get_by_tag": True,
+    "create_tag": False,
+    "create_new_tree_version_from_tag": True,
+    "restore_from_tag": True,
+    "diff_tags": False,
+    "diff_trees": False,
+    "merge": False,
+    "node_history": False,
+    "subtree_history": False,
+    "export": False,
+    "add_node": False,
+    "add_edge": False,
+    "add_nodes": False,
+    "add_edges": False,
+    "apply_changeset": False,
+    "enable_closure_index": False,
+    "enable_aggregates": False,
+    "recompute_aggregates": False,
+    "get_aggregates": False,
+    "get_ancestors": False,
+    "get_descendants": False,
+    "get_subtree_size": False,
+    "is_ancestor": False,
+    "get_root_nodes": False,
+    "get_node": False,
+    "get_child_nodes": False,
+    "get_parent_nodes": False,
+    "get_node_edges": False,
+    "find_nodes": False,
+    "find_edges": False,
+    "traverse_tree": False,
+    "get_nodes_at_depth": False,
+    "find_path": False,
+}
+
+
+def _unwrap(value):
+    return value.tree if isinstance(value, AsyncTree) else value
+
+
+def _wrap(value):
+    return AsyncTree(value) if isinstance(value, Tree) else value
+
+
+class AsyncTree:
+    """
+    Wraps a ``Tree`` loaded through an ``AsyncSession``; every ``Tree`` method
+    in ``TREE_METHODS`` is available as a coroutine with the same arguments.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __getattr__(self, name):
+        # Columns such as ``id`` and ``name`` are read from the wrapped tree.
+        return getattr(self.tree, name)
+
+    def __repr__(self):
+        return f"AsyncTree({self.tree.id!r}, {self.tree.name!r})"
+
+    @classmethod
+    async def get(cls, session, id):
+        tree = await session.run_sync(Tree.get, id)
+        return _wrap(tree)
+
+    @classmethod
+    async def import_(cls, session, fp, name=None):
+        return _wrap(await session.run_sync(Tree.import_, fp, name))
+
+
+def _async_method(name, returns_tree):
+    method = getattr(Tree, name)
+
+    async def call(self, session, *args, **kwargs):
+        args = [_unwrap(arg) for arg in args]
+        kwargs = {key: _unwrap(value) for key, value in kwargs.items()}
+        result = await session.run_sync(lambda sync_session: method(self.tree, sync_session, *args, **kwargs))
+        return _wrap(result) if returns_tree else result
+
+    call.__name__ = name
+    call.__qualname__ = f"AsyncTree.{name}"
+    call.__doc__ = method.__doc__
+    return call
+
+
+for _name, _returns_tree in TREE_METHODS.items():
+    setattr(AsyncTree, _name, _async_method(_name, _returns_tree))
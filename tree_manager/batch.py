@@ -0,0 +1,299 @@
+"""
+Run one operation over many trees in parallel, in a pool of worker processes.
+
+    from tree_manager.batch import run_batch
+
+    report = run_batch("sqlite:///database.db", "create_tag", tag_name="nightly", workers=8)
+    report["errors"]   # {tree_id: "ValueError: ..."} for the trees that failed
+
+Tree IDs are split into chunks that the workers take one at a time, so a few
+large trees don't hold up the rest. Each worker opens its own engine (with a
+single connection) when it starts, and processes each tree of a chunk in its
+own session and transaction: a tree that fails is rolled back and recorded in
+``errors`` while the others carry on.
+
+Built-in operations are listed in ``OPERATIONS``; any picklable, module-level
+function taking ``(session, tree, **options)`` can be passed instead. Its
+return value is collected in ``results`` and must be picklable too.
+
+On SQLite the database must be a file, and is opened with
+``SQLITE_CONCURRENT_PRAGMAS``: WAL mode lets the workers read while one of
+them writes. SQLite still allows a single writer, so writing operations
+(``create_tag``) only scale with the time they spend outside the write lock;
+reads (``export``, ``diff_tags``, ``check``) scale with the number of cores,
+as do all operations on PostgreSQL. A tree whose write fails because the
+database is locked is retried up to ``LOCK_RETRIES`` times, so custom
+operations should be safe to run again after a rollback.
+
+    python -m tree_manager.batch check [database_url] [--workers 8]
+    python -m tree_manager.batch export [database_url] --directory exports/
+    python -m tree_manager.batch create_tag [database_url] --tag nightly
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager.database import SQLITE_CONCURRENT_PRAGMAS, _database_url, make_engine
+from tree_manager.models import Tree, TreeBlob, TreeEdge, TreeNode, TreeTag
+
+# Upper bound on the number of trees a worker takes at a time. Smaller chunks
+# are used when there are too few trees to give every worker several.
+DEFAULT_CHUNK_SIZE = 64
+
+# Times a tree is retried after the database reported it was locked.
+LOCK_RETRIES = 5
+
+# Seconds to wait before the first retry; doubled on every further one.
+LOCK_RETRY_DELAY = 0.05
+
+# Engine of the current worker process, created by ``_init_worker``.
+_session_factory = None
+
+
+def _create_tag(session, tree, tag_name, description=None):
+    tag = tree.create_tag(session, tag_name, description=description)
+    if not isinstance(tag, TreeTag):
+        raise ValueError(tag)
+    return tag.id
+
+
+def _export(session, tree, directory, format="ndjson", tag_name=None):
+    path = os.path.join(directory, f"tree_{tree.id}.{format}")
+    with open(path, "wb") as fp:
+        counts = tree.export(session, fp, format=format, tag_name=tag_name)
+    return {"path": path, **counts}
+
+
+def _diff_counts(diff):
+    return {kind: {change: len(entries) for change, entries in changes.items()} for kind, changes in diff.items()}
+
+
+def _diff_tags(session, tree, tag_a, tag_b):
+    return _diff_counts(tree.diff_tags(session, tag_a, tag_b))
+
+
+def check_tree(session, tree):
+    """
+    Check that every edge visible in ``tree`` joins two nodes visible in it,
+    and that every interned node and edge payload is stored in tree_blob.
+
+    Returns:
+        list: A description of each problem found; empty if there are none.
+    """
+    nodes = TreeNode.__table__
+    edges = TreeEdge.__table__
+    blobs = TreeBlob.__table__
+    problems = []
+
+    visible = select(nodes.c.id).where(tree._node_filter())
+    dangling = session.execute(
+        select(edges.c.id, edges.c.incoming_node_id, edges.c.outgoing_node_id)
+        .where(
+            tree._edge_filter(),
+            or_(edges.c.incoming_node_id.not_in(visible), edges.c.outgoing_node_id.not_in(visible)),
+        )
+        .order_by(edges.c.id)
+    )
+    for edge_id, incoming_node_id, outgoing_node_id in dangling:
+        problems.append(f"Edge {edge_id} ({incoming_node_id} -> {outgoing_node_id}) joins a node outside the tree.")
+
+    for kind, table, condition in (("Node", nodes, tree._node_filter()), ("Edge", edges, tree._edge_filter())):
+        missing = session.execute(
+            select(table.c.id, table.c.data_hash)
+            .outerjoin(blobs, blobs.c.hash == table.c.data_hash)
+            .where(condition, and_(table.c.data_hash.is_not(None), blobs.c.hash.is_(None)))
+            .order_by(table.c.id)
+        )
+        for row_id, data_hash in missing:
+            problems.append(f"{kind} {row_id} references a missing payload {data_hash}.")
+    return problems
+
+
+def _check(session, tree):
+    problems = check_tree(session, tree)
+    if problems:
+        raise ValueError(" ".join(problems))
+    return "ok"
+
+
+# Operations that can be named in ``run_batch``, with the options they take.
+OPERATIONS = {
+    "create_tag": _create_tag,  # tag_name, description=None
+    "export": _export,  # directory, format="ndjson", tag_name=None
+    "diff_tags": _diff_tags,  # tag_a, tag_b; returns change counts
+    "check": _check,  # raises ValueError listing the problems found
+}
+
+
+def _engine_for(url):
+    if url.startswith("sqlite") and (url in ("sqlite://", "sqlite:///") or ":memory:" in url):
+        raise ValueError("Batches need a database file or server; an in-memory SQLite database is per process.")
+    return make_engine(url, pool_size=1, sqlite_pragmas=SQLITE_CONCURRENT_PRAGMAS)
+
+
+def _init_worker(url):
+    global _session_factory
+    _session_factory = sessionmaker(bind=_engine_for(url))
+
+
+def _is_lock_error(error):
+    return "database is locked" in str(error)
+
+
+def _run_tree(operation, tree_id, options):
+    for attempt in range(LOCK_RETRIES + 1):
+        session = _session_factory()
+        try:
+            tree = Tree.get(session, tree_id)
+            if tree is None:
+                raise ValueError(f"No tree found with ID: {tree_id}.")
+            return True, operation(session, tree, **options)
+        except Exception as e:
+            session.rollback()
+            if attempt < LOCK_RETRIES and _is_lock_error(e):
+                time.sleep(LOCK_RETRY_DELAY * 2**attempt)
+                continue
+            return False, f"{type(e).__name__}: {e}"
+        finally:
+            session.close()
+
+
+def _run_chunk(operation, tree_ids, options):
+    """
+    Run ``operation`` on each tree of a chunk in the current worker.
+
+    Returns:
+        list: ``(tree_id, succeeded, result or error message)`` per tree.
+    """
+    return [(tree_id, *_run_tree(operation, tree_id, options)) for tree_id in tree_ids]
+
+
+def _chunks(tree_ids, workers, chunk_size):
+    if chunk_size is None:
+        chunk_size = max(1, min(DEFAULT_CHUNK_SIZE, math.ceil(len(tree_ids) / (workers * 4))))
+    return [tree_ids[i:i + chunk_size] for i in range(0, len(tree_ids), chunk_size)]
+
+
+def run_batch(url, operation, tree_ids=None, workers=None, chunk_size=None, progress=None, **options):
+    """
+    Run an operation on many trees across a pool of worker processes.
+
+    Args:
+        url: Database URL the workers connect to. Defaults to
+            ``TREE_MANAGER_DATABASE_URL`` or ``DEFAULT_DATABASE_URL``.
+        operation: A name from ``OPERATIONS``, or a module-level function
+            taking ``(session, tree, **options)``.
+        tree_ids: The trees to process; all trees by default.
+        workers: Number of worker processes; defaults to the number of CPUs.
+            With 1, the trees are processed in this process.
+        chunk_size: Trees handed to a worker at a time.
+        progress: Called as ``progress(done, total)`` each time a chunk
+            completes.
+        **options: Passed on to the operation.
+
+    Returns:
+        dict: ``results`` and ``errors`` by tree ID (errors as
+        ``"ExceptionType: message"``), and the wall time in ``seconds``.
+    """
+    if isinstance(operation, str):
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown batch operation: {operation!r}. Expected one of {tuple(OPERATIONS)}.")
+        operation = OPERATIONS[operation]
+    url = _database_url(url)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    if tree_ids is None:
+        engine = _engine_for(url)
+        with engine.connect() as connection:
+            tree_ids = list(connection.scalars(select(Tree.id).order_by(Tree.id)))
+        engine.dispose()
+    tree_ids = list(tree_ids)
+    chunks = _chunks(tree_ids, workers, chunk_size)
+
+    report = {"results": {}, "errors": {}, "seconds": 0.0}
+    done = 0
+
+    def collect(outcomes):
+        nonlocal done
+        for tree_id, succeeded, value in outcomes:
+            report["results" if succeeded else "errors"][tree_id] = value
+        done += len(outcomes)
+        if progress is not None:
+            progress(done, len(tree_ids))
+
+    if workers == 1:
+        global _session_factory
+        previous = _session_factory
+        _init_worker(url)
+        try:
+            for chunk in chunks:
+                collect(_run_chunk(operation, chunk, options))
+        finally:
+            _session_factory.kw["bind"].dispose()
+            _session_factory = previous
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(url,)) as pool:
+            futures = [pool.submit(_run_chunk, operation, chunk, options) for chunk in chunks]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m tree_manager.batch", description="Run an operation on many trees in parallel."
+    )
+    parser.add_argument("operation", choices=sorted(OPERATIONS))
+    parser.add_argument("url", nargs="?", default=None)
+    parser.add_argument("--trees", type=int, nargs="+", help="only these tree IDs")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--tag", help="tag to create, or to export instead of the current state")
+    parser.add_argument("--description")
+    parser.add_argument("--directory", default=".", help="where export writes tree_<id>.<format>")
+    parser.add_argument("--format", default="ndjson")
+    parser.add_argument("--tags", nargs=2, metavar=("TAG_A", "TAG_B"), help="tags compared by diff_tags")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.operation == "create_tag":
+        if not args.tag:
+            parser.error("create_tag needs --tag")
+        options = {"tag_name": args.tag, "description": args.description}
+    elif args.operation == "export":
+        options = {"directory": args.directory, "format": args.format, "tag_name": args.tag}
+    elif args.operation == "diff_tags":
+        if not args.tags:
+            parser.error("diff_tags needs --tags TAG_A TAG_B")
+        options = {"tag_a": args.tags[0], "tag_b": args.tags[1]}
+
+    def progress(done, total):
+        print(f"\r{done}/{total} trees", end="", file=sys.stderr, flush=True)
+
+    report = run_batch(
+        args.url,
+        args.operation,
+        tree_ids=args.trees,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        progress=progress,
+        **options,
+    )
+    print(file=sys.stderr)
+    print(f"{len(report['results'])} succeeded, {len(report['errors'])} failed in {report['seconds']:.1f}s")
+    for tree_id, error in sorted(report["errors"].items()):
+        print(f"Tree {tree_id}: {error}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
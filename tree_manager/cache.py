@@ -0,0 +1,210 @@
+"""
+In-process adjacency cache for the read-heavy ``Tree`` lookups.
+
+Once installed with ``set_graph_cache``, ``Tree.get_child_nodes``,
+``get_parent_nodes`` and ``get_node_edges`` answer from a per-tree adjacency
+loaded with one query and kept in compact integer arrays, instead of issuing a
+query (plus a lazy load per edge) on every call:
+
+    from tree_manager import TreeGraphCache, set_graph_cache
+
+    set_graph_cache(TreeGraphCache(max_trees=32))
+
+``Tree.add_edge`` drops the cached adjacency of its tree. Writes made outside
+the ``Tree`` API (or from another process) are not seen until ``invalidate``
+is called for the tree, or, for trees with ``log_changes`` set, until
+``sync`` reads them from the change log.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy import inspect, select
+
+from tree_manager import models
+from tree_manager.changelog import latest_seq, tail_changes
+from tree_manager.models import TreeEdge, TreeNode
+
+# Number of trees whose adjacency a cache keeps before evicting the least
+# recently used one.
+DEFAULT_MAX_TREES = 64
+
+
+class TreeGraph:
+    """
+    Adjacency of one tree in compressed sparse row form: for each node with
+    edges, a slice of ``(edge_id, neighbour_id)`` pairs ordered by edge ID.
+    """
+
+    def __init__(self, rows):
+        self.children = self._index(sorted(rows, key=lambda row: (row[1], row[0])), 1, 2)
+        self.parents = self._index(sorted(rows, key=lambda row: (row[2], row[0])), 2, 1)
+        self.edge_count = len(rows)
+
+    @staticmethod
+    def _index(rows, key, value):
+        keys, offsets, edge_ids, node_ids = array("q"), array("q"), array("q"), array("q")
+        for row in rows:
+            if not keys or keys[-1] != row[key]:
+                keys.append(row[key])
+                offsets.append(len(edge_ids))
+            edge_ids.append(row[0])
+            node_ids.append(row[value])
+        offsets.append(len(edge_ids))
+        return keys, offsets, edge_ids, node_ids
+
+    @staticmethod
+    def _lookup(index, node_id):
+        keys, offsets, edge_ids, node_ids = index
+        i = bisect_left(keys, node_id)
+        if i == len(keys) or keys[i] != node_id:
+            return [], []
+        start, end = offsets[i], offsets[i + 1]
+        return list(edge_ids[start:end]), list(node_ids[start:end])
+
+    def child_ids(self, node_id):
+        return self._lookup(self.children, node_id)[1]
+
+    def parent_ids(self, node_id):
+        return self._lookup(self.parents, node_id)[1]
+
+    def edge_ids(self, node_id):
+        return sorted(set(self._lookup(self.children, node_id)[0] + self._lookup(self.parents, node_id)[0]))
+
+
+def _load(session, model, ids):
+    """
+    Return the ``model`` instances for ``ids`` in order, taking them from the
+    session's identity map where possible and loading the rest in one query.
+    """
+    mapper = inspect(model)
+    found = {}
+    missing = []
+    for id in ids:
+        instance = session.identity_map.get(mapper.identity_key_from_primary_key((id,)))
+        if instance is None or inspect(instance).expired:
+            missing.append(id)
+        else:
+            found[id] = instance
+    if missing:
+        for instance in session.query(model).filter(model.id.in_(missing)):
+            found[instance.id] = instance
+    return [found[id] for id in ids]
+
+
+class TreeGraphCache:
+    """
+    LRU cache of tree adjacencies, shared by every session of the process.
+
+    Args:
+        max_trees: How many trees to keep before evicting the least recently
+            used one.
+    """
+
+    def __init__(self, max_trees=DEFAULT_MAX_TREES):
+        if max_trees < 1:
+            raise ValueError("max_trees must be at least 1.")
+        self.max_trees = max_trees
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+        # Sequence number of the last change seen by ``sync``.
+        self._seq = None
+
+    def graph(self, session, tree):
+        """
+        Return the adjacency of ``tree``, loading it on a miss.
+        """
+        with self._lock:
+            graph = self._graphs.get(tree.id)
+            if graph is not None:
+                self._graphs.move_to_end(tree.id)
+                self.hits += 1
+                return graph
+            self.misses += 1
+
+        rows = session.execute(
+            select(TreeEdge.id, TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id).where(tree._edge_filter())
+        ).all()
+        graph = TreeGraph(rows)
+
+        with self._lock:
+            self._graphs[tree.id] = graph
+            self._graphs.move_to_end(tree.id)
+            while len(self._graphs) > self.max_trees:
+                self._graphs.popitem(last=False)
+                self.evictions += 1
+        return graph
+
+    def invalidate(self, tree_id=None):
+        """
+        Drop the cached adjacency of ``tree_id``, or of every tree.
+        """
+        with self._lock:
+            if tree_id is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(tree_id, None)
+
+    def sync(self, session):
+        """
+        Drop the adjacency of every tree whose edges changed since the last
+        call, as recorded in the change log. The first call, and any call
+        after the log was compacted past the last change seen, drops every
+        tree.
+
+        Returns:
+            set: The IDs of the trees dropped, or ``None`` if every tree was.
+        """
+        seq = self._seq
+        try:
+            changes = [] if seq is None else list(tail_changes(session, seq))
+        except ValueError:
+            seq = None
+        if seq is None:
+            self._seq = latest_seq(session)
+            self.invalidate()
+            return None
+        tree_ids = {
+            change.tree_id
+            for change in changes
+            if change.op != "add_node" and (change.op != "apply_changeset" or change.payload["edges"])
+        }
+        for tree_id in tree_ids:
+            self.invalidate(tree_id)
+        if changes:
+            self._seq = changes[-1].seq
+        return tree_ids
+
+    def stats(self):
+        with self._lock:
+            return {
+                "trees": len(self._graphs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def get_child_nodes(self, session, tree, node_id):
+        return _load(session, TreeNode, self.graph(session, tree).child_ids(node_id))
+
+    def get_parent_nodes(self, session, tree, node_id):
+        return _load(session, TreeNode, self.graph(session, tree).parent_ids(node_id))
+
+    def get_node_edges(self, session, tree, node_id):
+        return _load(session, TreeEdge, self.graph(session, tree).edge_ids(node_id))
+
+
+def set_graph_cache(cache):
+    """
+    Serve the ``Tree`` adjacency lookups from ``cache``, or query the database
+    again if ``cache`` is ``None``.
+    """
+    models._graph_cache = cache
+
+
+def get_graph_cache():
+    return models._graph_cache
@@ -0,0 +1,163 @@
+"""
+Append-only log of the writes to trees with ``log_changes`` set, so read
+replicas and caches can apply deltas instead of reloading whole trees.
+
+    tree = Tree(name="catalog", log_changes=True)
+    ...
+    seq = latest_seq(session)          # after loading the trees in full
+    for change in tail_changes(session, seq):
+        replica.apply(change)          # change.seq, change.tree_id, change.op, change.payload
+        seq = change.seq
+
+Each write through the ``Tree`` API appends one ``TreeChange`` row in the
+transaction of the write, so a change becomes visible together with the rows it describes.
+The operations and their payloads:
+
+    add_node          {"id", "data"}
+    add_edge          {"id", "incoming_node_id", "outgoing_node_id", "data"}
+    apply_changeset   {"updates": [{"id", "data"}], "nodes": [{"id", "data"}],
+                       "edges": [add_edge payloads]}; also written by add_nodes
+                      and add_edges
+    copy_on_write     {"nodes": [[id, copy_id]], "edges": [[id, copy_id]]}, for
+                      the rows an apply_changeset copied into a copy-on-write
+                      branch, logged before it
+    create_tree       {"name", "source", "origin_tree_id", "origin_tag_id",
+                       "base_tree_id"}, for the trees created by a branch,
+                      restore or import
+    merge             {"branch_tree_id", "nodes", "edges"}, with the counts of
+                      ``Tree.merge``
+
+Payloads are inline, even for trees that intern them. After ``create_tree``
+and ``merge`` consumers load the tree in full. Writes made outside the
+``Tree`` API are not logged.
+
+Sequence numbers are assigned when a change is written. SQLite serializes
+writers, so changes commit in sequence order; on PostgreSQL, concurrent
+writers can commit a change after one with a higher number.
+
+Changes every consumer has applied are dropped with ``compact_changes``, e.g.
+from a scheduled job:
+
+    python -m tree_manager.changelog compact <before_seq> [database_url]
+    python -m tree_manager.changelog tail <since_seq> [database_url]
+
+Tailing from before the last compaction raises ``ValueError``: the consumer
+has missed changes and has to reload.
+"""
+import json
+import sys
+from collections import namedtuple
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager.models import TreeChange
+
+# Operations consumers can apply as deltas; the rest (see the module
+# docstring) require reloading the tree.
+DELTA_OPS = ("add_node", "add_edge", "apply_changeset")
+
+# Changes read per query by ``tail_changes``.
+TAIL_BATCH_SIZE = 1000
+
+# Operation of the markers ``compact_changes`` leaves in place of the changes
+# it drops. Markers have no tree and are never returned by ``tail_changes``.
+COMPACTED_OP = "compacted"
+
+Change = namedtuple("Change", ["seq", "tree_id", "op", "payload", "created_at"])
+
+
+def latest_seq(session):
+    """
+    The sequence number of the latest change, where a consumer that has
+    loaded the current state starts tailing.
+    """
+    seq = session.scalar(select(func.max(TreeChange.seq)).where(TreeChange.tree_id.is_not(None)))
+    return max(seq or 0, _compacted_before(session) - 1)
+
+
+def _compacted_before(session):
+    table = TreeChange.__table__
+    payload = session.scalar(
+        select(table.c.payload).where(table.c.tree_id.is_(None)).order_by(table.c.seq.desc()).limit(1)
+    )
+    return payload["before_seq"] if payload else 0
+
+
+def tail_changes(session, since_seq=0, tree_id=None, batch_size=TAIL_BATCH_SIZE):
+    """
+    Yield the changes after ``since_seq`` in sequence order, reading
+    ``batch_size`` at a time.
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        since_seq: The sequence number of the last change already applied.
+        tree_id: Only yield the changes of this tree.
+        batch_size: Changes read per query.
+
+    Yields:
+        Change: ``(seq, tree_id, op, payload, created_at)`` tuples.
+    """
+    if since_seq < _compacted_before(session) - 1:
+        raise ValueError(f"Changes after {since_seq} have been compacted; reload the trees.")
+    table = TreeChange.__table__
+    query = select(table.c.seq, table.c.tree_id, table.c.op, table.c.payload, table.c.created_at)
+    if tree_id is None:
+        query = query.where(table.c.tree_id.is_not(None))
+    else:
+        query = query.where(table.c.tree_id == tree_id)
+    while True:
+        rows = session.execute(query.where(table.c.seq > since_seq).order_by(table.c.seq).limit(batch_size)).all()
+        for row in rows:
+            yield Change(*row)
+        if len(rows) < batch_size:
+            return
+        since_seq = rows[-1].seq
+
+
+def compact_changes(session, before_seq):
+    """
+    Drop the changes numbered below ``before_seq``, leaving a marker so that
+    consumers still behind them get an error instead of a gap.
+
+    Returns:
+        int: The number of changes dropped.
+    """
+    before_seq = min(before_seq, latest_seq(session) + 1)
+    if before_seq <= _compacted_before(session):
+        return 0
+    table = TreeChange.__table__
+    try:
+        dropped = session.execute(
+            table.delete().where(table.c.seq < before_seq, table.c.tree_id.is_not(None))
+        ).rowcount
+        session.execute(table.delete().where(table.c.tree_id.is_(None)))
+        session.execute(insert(table).values(tree_id=None, op=COMPACTED_OP, payload={"before_seq": before_seq}))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return dropped
+
+
+def main(argv):
+    if len(argv) not in (2, 3) or argv[0] not in ("tail", "compact") or not argv[1].isdigit():
+        print("Usage: python -m tree_manager.changelog {tail <since_seq>|compact <before_seq>} [database_url]")
+        return 1
+
+    command, seq = argv[0], int(argv[1])
+    url = argv[2] if len(argv) == 3 else "sqlite:///database.db"
+    session = sessionmaker(bind=create_engine(url))()
+    try:
+        if command == "tail":
+            for change in tail_changes(session, seq):
+                print(json.dumps({**change._asdict(), "created_at": str(change.created_at)}))
+        else:
+            print(f"Dropped {compact_changes(session, seq)} changes")
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+"""
+Maintenance commands for the closure table behind ``Tree.get_ancestors``,
+``get_descendants``, ``get_subtree_size`` and ``is_ancestor``.
+
+    python -m tree_manager.closure rebuild <tree_id> [database_url]
+    python -m tree_manager.closure check <tree_id> [database_url]
+
+``rebuild`` enables the index on a tree of an existing database (run
+``python -m tree_manager.migrations`` first) and recomputes it from the edges.
+``check`` reports pairs that differ from what the edges imply.
+"""
+import sys
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager.models import Tree, TreeClosure, _closure_pairs
+
+
+def rebuild_closure(session, tree_id):
+    """
+    Enable the closure index for a tree and rebuild it from its edges.
+
+    Returns:
+        int: The number of (ancestor, descendant) pairs stored.
+    """
+    tree = Tree.get(session, tree_id)
+    if not tree:
+        raise ValueError(f"No tree found with ID: {tree_id}.")
+    tree.enable_closure_index(session)
+    return session.scalar(select(func.count()).select_from(TreeClosure).filter_by(tree_id=tree_id))
+
+
+def check_closure(session, tree_id):
+    """
+    Compare the stored closure of a tree against the one implied by its edges.
+
+    Returns:
+        dict: ``missing`` pairs the edges imply but the table lacks, and
+        ``unexpected`` pairs the table holds that the edges don't imply (a
+        pair with the wrong depth shows up in both), each as
+        ``(ancestor_id, descendant_id, depth)`` tuples. Both are empty when
+        the index is consistent.
+    """
+    tree = Tree.get(session, tree_id)
+    if not tree:
+        raise ValueError(f"No tree found with ID: {tree_id}.")
+    expected = _closure_pairs(session, tree)
+    stored = select(TreeClosure.ancestor_id, TreeClosure.descendant_id, TreeClosure.depth).filter_by(
+        tree_id=tree_id
+    )
+    return {
+        "missing": [tuple(row) for row in session.execute(expected.except_(stored))],
+        "unexpected": [tuple(row) for row in session.execute(stored.except_(expected))],
+    }
+
+
+def main(argv):
+    if len(argv) not in (2, 3) or argv[0] not in ("rebuild", "check"):
+        print("Usage: python -m tree_manager.closure {rebuild|check} <tree_id> [database_url]")
+        return 1
+
+    command, tree_id = argv[0], int(argv[1])
+    url = argv[2] if len(argv) == 3 else "sqlite:///database.db"
+    session = sessionmaker(bind=create_engine(url))()
+    try:
+        if command == "rebuild":
+            count = rebuild_closure(session, tree_id)
+            print(f"Rebuilt closure index for tree {tree_id}: {count} pairs.")
+            return 0
+
+        problems = check_closure(session, tree_id)
+        for ancestor_id, descendant_id, depth in problems["missing"]:
+            print(f"missing: {ancestor_id} -> {descendant_id} (depth {depth})")
+        for ancestor_id, descendant_id, depth in problems["unexpected"]:
+            print(f"unexpected: {ancestor_id} -> {descendant_id} (depth {depth})")
+        if problems["missing"] or problems["unexpected"]:
+            return 1
+        print(f"Closure index for tree {tree_id} is consistent.")
+        return 0
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,132 @@
-from sqlalchemy import create_engine
+import os
+import weakref
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from tree_manager.models import Base
 
-engine = create_engine("sqlite:///database.db")
+# Used when no URL is passed and TREE_MANAGER_DATABASE_URL is not set.
+DEFAULT_DATABASE_URL = "sqlite:///database.db"
+
+# Pragmas suited to a SQLite file shared by concurrent readers and a writer:
+# readers no longer block on the writer, and a busy connection waits for the
+# lock instead of failing straight away.
+SQLITE_CONCURRENT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+}
+
+# Pragmas applied by ``init_db(profile=...)``. "production" adds a 256 MiB
+# memory map, a 64 MiB page cache and in-memory temporary tables to the
+# concurrent settings.
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        **SQLITE_CONCURRENT_PRAGMAS,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+# The pragmas registered for each engine, read by its connect listener.
+_engine_pragmas = weakref.WeakKeyDictionary()
+
+
+def _database_url(url):
+    return url or os.environ.get("TREE_MANAGER_DATABASE_URL", DEFAULT_DATABASE_URL)
+
+
+def _engine_options(url, pool_size, max_overflow, options):
+    options = dict(options)
+    # In-memory SQLite uses a single shared connection, which takes no pool sizing.
+    if pool_size is not None and ":memory:" not in url:
+        options["pool_size"] = pool_size
+    if max_overflow is not None and ":memory:" not in url:
+        options["max_overflow"] = max_overflow
+    return options
+
+
+def _apply_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+    if engine in _engine_pragmas:
+        _engine_pragmas[engine].update(pragmas)
+        return
+    configured = _engine_pragmas[engine] = dict(pragmas)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in configured.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def sqlite_profile(profile):
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile!r}. Expected one of {tuple(SQLITE_PROFILES)}.")
+    return SQLITE_PROFILES[profile]
+
+
+def make_engine(url=None, pool_size=None, max_overflow=None, sqlite_pragmas=None, **options):
+    """
+    Create an engine for the tree tables.
+
+    Args:
+        url: Database URL, e.g. ``postgresql+psycopg://user@host/trees``.
+            Defaults to ``TREE_MANAGER_DATABASE_URL`` or ``DEFAULT_DATABASE_URL``.
+        pool_size: Connections kept open by the pool.
+        max_overflow: Connections opened beyond ``pool_size`` under load.
+        sqlite_pragmas: ``{name: value}`` pragmas run on every new SQLite
+            connection, e.g. ``SQLITE_CONCURRENT_PRAGMAS``. Ignored on other
+            backends.
+        **options: Passed on to ``create_engine``.
+    """
+    url = _database_url(url)
+    engine = create_engine(url, **_engine_options(url, pool_size, max_overflow, options))
+    _apply_sqlite_pragmas(engine, sqlite_pragmas)
+    return engine
+
+
+def make_async_engine(url=None, pool_size=None, max_overflow=None, sqlite_pragmas=None, **options):
+    """
+    Create an asyncio engine, taking the same arguments as ``make_engine``.
+    The URL must name an async driver, e.g. ``sqlite+aiosqlite:///database.db``
+    or ``postgresql+asyncpg://user@host/trees``.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = _database_url(url)
+    engine = create_async_engine(url, **_engine_options(url, pool_size, max_overflow, options))
+    _apply_sqlite_pragmas(engine.sync_engine, sqlite_pragmas)
+    return engine
+
+
+def make_async_sessionmaker(engine):
+    """
+    Session factory for ``AsyncTree``. Objects are not expired on commit, so
+    the nodes and edges returned by a call stay readable without another
+    round trip to the database.
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+def init_db(bind=None, profile="default"):
+    """
+    Create the tables and indexes, and configure SQLite connections of
+    ``bind`` (the module engine by default) with the pragmas of ``profile``.
+    Pooled connections are closed so every connection picks them up.
+    """
+    bind = bind or engine
+    pragmas = sqlite_profile(profile)
+    if pragmas and bind.dialect.name == "sqlite":
+        _apply_sqlite_pragmas(bind, pragmas)
+        bind.dispose()
+    Base.metadata.create_all(bind=bind)
@@ -0,0 +1,293 @@
+"""
+Streaming export and import of trees, for backups and for moving a tree (or
+the state recorded by one of its tags) to another database.
+
+    python -m tree_manager.export export <tree_id> <file> [database_url] [--format msgpack] [--tag name]
+    python -m tree_manager.export import <file> [database_url]
+
+A stream is a header record followed by one record per node and then one per
+edge, each with its payload inlined:
+
+    {"type": "tree", "version": 1, "name": ..., "intern_payloads": ..., "closure_indexed": ...,
+     "row_snapshots": ..., "aggregates": ..., "log_changes": ...}
+    {"type": "node", "id": ..., "data": ...}
+    {"type": "edge", "id": ..., "incoming_node_id": ..., "outgoing_node_id": ..., "data": ...}
+
+``ndjson`` writes one JSON document per line; ``msgpack`` (requires the
+``msgpack`` package) writes the same records as consecutive MessagePack
+objects. Both directions work ``BULK_BATCH_SIZE`` rows at a time, so apart
+from the old-to-new node ID map kept while importing, memory use does not
+depend on the size of the tree.
+"""
+import json
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager.models import (
+    BULK_BATCH_SIZE,
+    Tree,
+    TreeTag,
+    _aggregates_rebuild,
+    _bulk_insert_edges,
+    _bulk_insert_nodes,
+    _chunked,
+    _closure_rebuild,
+    _created_from,
+    _log_change,
+    _new_payloads,
+    _resolve_payloads,
+    _row_entry,
+    _stream_rows,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ("ndjson", "msgpack")
+FORMAT_VERSION = 1
+
+# Bytes read at a time when decoding a msgpack stream.
+READ_SIZE = 1 << 16
+
+
+def _record_writer(fp, format):
+    if format == "ndjson":
+        return lambda record: fp.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+    if format == "msgpack":
+        if msgpack is None:
+            raise ImportError("The msgpack format requires the msgpack package.")
+        packer = msgpack.Packer()
+        return lambda record: fp.write(packer.pack(record))
+    raise ValueError(f"Unknown export format: {format!r}. Expected one of {FORMATS}.")
+
+
+def _read_records(fp):
+    """
+    Yield the records of an export stream, telling the format apart by its
+    first byte (NDJSON records start with ``{``).
+    """
+    first = fp.read(1)
+    if not first:
+        return
+    if first == b"{":
+        yield json.loads(first + fp.readline())
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    if msgpack is None:
+        raise ImportError("Reading a msgpack export requires the msgpack package.")
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(first)
+    while True:
+        yield from unpacker
+        chunk = fp.read(READ_SIZE)
+        if not chunk:
+            return
+        unpacker.feed(chunk)
+
+
+def _tree_records(session, tree):
+    for kind in ("nodes", "edges"):
+        for chunk in _chunked(_stream_rows(session, tree, kind), BULK_BATCH_SIZE):
+            yield kind, _resolve_payloads(session, [_row_entry(kind, row) for row in chunk])
+
+
+def _tag_records(session, tag):
+    state = tag.load_snapshot(session, resolve_payloads=False)
+    for kind in ("nodes", "edges"):
+        for chunk in _chunked(state[kind], BULK_BATCH_SIZE):
+            yield kind, _resolve_payloads(session, [dict(entry) for entry in chunk])
+
+
+def export_tree(session, tree, fp, format="ndjson", tag_name=None):
+    """
+    Write a tree, or the state recorded by one of its tags, to a binary file.
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        tree: The tree to export.
+        fp: A file object opened for writing bytes.
+        format: ``"ndjson"`` or ``"msgpack"``.
+        tag_name: Export the state recorded by this tag instead of the
+            current one.
+
+    Returns:
+        dict: The number of ``nodes`` and ``edges`` written.
+    """
+    write = _record_writer(fp, format)
+    if tag_name is None:
+        chunks = _tree_records(session, tree)
+    else:
+        tag = session.query(TreeTag).filter_by(tree_id=tree.id, tag_name=tag_name).first()
+        if not tag:
+            raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+        chunks = _tag_records(session, tag)
+
+    write(
+        {
+            "type": "tree",
+            "version": FORMAT_VERSION,
+            "name": tree.name if tag_name is None else f"{tree.name}_{tag_name}",
+            "intern_payloads": tree.intern_payloads,
+            "closure_indexed": tree.closure_indexed,
+            "row_snapshots": tree.row_snapshots,
+            "aggregates": tree.aggregates,
+            "log_changes": tree.log_changes,
+        }
+    )
+    counts = {"nodes": 0, "edges": 0}
+    for kind, entries in chunks:
+        record_type = kind[:-1]
+        for entry in entries:
+            write({"type": record_type, **entry})
+        counts[kind] += len(entries)
+    return counts
+
+
+def import_tree(session, fp, name=None):
+    """
+    Create a new tree from an export stream written by ``export_tree``.
+
+    Node and edge IDs are assigned afresh; the stream's IDs are only used to
+    connect edges to their nodes. Everything is written in one transaction.
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        fp: A file object opened for reading bytes.
+        name: Name of the new tree; defaults to the name in the stream.
+
+    Returns:
+        Tree: The imported tree.
+    """
+    records = _read_records(fp)
+    header = next(records, None)
+    if not header or header.get("type") != "tree":
+        raise ValueError("Not a tree export: the stream does not start with a tree header.")
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export version: {header.get('version')}.")
+
+    try:
+        tree = Tree(
+            name=name or header["name"],
+            intern_payloads=header.get("intern_payloads", False),
+            closure_indexed=header.get("closure_indexed", False),
+            row_snapshots=header.get("row_snapshots", False),
+            aggregates=header.get("aggregates"),
+            log_changes=header.get("log_changes", False),
+        )
+        session.add(tree)
+        session.flush()
+
+        node_mapping = {}
+        pending_nodes = []
+        pending_edges = []
+
+        def flush_nodes():
+            payloads = _new_payloads(session, [node["data"] for node in pending_nodes], tree.intern_payloads)
+            new_ids = _bulk_insert_nodes(session, tree.id, payloads)
+            node_mapping.update(zip((node["id"] for node in pending_nodes), new_ids))
+            pending_nodes.clear()
+
+        def flush_edges():
+            for edge in pending_edges:
+                for node_id in (edge["incoming_node_id"], edge["outgoing_node_id"]):
+                    if node_id not in node_mapping:
+                        raise ValueError(f"Edge refers to a node missing from the export: {node_id}.")
+            payloads = _new_payloads(session, [edge["data"] for edge in pending_edges], tree.intern_payloads)
+            _bulk_insert_edges(
+                session,
+                [
+                    {
+                        "tree_id": tree.id,
+                        "incoming_node_id": node_mapping[edge["incoming_node_id"]],
+                        "outgoing_node_id": node_mapping[edge["outgoing_node_id"]],
+                        **payload,
+                    }
+                    for edge, payload in zip(pending_edges, payloads)
+                ],
+            )
+            pending_edges.clear()
+
+        for record in records:
+            if record["type"] == "node":
+                pending_nodes.append(record)
+                if len(pending_nodes) == BULK_BATCH_SIZE:
+                    flush_nodes()
+            elif record["type"] == "edge":
+                if pending_nodes:
+                    flush_nodes()
+                pending_edges.append(record)
+                if len(pending_edges) == BULK_BATCH_SIZE:
+                    flush_edges()
+            else:
+                raise ValueError(f"Unknown record type in tree export: {record['type']!r}.")
+        if pending_nodes:
+            flush_nodes()
+        if pending_edges:
+            flush_edges()
+
+        if tree.closure_indexed:
+            _closure_rebuild(session, tree)
+        if tree.aggregates:
+            _aggregates_rebuild(session, tree)
+        _log_change(session, tree, "create_tree", _created_from(tree, "import"))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return tree
+
+
+def main(argv):
+    options = {}
+    args = []
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg in ("--format", "--tag") and argv:
+            options[arg] = argv.pop(0)
+        else:
+            args.append(arg)
+
+    if args[:1] == ["export"] and len(args) in (3, 4):
+        tree_id, path = int(args[1]), args[2]
+        url = args[3] if len(args) == 4 else "sqlite:///database.db"
+    elif args[:1] == ["import"] and len(args) in (2, 3):
+        path = args[1]
+        url = args[2] if len(args) == 3 else "sqlite:///database.db"
+    else:
+        print(
+            "Usage: python -m tree_manager.export export <tree_id> <file> [database_url] "
+            "[--format ndjson|msgpack] [--tag name]\n"
+            "       python -m tree_manager.export import <file> [database_url]"
+        )
+        return 1
+
+    session = sessionmaker(bind=create_engine(url))()
+    try:
+        if args[0] == "export":
+            tree = Tree.get(session, tree_id)
+            if not tree:
+                raise ValueError(f"No tree found with ID: {tree_id}.")
+            with open(path, "wb") as fp:
+                counts = export_tree(
+                    session, tree, fp, format=options.get("--format", "ndjson"), tag_name=options.get("--tag")
+                )
+            print(f"Exported tree {tree_id}: {counts['nodes']} nodes, {counts['edges']} edges.")
+        else:
+            with open(path, "rb") as fp:
+                tree = import_tree(session, fp)
+            print(f"Imported {path} as tree {tree.id} ({tree.name}).")
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,265 @@
+"""
+Per-call instrumentation of the public ``Tree`` methods.
+
+Once a sink is installed with ``set_instrumentation``, every call of a public
+``Tree`` method is measured and handed to the sink as a dict:
+
+    {"method": "find_path", "tree_id": 3, "statements": 1204, "rows": 1310,
+     "objects": 1207, "seconds": 3.02, "error": None}
+
+``statements`` counts SQL statements sent to the database, ``rows`` the rows
+fetched back from the DBAPI cursor and ``objects`` the ORM instances loaded,
+so an N+1 pattern shows up as ``statements`` growing with the result. Calls
+a method makes to other ``Tree`` methods are counted in the outer call only.
+``error`` is the exception class name if the call raised.
+
+    from tree_manager.instrumentation import LoggingSink, MemorySink, set_instrumentation
+
+    sink = MemorySink()
+    set_instrumentation(sink)
+    ...
+    sink.stats()["find_path"]  # {"calls": ..., "statements": ..., "seconds": ..., ...}
+
+``LoggingSink`` logs each call (or only the slow ones), and
+``PrometheusFileSink`` keeps the same totals as ``MemorySink`` and writes them
+in the Prometheus text format, e.g. for the node exporter's textfile
+collector. Any object with a ``record(call)`` method can be used as a sink.
+
+The SQLAlchemy listeners are only registered while a sink is installed; with
+none, a ``Tree`` method call costs one extra function call. Generator methods
+(``iter_diff_tags``, ``iter_diff_trees``) are not measured, since their work
+happens as the caller consumes them.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from tree_manager import models
+from tree_manager.models import Base, Tree
+
+# Counters of the Tree call being measured in the current context, if any.
+_active = contextvars.ContextVar("tree_manager_call", default=None)
+
+# Totals kept by MemorySink for each method.
+STAT_FIELDS = ("calls", "errors", "statements", "rows", "objects", "seconds", "max_seconds")
+
+# Seconds between two writes of a PrometheusFileSink.
+DEFAULT_WRITE_INTERVAL = 10.0
+
+
+class _CountingCursor:
+    """DBAPI cursor proxy counting the rows fetched through it."""
+
+    def __init__(self, cursor, call):
+        self._cursor = cursor
+        self._call = call
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._call["rows"] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._call["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._call["rows"] += len(rows)
+        return rows
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    call = _active.get()
+    if call is None:
+        return
+    call["statements"] += 1
+    if context is not None and cursor.description is not None:
+        context.cursor = _CountingCursor(cursor, call)
+
+
+def _on_load(target, context):
+    call = _active.get()
+    if call is not None:
+        call["objects"] += 1
+
+
+class Instrumentation:
+    """
+    Measures ``Tree`` calls for one sink. Installed by ``set_instrumentation``.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def measure(self, method, tree, call):
+        if _active.get() is not None:
+            return call()
+        record = {
+            "method": method,
+            "tree_id": tree.id if isinstance(tree, Tree) else None,
+            "statements": 0,
+            "rows": 0,
+            "objects": 0,
+            "seconds": 0.0,
+            "error": None,
+        }
+        token = _active.set(record)
+        start = time.perf_counter()
+        try:
+            return call()
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            _active.reset(token)
+            self.sink.record(record)
+
+
+_listening = False
+
+
+def set_instrumentation(sink):
+    """
+    Measure every ``Tree`` call and pass it to ``sink``, or stop measuring if
+    ``sink`` is ``None``.
+    """
+    global _listening
+    if sink is None:
+        models._instrumentation = None
+        if _listening:
+            event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.remove(Base, "load", _on_load)
+            _listening = False
+        return
+    if not _listening:
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Base, "load", _on_load, propagate=True)
+        _listening = True
+    models._instrumentation = Instrumentation(sink)
+
+
+def get_instrumentation():
+    instrumentation = models._instrumentation
+    return instrumentation.sink if instrumentation is not None else None
+
+
+class MemorySink:
+    """
+    Keeps running totals per method, shared by every thread of the process.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        with self._lock:
+            stats = self._stats.setdefault(call["method"], dict.fromkeys(STAT_FIELDS, 0))
+            stats["calls"] += 1
+            stats["errors"] += call["error"] is not None
+            for field in ("statements", "rows", "objects", "seconds"):
+                stats[field] += call[field]
+            stats["max_seconds"] = max(stats["max_seconds"], call["seconds"])
+
+    def stats(self):
+        """
+        Returns:
+            dict: ``{method: {"calls", "errors", "statements", "rows",
+            "objects", "seconds", "max_seconds"}}`` for every method called.
+        """
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LoggingSink:
+    """
+    Logs one line per call taking at least ``min_seconds``.
+
+    Args:
+        logger: Defaults to the ``tree_manager`` logger.
+        level: Level of the log records.
+        min_seconds: Only log calls at least this slow.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO, min_seconds=0.0):
+        self.logger = logger or logging.getLogger("tree_manager")
+        self.level = level
+        self.min_seconds = min_seconds
+
+    def record(self, call):
+        if call["seconds"] < self.min_seconds:
+            return
+        self.logger.log(
+            self.level,
+            "Tree.%s tree=%s: %d statements, %d rows, %d objects in %.3fs%s",
+            call["method"],
+            call["tree_id"],
+            call["statements"],
+            call["rows"],
+            call["objects"],
+            call["seconds"],
+            f" (raised {call['error']})" if call["error"] else "",
+        )
+
+
+class PrometheusFileSink(MemorySink):
+    """
+    Keeps the totals of ``MemorySink`` and writes them to ``path`` in the
+    Prometheus text format, at most once every ``interval`` seconds (and on
+    ``write()``). The file is replaced atomically.
+    """
+
+    METRICS = (
+        ("calls", "tree_manager_calls_total", "counter", "Calls of the Tree method."),
+        ("errors", "tree_manager_errors_total", "counter", "Calls of the Tree method that raised."),
+        ("statements", "tree_manager_statements_total", "counter", "SQL statements executed."),
+        ("rows", "tree_manager_rows_total", "counter", "Rows fetched from the database."),
+        ("objects", "tree_manager_objects_loaded_total", "counter", "ORM objects loaded."),
+        ("seconds", "tree_manager_seconds_total", "counter", "Wall time spent in the Tree method."),
+        ("max_seconds", "tree_manager_max_seconds", "gauge", "Slowest call of the Tree method."),
+    )
+
+    def __init__(self, path, interval=DEFAULT_WRITE_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self._written_at = None
+
+    def record(self, call):
+        super().record(call)
+        now = time.monotonic()
+        if self._written_at is None or now - self._written_at >= self.interval:
+            self._written_at = now
+            self.write()
+
+    def render(self):
+        stats = self.stats()
+        lines = []
+        for field, name, kind, help in self.METRICS:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for method in sorted(stats):
+                lines.append(f'{name}{{method="{method}"}} {stats[method][field]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as fp:
+            fp.write(self.render())
+        os.replace(temporary, self.path)
@@ -0,0 +1,398 @@
+"""
+Three-way merge of a branch back into the tree it was created from.
+
+    report = tree.merge(session, branch, "v1")
+    report["conflicts"]   # empty if the branch merged cleanly
+
+The tag is the common ancestor: nodes and edges the branch changed since the
+tag are carried over unless the tree changed them too. Rows are matched by
+identity rather than ID: every copy made by a branch, restore or merge
+records the row it was copied from in ``origin_id``, and the copies of a row
+share the ID of the first one.
+
+All three states are read with one query each (or from the tag's snapshot)
+and compared in memory, payloads as their stored JSON text, so only the
+payloads that changed are decoded. The changes are then written with batched
+statements in a single transaction.
+
+Conflicts are reported as dicts::
+
+    {"kind": "nodes" | "edges", "id": <id in the tree>, "type": ...,
+     "base": <entry at the tag>, "source": <entry in the tree>, "branch": <entry in the branch>}
+
+with entries in the snapshot format and ``type`` one of ``CONFLICT_TYPES``.
+"""
+import hashlib
+import json
+
+from sqlalchemy import String, bindparam, cast, func, select, update
+
+from tree_manager.models import (
+    BULK_BATCH_SIZE,
+    Tree,
+    TreeAggregate,
+    TreeClosure,
+    TreeEdge,
+    TreeNode,
+    TreeTag,
+    _aggregates_rebuild,
+    _bulk_insert_edges,
+    _canonical_json,
+    _chunked,
+    _closure_rebuild,
+    _insert_returning_ids,
+    _invalidate_graph,
+    _log_change,
+    _resolve_payloads,
+)
+
+# Why a node or edge could not be merged:
+#   modified         changed differently in the tree and in the branch
+#   added            added to both with different contents (e.g. nodes the
+#                    tree gained between the tag and the branch)
+#   source_removed   removed from the tree, changed in the branch
+#   branch_removed   removed from the branch, changed in the tree
+#   dangling         removing a node would leave edges to it, or an edge
+#                    joins a node the merge removes
+CONFLICT_TYPES = ("modified", "added", "source_removed", "branch_removed", "dangling")
+
+# Ways ``merge`` can settle conflicts: keep the tree's side, or take the
+# branch's. Dangling conflicts always keep the nodes and drop the edges.
+RESOLUTIONS = ("source", "branch")
+
+ENDPOINTS = ("incoming_node_id", "outgoing_node_id")
+
+SIDES = ("base", "source", "branch")
+
+
+def _read_rows(session, tree, kind):
+    """
+    Read the nodes or edges visible in ``tree``.
+
+    Returns:
+        dict: ``{identity: entry}``, where the identity is the ID of the row
+        the entry was first copied from. Entries are like snapshot entries,
+        with their ID in ``tree``, but hold inline payloads as JSON text under
+        ``json`` instead of ``data``.
+    """
+    table = (TreeNode if kind == "nodes" else TreeEdge).__table__
+    columns = [table.c.id, func.coalesce(table.c.origin_id, table.c.id)]
+    if kind == "edges":
+        columns += [table.c.incoming_node_id, table.c.outgoing_node_id]
+    condition = tree._node_filter() if kind == "nodes" else tree._edge_filter()
+    rows = session.execute(
+        select(*columns, cast(table.c.data, String), table.c.data_hash).where(condition).order_by(table.c.id)
+    )
+    entries = {}
+    for id, identity, *endpoints, text, data_hash in rows:
+        entry = {"id": id, **dict(zip(ENDPOINTS, endpoints))}
+        if data_hash is not None:
+            entry["data_hash"] = data_hash
+        else:
+            entry["json"] = text
+        entries[identity] = entry
+    return entries
+
+
+def _encoded(entry):
+    """
+    Turn a snapshot entry into the form read by ``_read_rows``.
+    """
+    entry = dict(entry)
+    if "data_hash" not in entry:
+        entry["json"] = json.dumps(entry.pop("data", None))
+    return entry
+
+
+def _decoded(entry):
+    """
+    Turn an entry read by ``_read_rows`` back into a snapshot entry.
+    """
+    entry = dict(entry)
+    if "json" in entry:
+        text = entry.pop("json")
+        entry["data"] = None if text is None else json.loads(text)
+    return entry
+
+
+def _stored(entry):
+    if "data_hash" in entry:
+        return {"data": None, "data_hash": entry["data_hash"]}
+    return {"data": _decoded(entry)["data"], "data_hash": None}
+
+
+def _same(a, b):
+    """
+    Whether two entries hold the same endpoints and payload, whether the
+    payloads are inline or interned.
+    """
+    if any(a.get(key) != b.get(key) for key in ENDPOINTS):
+        return False
+    if "data_hash" in a and "data_hash" in b:
+        return a["data_hash"] == b["data_hash"]
+    if "json" in a and "json" in b and a["json"] == b["json"]:
+        return True
+    a, b = _stored(a), _stored(b)
+    if a["data_hash"] is None and b["data_hash"] is None:
+        return a["data"] == b["data"]
+    return _digest(a) == _digest(b)
+
+
+def _digest(payload):
+    if payload["data_hash"] is not None:
+        return payload["data_hash"]
+    return hashlib.sha256(_canonical_json(payload["data"]).encode()).hexdigest()
+
+
+def _three_way(kind, base, source, branch, conflicts):
+    """
+    Merge one kind of row. ``base``, ``source`` and ``branch`` map IDs in the
+    tree to entries; rows new to the tree are keyed ``("new", identity)`` in
+    ``branch``.
+
+    Returns:
+        dict: ``updates`` (``{id: branch entry}``), ``removals`` (IDs),
+        ``additions`` (branch entries of rows new to the tree) and
+        ``pending``: what each conflict would change if the branch won, as
+        ``{id: branch entry or None}``.
+    """
+    plan = {"updates": {}, "removals": set(), "additions": [], "pending": {}}
+    for id in base.keys() | source.keys() | branch.keys():
+        old, ours, theirs = base.get(id), source.get(id), branch.get(id)
+        if isinstance(id, tuple):
+            plan["additions"].append(theirs)
+            continue
+        if old is None:
+            branch_changed, source_changed = theirs is not None, ours is not None
+        else:
+            branch_changed = theirs is None or not _same(old, theirs)
+            source_changed = ours is None or not _same(old, ours)
+        if not branch_changed:
+            continue
+        if not source_changed:
+            if theirs is None:
+                plan["removals"].add(id)
+            else:
+                plan["updates"][id] = theirs
+            continue
+        if ours is None and theirs is None or ours is not None and theirs is not None and _same(ours, theirs):
+            continue
+        if old is None:
+            conflict_type = "added"
+        elif ours is None:
+            conflict_type = "source_removed"
+        elif theirs is None:
+            conflict_type = "branch_removed"
+        else:
+            conflict_type = "modified"
+        conflicts.append(
+            {"kind": kind, "id": id, "type": conflict_type, "base": old, "source": ours, "branch": theirs}
+        )
+        plan["pending"][id] = theirs
+    return plan
+
+
+def _remove_rows(session, table, ids):
+    for chunk in _chunked(sorted(ids), BULK_BATCH_SIZE):
+        session.execute(table.delete().where(table.c.id.in_(chunk)))
+
+
+def _update_rows(session, table, entries, columns=()):
+    values = {column: bindparam(f"new_{column}") for column in columns}
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(data=bindparam("new_data"), data_hash=bindparam("new_hash"), **values)
+    )
+    for chunk in _chunked(entries.items(), BULK_BATCH_SIZE):
+        rows = []
+        for id, entry in chunk:
+            payload = _stored(entry)
+            row = {"row_id": id, "new_data": payload["data"], "new_hash": payload["data_hash"]}
+            row.update({f"new_{column}": entry[column] for column in columns})
+            rows.append(row)
+        session.connection().execute(stmt, rows)
+
+
+def merge_branch(session, tree, branch, base_tag=None, resolve=None):
+    """
+    Merge the changes ``branch`` made since ``base_tag`` into ``tree``. See
+    ``Tree.merge``.
+    """
+    if resolve is not None and resolve not in RESOLUTIONS:
+        raise ValueError(f"Unknown conflict resolution: {resolve!r}. Expected one of {RESOLUTIONS}.")
+    if tree.base_tree_id is not None:
+        raise ValueError("Cannot merge into a copy-on-write branch, whose rows are shared with its base tree.")
+    if base_tag is None:
+        if branch.origin_tree_id != tree.id:
+            raise ValueError(f"Tree {branch.id} was not branched from tree {tree.id}; name the base tag.")
+        tag = session.get(TreeTag, branch.origin_tag_id)
+    else:
+        tag = session.query(TreeTag).filter_by(tree_id=tree.id, tag_name=base_tag).first()
+    if tag is None:
+        raise ValueError(f"Tag '{base_tag}' does not exist for this tree.")
+
+    snapshot = tag.load_snapshot(session, resolve_payloads=False)
+    conflicts = []
+    plans = {}
+    # Branch node IDs mapped to the IDs of the same nodes in the tree.
+    node_ids = {}
+    for kind in ("nodes", "edges"):
+        source_rows = _read_rows(session, tree, kind)
+        source = {entry["id"]: entry for entry in source_rows.values()}
+        base = {entry["id"]: _encoded(entry) for entry in snapshot[kind] if "id" in entry}
+        branch_rows = _read_rows(session, branch, kind)
+        theirs = {}
+        for identity, entry in branch_rows.items():
+            if identity in source_rows:
+                id = source_rows[identity]["id"]
+            elif identity in base:
+                id = identity
+            else:
+                id = None
+            if kind == "nodes":
+                node_ids[entry["id"]] = id if id is not None else ("new", identity)
+            else:
+                entry.update({key: node_ids[entry[key]] for key in ENDPOINTS})
+            if id is None:
+                # New to the tree: keep the branch identity so a later merge
+                # of the same branch matches the copy.
+                entry.pop("id")
+                entry["origin_id"] = identity
+                theirs[("new", identity)] = entry
+            else:
+                entry["id"] = id
+                theirs[id] = entry
+        plans[kind] = _three_way(kind, base, source, theirs, conflicts)
+        plans[kind]["source"] = source
+
+    # Nodes removed from the tree that the branch puts back, under new IDs.
+    readded = {}
+    for kind, plan in plans.items():
+        pending = plan.pop("pending")
+        if resolve != "branch":
+            continue
+        for id, entry in pending.items():
+            if entry is None:
+                plan["removals"].add(id)
+            elif id in plan["source"]:
+                plan["updates"][id] = entry
+            else:
+                # Removed from the tree: added back as a copy.
+                entry = {key: value for key, value in entry.items() if key != "id"}
+                plan["additions"].append(dict(entry, origin_id=id))
+                if kind == "nodes":
+                    readded[id] = ("new", id)
+
+    nodes, edges = plans["nodes"], plans["edges"]
+    for entry in edges["additions"] + list(edges["updates"].values()):
+        entry.update({key: readded.get(entry[key], entry[key]) for key in ENDPOINTS})
+
+    # A removed node must not keep edges, and an edge needs both its nodes.
+    kept_edges = [
+        edges["updates"].get(id, entry) for id, entry in edges["source"].items() if id not in edges["removals"]
+    ] + edges["additions"]
+    for entry in kept_edges:
+        for key in ENDPOINTS:
+            if entry[key] in nodes["removals"]:
+                nodes["removals"].discard(entry[key])
+                conflicts.append(
+                    {
+                        "kind": "nodes",
+                        "id": entry[key],
+                        "type": "dangling",
+                        "base": None,
+                        "source": nodes["source"][entry[key]],
+                        "branch": None,
+                    }
+                )
+    remaining = (nodes["source"].keys() - nodes["removals"]) | {
+        ("new", entry["origin_id"]) for entry in nodes["additions"]
+    }
+    for entry in edges["additions"] + list(edges["updates"].values()):
+        if all(entry[key] in remaining for key in ENDPOINTS):
+            continue
+        conflicts.append(
+            {"kind": "edges", "id": entry.get("id"), "type": "dangling", "base": None, "source": None, "branch": entry}
+        )
+        if "id" in entry:
+            del edges["updates"][entry["id"]]
+        else:
+            edges["additions"].remove(entry)
+
+    report = {
+        kind: {"added": len(plan["additions"]), "modified": len(plan["updates"]), "removed": len(plan["removals"])}
+        for kind, plan in plans.items()
+    }
+    report["conflicts"] = [
+        {**conflict, **{side: _decoded(conflict[side]) for side in SIDES if conflict[side] is not None}}
+        for conflict in conflicts
+    ]
+    _resolve_payloads(
+        session, [conflict[side] for conflict in report["conflicts"] for side in SIDES if conflict[side] is not None]
+    )
+    report["applied"] = not conflicts or resolve is not None
+    if not report["applied"] or not any(report[kind][change] for kind in plans for change in report[kind]):
+        return report
+
+    _check_shared(session, tree, nodes, edges)
+    try:
+        _apply(session, tree, nodes, edges)
+        _log_change(
+            session, tree, "merge", {"branch_tree_id": branch.id, "nodes": report["nodes"], "edges": report["edges"]}
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    _invalidate_graph(tree.id)
+    return report
+
+
+def _check_shared(session, tree, nodes, edges):
+    """
+    Refuse merges that would remove or rewrite rows a copy-on-write branch of
+    the tree still reads in place: the branch's state, and its cached
+    adjacency, would change under it.
+    """
+    for kind, plan in (("nodes", nodes), ("edges", edges)):
+        if tree._shared_ids(session, kind, [*plan["removals"], *plan["updates"]]):
+            raise ValueError(f"The merge changes {kind} shared with a copy-on-write branch of this tree.")
+
+
+def _apply(session, tree, nodes, edges):
+    node_table = TreeNode.__table__
+    edge_table = TreeEdge.__table__
+    if nodes["removals"] and (tree.closure_indexed or tree.aggregates):
+        # Rebuilt below; their rows reference the nodes being removed.
+        for table in (TreeClosure.__table__, TreeAggregate.__table__):
+            session.execute(table.delete().where(table.c.tree_id == tree.id))
+
+    _remove_rows(session, edge_table, edges["removals"])
+    _remove_rows(session, node_table, nodes["removals"])
+    _update_rows(session, node_table, nodes["updates"])
+
+    new_ids = _insert_returning_ids(
+        session,
+        node_table,
+        ({"tree_id": tree.id, "origin_id": entry["origin_id"], **_stored(entry)} for entry in nodes["additions"]),
+    )
+    placed = {("new", entry["origin_id"]): id for entry, id in zip(nodes["additions"], new_ids)}
+
+    def place(entry):
+        return {key: placed.get(entry[key], entry[key]) for key in ENDPOINTS}
+
+    _update_rows(
+        session, edge_table, {id: {**entry, **place(entry)} for id, entry in edges["updates"].items()}, ENDPOINTS
+    )
+    _bulk_insert_edges(
+        session,
+        (
+            {"tree_id": tree.id, "origin_id": entry["origin_id"], **place(entry), **_stored(entry)}
+            for entry in edges["additions"]
+        ),
+    )
+    if tree.closure_indexed:
+        _closure_rebuild(session, tree)
+    if tree.aggregates:
+        _aggregates_rebuild(session, tree)
@@ -0,0 +1,119 @@
+"""
+Schema upgrades for databases created by an earlier version of tree_manager.
+
+``upgrade`` is idempotent: it creates missing tables, adds missing columns to
+existing tables, fills in ``tree_edge.tree_id`` for edges written before edges
+recorded their tree, and creates missing indexes (rebuilding any whose columns
+have changed), so it can be run against any existing ``database.db``:
+
+    python -m tree_manager.migrations sqlite:///database.db [--profile production]
+
+With ``--profile``, a SQLite database is also switched to the journal mode of
+that storage profile (see ``tree_manager.database.SQLITE_PROFILES``), which is
+stored in the database file.
+"""
+import sys
+
+from sqlalchemy import create_engine, inspect, select, text, update
+from sqlalchemy.schema import CreateColumn
+
+from tree_manager.database import sqlite_profile
+from tree_manager.models import Base, TreeEdge, TreeNode
+
+
+def _add_missing_columns(connection):
+    inspector = inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                table_name = connection.dialect.identifier_preparer.format_table(table)
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _backfill_edge_trees(connection):
+    """
+    Set the ``tree_id`` of edges that have none to the tree of their incoming
+    node.
+    """
+    edges = TreeEdge.__table__
+    nodes = TreeNode.__table__
+    result = connection.execute(
+        update(edges)
+        .where(edges.c.tree_id.is_(None))
+        .values(tree_id=select(nodes.c.tree_id).where(nodes.c.id == edges.c.incoming_node_id).scalar_subquery())
+    )
+    return result.rowcount
+
+
+def _create_missing_indexes(connection):
+    inspector = inspect(connection)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"]: index["column_names"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            columns = [column.name for column in index.columns]
+            if index.name in existing and existing[index.name] == columns:
+                continue
+            if index.name in existing:
+                index.drop(connection)
+            index.create(connection)
+            created.append(index.name)
+    return created
+
+
+def upgrade(engine):
+    """
+    Bring the schema behind ``engine`` up to date with the models.
+
+    Returns:
+        dict: The ``columns`` added and ``indexes`` created, by name, and the
+        number of edges whose tree was backfilled (``edges_backfilled``).
+    """
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        added = _add_missing_columns(connection)
+        backfilled = _backfill_edge_trees(connection)
+        created = _create_missing_indexes(connection)
+    return {"columns": added, "indexes": created, "edges_backfilled": backfilled}
+
+
+def set_journal_mode(engine, profile):
+    """
+    Switch a SQLite database to the journal mode of a storage profile.
+
+    Returns:
+        str: The journal mode now in effect, or ``None`` if the profile sets
+        none or the database is not SQLite.
+    """
+    journal_mode = sqlite_profile(profile).get("journal_mode")
+    if journal_mode is None or engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(f"PRAGMA journal_mode={journal_mode}").scalar()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    profile = None
+    if "--profile" in args:
+        position = args.index("--profile")
+        profile = args[position + 1]
+        del args[position:position + 2]
+    url = args[0] if args else "sqlite:///database.db"
+    engine = create_engine(url)
+    changes = upgrade(engine)
+    for name in changes["columns"]:
+        print(f"Added column {name}")
+    if changes["edges_backfilled"]:
+        print(f"Recorded the tree of {changes['edges_backfilled']} edges")
+    for name in changes["indexes"]:
+        print(f"Created index {name}")
+    if profile:
+        journal_mode = set_journal_mode(engine, profile)
+        if journal_mode:
+            print(f"Journal mode: {journal_mode}")
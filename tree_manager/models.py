@@ -1,20 +1,1394 @@
 from sqlalchemy import (
+    bindparam,
     create_engine,
+    event,
     Column,
+    Boolean,
+    Float,
+    Index,
     Integer,
     String,
     ForeignKey,
     JSON,
+    MetaData,
+    Table,
     TIMESTAMP,
     func,
+    cast,
+    exists,
+    insert,
+    update,
+    literal,
+    literal_column,
+    and_,
+    or_,
+    case,
+    false,
+    true,
+    select,
+    text,
 )
+import functools
+import hashlib
+from collections import namedtuple
+import inspect
 import json
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base
+import re
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import declarative_base, joinedload, relationship, sessionmaker
 from sqlalchemy.schema import UniqueConstraint
 
 
 Base = declarative_base()
 
+# Number of rows sent per multi-row INSERT by the bulk copy helpers.
+BULK_BATCH_SIZE = 5000
+
+# A tag is stored as a full snapshot (a keyframe) once this many tags in a row
+# have been stored as deltas against their predecessor. Set to 1 to store every
+# tag in full.
+SNAPSHOT_KEYFRAME_INTERVAL = 16
+
+# Kinds of subtree aggregate a tree can declare with ``Tree.enable_aggregates``.
+AGGREGATE_KINDS = ("count", "height", "sum")
+
+# Changesets adding more edges than this recompute a tree's aggregates in one
+# pass instead of updating the ancestors of every new edge.
+AGGREGATE_BATCH_LIMIT = 100
+
+# Payload keys usable in ``find_nodes`` and ``find_edges`` criteria; keys of
+# nested objects are joined with ``__``.
+PAYLOAD_KEY_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Dialects on which traversals run as a single ``WITH RECURSIVE`` query. Any
+# other backend falls back to walking the graph in Python.
+RECURSIVE_CTE_DIALECTS = ("sqlite", "postgresql")
+
+# INSERT constructs with ``ON CONFLICT .. DO UPDATE``, by dialect. Elsewhere
+# the closure table is kept with a separate UPDATE and INSERT.
+UPSERT_DIALECTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+# What the read methods of ``Tree`` return with ``raw=True``: the columns
+# of a node or edge, read straight from the result rows without building ORM
+# objects or adding them to the session. The fields match ``TagView``'s.
+NodeRow = namedtuple("NodeRow", "id data")
+EdgeRow = namedtuple("EdgeRow", "id incoming_node_id outgoing_node_id data")
+
+# The TreeGraphCache installed with ``tree_manager.cache.set_graph_cache``, if
+# any.
+_graph_cache = None
+
+# The Instrumentation installed with
+# ``tree_manager.instrumentation.set_instrumentation``, if any.
+_instrumentation = None
+
+
+def _invalidate_graph(tree_id):
+    if _graph_cache is not None:
+        _graph_cache.invalidate(tree_id)
+
+
+def _log_change(session, tree, op, payload):
+    """
+    Append a write to ``tree`` to its change log, in the caller's transaction;
+    see ``tree_manager.changelog``.
+    """
+    if tree.log_changes:
+        session.execute(insert(TreeChange.__table__).values(tree_id=tree.id, op=op, payload=payload))
+
+
+def _loader_options(load):
+    """
+    The loader options passed as ``load`` to a read method: one option, such
+    as ``selectinload(TreeNode.outgoing_edges)``, or a list of them.
+    """
+    if load is None:
+        return ()
+    return tuple(load) if isinstance(load, (list, tuple)) else (load,)
+
+
+def _fetch(session, query, model, load=None, raw=False):
+    """
+    Run a query for ``model`` entities. Returns the ORM objects, loaded with
+    the options in ``load``, or with ``raw`` ``NodeRow`` / ``EdgeRow``
+    tuples, resolving interned payloads with one query per
+    ``BULK_BATCH_SIZE`` distinct blobs.
+    """
+    if not raw:
+        return query.options(*_loader_options(load)).all()
+    table = model.__table__
+    if model is TreeNode:
+        row_type, columns = NodeRow, [table.c.id]
+    else:
+        row_type, columns = EdgeRow, [table.c.id, table.c.incoming_node_id, table.c.outgoing_node_id]
+    rows = query.with_entities(*columns, table.c.data, table.c.data_hash).all()
+    hashes = {row[-1] for row in rows if row[-1] is not None}
+    blobs = {}
+    for chunk in _chunked(list(hashes), BULK_BATCH_SIZE):
+        blobs.update(session.execute(select(TreeBlob.hash, TreeBlob.data).where(TreeBlob.hash.in_(chunk))).all())
+    return [row_type(*row[:-2], row[-2] if row[-1] is None else blobs[row[-1]]) for row in rows]
+
+
+def _as_row(instance):
+    if isinstance(instance, TreeNode):
+        return NodeRow(instance.id, instance.data)
+    return EdgeRow(instance.id, instance.incoming_node_id, instance.outgoing_node_id, instance.data)
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _store_blobs(session, values):
+    """
+    Store payloads in the content-addressed blob table.
+
+    Each payload is keyed by the SHA-256 of its canonical JSON; only hashes not
+    already present are inserted.
+
+    Returns:
+        list: The hash of each payload, in the same order as ``values``.
+    """
+    blobs = TreeBlob.__table__
+    hashes = []
+    pending = {}
+    for value in values:
+        digest = hashlib.sha256(_canonical_json(value).encode()).hexdigest()
+        hashes.append(digest)
+        pending.setdefault(digest, value)
+
+    for chunk in _chunked(list(pending), BULK_BATCH_SIZE):
+        stored = set(session.scalars(select(blobs.c.hash).where(blobs.c.hash.in_(chunk))))
+        missing = [{"hash": digest, "data": pending[digest]} for digest in chunk if digest not in stored]
+        if missing:
+            session.execute(insert(blobs), missing)
+    return hashes
+
+
+def _payload(entry):
+    """
+    Pick the stored form of a node or edge payload out of a snapshot entry:
+    inline ``data`` or a ``data_hash`` into the blob table.
+    """
+    if entry.get("data_hash") is not None:
+        return {"data": None, "data_hash": entry["data_hash"]}
+    return {"data": entry.get("data"), "data_hash": None}
+
+
+def _payload_entry(data, data_hash):
+    if data_hash is not None:
+        return {"data_hash": data_hash}
+    return {"data": data}
+
+
+def _resolve_payloads(session, entries):
+    """
+    Replace ``data_hash`` references in snapshot entries with their payloads,
+    in place, loading each distinct blob once.
+    """
+    hashes = {entry["data_hash"] for entry in entries if "data_hash" in entry}
+    blobs = {}
+    for chunk in _chunked(list(hashes), BULK_BATCH_SIZE):
+        blobs.update(session.execute(select(TreeBlob.hash, TreeBlob.data).where(TreeBlob.hash.in_(chunk))).all())
+    for entry in entries:
+        if "data_hash" in entry:
+            entry["data"] = blobs[entry.pop("data_hash")]
+    return entries
+
+
+def _last_id(session, table):
+    """
+    The highest ID ``table`` has handed out on SQLite: the larger of its
+    AUTOINCREMENT counter in sqlite_sequence and ``max(id)``, so the IDs of
+    deleted rows are not assigned again. Copy-on-write branches rely on this;
+    they see the base tree's rows up to the IDs it had when they were created.
+    """
+    sequence = session.execute(
+        text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": table.name}
+    ).scalar()
+    return max(sequence or 0, session.scalar(select(func.coalesce(func.max(table.c.id), 0))))
+
+
+def _insert_returning_ids(session, table, rows):
+    """
+    Insert ``rows`` into ``table`` in multi-row batches.
+
+    SQLite cannot return generated keys from a multi-row INSERT in a guaranteed
+    order, so there the IDs are assigned up front after ``_last_id``; inserting
+    them advances the table's AUTOINCREMENT counter. The driver only opens a
+    transaction before a write, so an UPDATE matching no rows takes the write
+    lock first; until the commit, no other connection can insert into that
+    range. Other backends use ``INSERT .. RETURNING`` sorted by parameter
+    order.
+
+    Returns:
+        list: The new row IDs, in the same order as ``rows``.
+    """
+    explicit_ids = session.get_bind().dialect.name == "sqlite"
+    returning_stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    if explicit_ids:
+        session.execute(update(table).where(false()).values(id=table.c.id))
+    new_ids = []
+    for chunk in _chunked(rows, BULK_BATCH_SIZE):
+        if explicit_ids:
+            start = _last_id(session, table) + 1
+            ids = list(range(start, start + len(chunk)))
+            session.execute(insert(table), [{"id": id, **row} for id, row in zip(ids, chunk)])
+            new_ids.extend(ids)
+        else:
+            new_ids.extend(session.scalars(returning_stmt, chunk).all())
+    return new_ids
+
+
+def _bulk_insert_nodes(session, tree_id, payloads):
+    """
+    Insert nodes for ``tree_id`` in multi-row batches.
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        tree_id: The ID of the tree that owns the new nodes.
+        payloads: Iterable of ``{"data": ..., "data_hash": ...}`` dicts, as
+            returned by ``_payload``.
+
+    Returns:
+        list: The new node IDs, in the same order as ``payloads``.
+    """
+    return _insert_returning_ids(
+        session, TreeNode.__table__, ({"tree_id": tree_id, **payload} for payload in payloads)
+    )
+
+
+def _bulk_insert_edges(session, rows):
+    """
+    Insert edge rows (dicts with ``tree_id``, ``incoming_node_id``,
+    ``outgoing_node_id``, ``data`` and ``data_hash``) with a single
+    executemany per batch.
+    """
+    for chunk in _chunked(rows, BULK_BATCH_SIZE):
+        session.execute(insert(TreeEdge.__table__), chunk)
+
+
+def _new_payloads(session, values, intern_payloads):
+    """
+    Turn new node or edge payloads into ``{"data": ..., "data_hash": ...}``
+    dicts, interning them in tree_blob if ``intern_payloads`` is set.
+    """
+    if intern_payloads:
+        return [{"data": None, "data_hash": digest} for digest in _store_blobs(session, values)]
+    return [{"data": value, "data_hash": None} for value in values]
+
+
+def _copy_tree_rows(session, source_tree, target_tree_id):
+    """
+    Copy every node and edge visible in ``source_tree`` into ``target_tree_id``,
+    recording the row each copy descends from in ``origin_id``.
+
+    On SQLite the copy is three ``INSERT .. SELECT`` statements: new node IDs
+    are ``_last_id + row_number()`` over the source nodes ordered by ID, kept in
+    a temporary table keyed by the old ID, and nodes and edges are copied by
+    joining against it, so no row passes through Python. (Joining the
+    numbering as a subquery instead leaves SQLite without an index on it and
+    makes the edge copy quadratic.) The caller's insert of the target tree
+    has taken the write lock by then, which keeps the new IDs free. Other
+    backends stream the rows through the batched helpers above.
+    """
+    nodes = TreeNode.__table__
+    edges = TreeEdge.__table__
+
+    if session.get_bind().dialect.name == "sqlite":
+        base = _last_id(session, nodes)
+        mapping = Table(
+            "tree_copy_mapping",
+            MetaData(),
+            Column("old_id", Integer, primary_key=True),
+            Column("new_id", Integer, nullable=False),
+            prefixes=["TEMPORARY"],
+        )
+        connection = session.connection()
+        mapping.create(connection)
+        try:
+            session.execute(
+                insert(mapping).from_select(
+                    ["old_id", "new_id"],
+                    select(nodes.c.id, base + func.row_number().over(order_by=nodes.c.id)).where(
+                        source_tree._node_filter()
+                    ),
+                )
+            )
+            session.execute(
+                insert(nodes).from_select(
+                    ["id", "tree_id", "origin_id", "data", "data_hash"],
+                    select(
+                        mapping.c.new_id,
+                        target_tree_id,
+                        func.coalesce(nodes.c.origin_id, nodes.c.id),
+                        nodes.c.data,
+                        nodes.c.data_hash,
+                    )
+                    .join(nodes, nodes.c.id == mapping.c.old_id)
+                    .order_by(mapping.c.old_id),
+                )
+            )
+
+            incoming = mapping.alias("incoming")
+            outgoing = mapping.alias("outgoing")
+            session.execute(
+                insert(edges).from_select(
+                    ["tree_id", "origin_id", "incoming_node_id", "outgoing_node_id", "data", "data_hash"],
+                    select(
+                        target_tree_id,
+                        func.coalesce(edges.c.origin_id, edges.c.id),
+                        incoming.c.new_id,
+                        outgoing.c.new_id,
+                        edges.c.data,
+                        edges.c.data_hash,
+                    )
+                    .join(incoming, edges.c.incoming_node_id == incoming.c.old_id)
+                    .join(outgoing, edges.c.outgoing_node_id == outgoing.c.old_id)
+                    .where(source_tree._edge_filter())
+                    .order_by(edges.c.id),
+                )
+            )
+        finally:
+            mapping.drop(connection)
+        return
+
+    old_nodes = session.execute(
+        select(nodes.c.id, func.coalesce(nodes.c.origin_id, nodes.c.id), nodes.c.data, nodes.c.data_hash)
+        .where(source_tree._node_filter())
+        .order_by(nodes.c.id)
+    ).all()
+    new_ids = _bulk_insert_nodes(
+        session,
+        target_tree_id,
+        [{"origin_id": origin_id, "data": data, "data_hash": data_hash} for _, origin_id, data, data_hash in old_nodes],
+    )
+    node_mapping = {old_node.id: new_id for old_node, new_id in zip(old_nodes, new_ids)}
+
+    old_edges = session.execute(
+        select(
+            func.coalesce(edges.c.origin_id, edges.c.id),
+            edges.c.incoming_node_id,
+            edges.c.outgoing_node_id,
+            edges.c.data,
+            edges.c.data_hash,
+        )
+        .where(source_tree._edge_filter())
+        .order_by(edges.c.id)
+    )
+    _bulk_insert_edges(
+        session,
+        (
+            {
+                "tree_id": target_tree_id,
+                "origin_id": origin_id,
+                "incoming_node_id": node_mapping[incoming_node_id],
+                "outgoing_node_id": node_mapping[outgoing_node_id],
+                "data": data,
+                "data_hash": data_hash,
+            }
+            for origin_id, incoming_node_id, outgoing_node_id, data, data_hash in old_edges
+        ),
+    )
+
+
+def _origin_ids(session, tree, model, ids):
+    """
+    Map the IDs of rows visible in ``tree`` to the row they descend from,
+    following ``origin_id`` back through earlier copies.
+
+    Returns:
+        dict: ``{id: origin_id}`` for every ID in ``ids``.
+    """
+    origins = {id: id for id in ids}
+    table = model.__table__
+    copied = exists().where(
+        tree._node_filter() if model is TreeNode else tree._edge_filter(), table.c.origin_id.is_not(None)
+    )
+    if not session.scalar(select(copied)):
+        return origins
+    for chunk in _chunked(ids, BULK_BATCH_SIZE):
+        origins.update(
+            session.execute(
+                select(table.c.id, table.c.origin_id).where(table.c.id.in_(chunk), table.c.origin_id.is_not(None))
+            ).all()
+        )
+    return origins
+
+
+def _copy_on_write(session, tree, payloads):
+    """
+    Give a copy-on-write branch its own copies of nodes it shares, with new
+    payloads, and move the edges it sees at those nodes over to the copies.
+    Edges that are shared too, with a base tree or with a branch of this
+    one, are copied in turn; the rows replaced are recorded in tree_override
+    so that the branch no longer sees them.
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        tree: The branch.
+        payloads: ``{node_id: payload}``, with payloads as returned by
+            ``_new_payloads``.
+
+    Returns:
+        tuple: ``({node_id: copy_id}, {edge_id: copy_id})``.
+    """
+    edges = TreeEdge.__table__
+    node_ids = list(payloads)
+    origins = _origin_ids(session, tree, TreeNode, node_ids)
+    copies = dict(
+        zip(
+            node_ids,
+            _bulk_insert_nodes(
+                session, tree.id, [{"origin_id": origins[id], **payloads[id]} for id in node_ids]
+            ),
+        )
+    )
+
+    touching = {}
+    for chunk in _chunked(node_ids, BULK_BATCH_SIZE):
+        for row in session.execute(
+            select(
+                edges.c.id,
+                edges.c.tree_id,
+                func.coalesce(edges.c.origin_id, edges.c.id).label("origin_id"),
+                edges.c.incoming_node_id,
+                edges.c.outgoing_node_id,
+                edges.c.data,
+                edges.c.data_hash,
+            ).where(or_(edges.c.incoming_node_id.in_(chunk), edges.c.outgoing_node_id.in_(chunk)), tree._edge_filter())
+        ):
+            touching[row.id] = row
+    # The branch's own edges are moved in place unless its branches see them.
+    shared = tree._shared_ids(session, "edges", [id for id, edge in touching.items() if edge.tree_id == tree.id])
+    moved, copied = [], []
+    for id in sorted(touching):
+        edge = touching[id]
+        (moved if edge.tree_id == tree.id and id not in shared else copied).append(edge)
+
+    if moved:
+        session.connection().execute(
+            update(edges)
+            .where(edges.c.id == bindparam("edge_id"))
+            .values(incoming_node_id=bindparam("incoming"), outgoing_node_id=bindparam("outgoing")),
+            [
+                {
+                    "edge_id": edge.id,
+                    "incoming": copies.get(edge.incoming_node_id, edge.incoming_node_id),
+                    "outgoing": copies.get(edge.outgoing_node_id, edge.outgoing_node_id),
+                }
+                for edge in moved
+            ],
+        )
+    edge_copies = dict(
+        zip(
+            [edge.id for edge in copied],
+            _insert_returning_ids(
+                session,
+                edges,
+                [
+                    {
+                        "tree_id": tree.id,
+                        "origin_id": edge.origin_id,
+                        "incoming_node_id": copies.get(edge.incoming_node_id, edge.incoming_node_id),
+                        "outgoing_node_id": copies.get(edge.outgoing_node_id, edge.outgoing_node_id),
+                        "data": edge.data,
+                        "data_hash": edge.data_hash,
+                    }
+                    for edge in copied
+                ],
+            ),
+        )
+    )
+    session.execute(
+        insert(TreeOverride.__table__),
+        [
+            {"kind": kind, "row_id": id, "tree_id": tree.id, "copy_id": copy_id}
+            for kind, replaced in (("nodes", copies), ("edges", edge_copies))
+            for id, copy_id in replaced.items()
+        ],
+    )
+    return copies, edge_copies
+
+
+def _created_from(tree, source):
+    """
+    Payload of the ``create_tree`` change logged for a branch, restore or
+    import: consumers load the new tree in full.
+    """
+    return {
+        "name": tree.name,
+        "source": source,
+        "origin_tree_id": tree.origin_tree_id,
+        "origin_tag_id": tree.origin_tag_id,
+        "base_tree_id": tree.base_tree_id,
+    }
+
+
+def _tree_state(session, tree):
+    """
+    Read the nodes and edges currently visible in a tree in the snapshot format.
+
+    Interned payloads are recorded by their ``data_hash`` rather than copied.
+    """
+    nodes = TreeNode.__table__
+    edges = TreeEdge.__table__
+    node_rows = session.execute(
+        select(nodes.c.id, nodes.c.data, nodes.c.data_hash)
+        .where(tree._node_filter())
+        .order_by(nodes.c.id)
+    )
+    edge_rows = session.execute(
+        select(edges.c.id, edges.c.incoming_node_id, edges.c.outgoing_node_id, edges.c.data, edges.c.data_hash)
+        .where(tree._edge_filter())
+        .order_by(edges.c.id)
+    )
+    return {
+        "nodes": [{"id": id, **_payload_entry(data, data_hash)} for id, data, data_hash in node_rows],
+        "edges": [
+            {
+                "id": id,
+                "incoming_node_id": incoming_node_id,
+                "outgoing_node_id": outgoing_node_id,
+                **_payload_entry(data, data_hash),
+            }
+            for id, incoming_node_id, outgoing_node_id, data, data_hash in edge_rows
+        ],
+    }
+
+
+def _edge_key(edge):
+    # Snapshots written before edges carried their id fall back to the endpoints.
+    if "id" in edge:
+        return edge["id"]
+    return (edge["incoming_node_id"], edge["outgoing_node_id"])
+
+
+def _diff_states(old, new):
+    """
+    Compute the delta that turns snapshot ``old`` into snapshot ``new``.
+
+    Returns:
+        dict: For ``nodes`` and ``edges``, the ``added`` and ``changed``
+        entries and the keys of the ``removed`` ones.
+    """
+    delta = {}
+    for kind, key in (("nodes", lambda node: node["id"]), ("edges", _edge_key)):
+        old_entries = {key(entry): entry for entry in old[kind]}
+        new_entries = {key(entry): entry for entry in new[kind]}
+        delta[kind] = {
+            "added": [entry for k, entry in new_entries.items() if k not in old_entries],
+            "changed": [
+                entry for k, entry in new_entries.items() if k in old_entries and old_entries[k] != entry
+            ],
+            "removed": [k for k in old_entries if k not in new_entries],
+        }
+    return delta
+
+
+def _apply_deltas(state, deltas):
+    """
+    Replay deltas produced by ``_diff_states``, oldest first, on top of a
+    snapshot.
+    """
+    result = {}
+    for kind, key in (("nodes", lambda node: node["id"]), ("edges", _edge_key)):
+        entries = {key(entry): entry for entry in state[kind]}
+        for delta in deltas:
+            for removed in delta[kind]["removed"]:
+                # JSON has no tuples, so endpoint keys come back as lists.
+                entries.pop(tuple(removed) if isinstance(removed, list) else removed, None)
+            for entry in delta[kind]["changed"] + delta[kind]["added"]:
+                entries[key(entry)] = entry
+        result[kind] = list(entries.values())
+    return result
+
+
+def _state_subset(state, node_ids):
+    """
+    Keep only the nodes of a snapshot in ``node_ids`` and the edges between
+    them.
+    """
+    wanted = set(node_ids)
+    return {
+        "nodes": [entry for entry in state["nodes"] if entry["id"] in wanted],
+        "edges": [
+            entry
+            for entry in state["edges"]
+            if entry["incoming_node_id"] in wanted and entry["outgoing_node_id"] in wanted
+        ],
+    }
+
+
+def _tag_row_columns(kind):
+    """
+    The version-ranged table holding the ``nodes`` or ``edges`` of ``"rows"``
+    tags, and the columns holding a snapshot entry's ``id`` (and endpoints).
+    """
+    if kind == "nodes":
+        table = TreeTagNode.__table__
+        return table, (table.c.node_id,)
+    table = TreeTagEdge.__table__
+    return table, (table.c.edge_id, table.c.incoming_node_id, table.c.outgoing_node_id)
+
+
+def _entry_keys(kind):
+    return ("id",) if kind == "nodes" else ("id", "incoming_node_id", "outgoing_node_id")
+
+
+def _tag_rows(session, tag, kind, node_ids=None):
+    """
+    Read the ``nodes`` or ``edges`` recorded by a ``"rows"`` tag as snapshot
+    entries ordered by ID. With ``node_ids``, only those nodes and the edges
+    between them are read, through the node and incoming node indexes.
+    """
+    table, columns = _tag_row_columns(kind)
+    stmt = (
+        select(*columns, table.c.data, table.c.data_hash)
+        .where(
+            table.c.tree_id == tag.tree_id,
+            table.c.valid_from <= tag.id,
+            or_(table.c.valid_to.is_(None), table.c.valid_to > tag.id),
+        )
+        .order_by(columns[0])
+    )
+    if node_ids is None:
+        rows = session.execute(stmt)
+    else:
+        wanted = set(node_ids)
+        rows = sorted(
+            (
+                row
+                for chunk in _chunked(wanted, BULK_BATCH_SIZE)
+                for row in session.execute(stmt.where(columns[0 if kind == "nodes" else 1].in_(chunk)))
+                if kind == "nodes" or row[2] in wanted
+            ),
+            key=lambda row: row[0],
+        )
+    keys = _entry_keys(kind)
+    return [
+        {**dict(zip(keys, values)), **_payload_entry(data, data_hash)} for *values, data, data_hash in rows
+    ]
+
+
+def _record_tag_rows(session, tag, state):
+    """
+    Record ``state`` for a ``"rows"`` tag. Rows that no longer match the tree
+    are closed at ``tag`` and new or changed entries are inserted as valid
+    from ``tag`` on, so a tag only writes what changed since the tree's
+    previous ``"rows"`` tag.
+
+    Returns:
+        dict: The state recorded by that previous tag, read along the way.
+    """
+    previous = {}
+    for kind in ("nodes", "edges"):
+        table, columns = _tag_row_columns(kind)
+        keys = _entry_keys(kind)
+        pending = {entry["id"]: entry for entry in state[kind]}
+        current_rows = session.execute(
+            select(table.c.id, *columns, table.c.data, table.c.data_hash).where(
+                table.c.tree_id == tag.tree_id, table.c.valid_to.is_(None)
+            )
+        )
+        closed = []
+        previous[kind] = []
+        for row_id, *values, data, data_hash in current_rows:
+            entry = {**dict(zip(keys, values)), **_payload_entry(data, data_hash)}
+            previous[kind].append(entry)
+            if pending.get(entry["id"]) == entry:
+                del pending[entry["id"]]
+            else:
+                closed.append(row_id)
+
+        for chunk in _chunked(closed, BULK_BATCH_SIZE):
+            session.execute(update(table).where(table.c.id.in_(chunk)).values(valid_to=tag.id))
+        rows = (
+            {
+                "tree_id": tag.tree_id,
+                "valid_from": tag.id,
+                **{column.name: entry[key] for key, column in zip(keys, columns)},
+                **_payload(entry),
+            }
+            for entry in pending.values()
+        )
+        for chunk in _chunked(rows, BULK_BATCH_SIZE):
+            session.execute(insert(table), chunk)
+    return previous
+
+
+def _node_changes(old, new):
+    """
+    List the nodes added, modified or removed between two snapshots as
+    ``(node_id, change, entry)``, where ``entry`` is ``None`` for removed
+    nodes.
+    """
+    old_nodes = {entry["id"]: entry for entry in old["nodes"]}
+    changes = []
+    for entry in new["nodes"]:
+        previous = old_nodes.pop(entry["id"], None)
+        if previous is None:
+            changes.append((entry["id"], "added", entry))
+        elif previous != entry:
+            changes.append((entry["id"], "modified", entry))
+    changes.extend((node_id, "removed", None) for node_id in old_nodes)
+    return changes
+
+
+def _record_tag_changes(session, tag, changes):
+    """
+    Add the node changes a tag made (from ``_node_changes``) to the change
+    index.
+    """
+    rows = (
+        {
+            "tree_id": tag.tree_id,
+            "tag_id": tag.id,
+            "node_id": node_id,
+            "change": change,
+            **(_payload(entry) if entry is not None else {"data": None, "data_hash": None}),
+        }
+        for node_id, change, entry in changes
+    )
+    for chunk in _chunked(rows, BULK_BATCH_SIZE):
+        session.execute(insert(TreeTagChange.__table__), chunk)
+    tag.changes_indexed = True
+
+
+def _index_tag_changes(session, tree):
+    """
+    Build the change index for the tags of ``tree`` created before tags
+    recorded their changes, comparing each with the tag before it.
+    """
+    tags = session.query(TreeTag).filter_by(tree_id=tree.id).order_by(TreeTag.id).all()
+    previous_tag, previous_state = None, {"nodes": [], "edges": []}
+    for tag in tags:
+        if tag.changes_indexed:
+            previous_tag, previous_state = tag, None
+            continue
+        if previous_state is None:
+            previous_state = previous_tag.load_snapshot(session, resolve_payloads=False)
+        state = tag.load_snapshot(session, resolve_payloads=False)
+        _record_tag_changes(session, tag, _node_changes(previous_state, state))
+        previous_tag, previous_state = tag, state
+    session.commit()
+
+
+def _stream_rows(session, tree, kind):
+    """
+    Yield the ``nodes`` or ``edges`` visible in a tree as raw rows ordered by
+    ID, reading ``BULK_BATCH_SIZE`` rows at a time. Payloads are left as JSON
+    text so rows can be compared without decoding them.
+    """
+    nodes = TreeNode.__table__
+    edges = TreeEdge.__table__
+    if kind == "nodes":
+        stmt = (
+            select(nodes.c.id, cast(nodes.c.data, String), nodes.c.data_hash)
+            .where(tree._node_filter())
+            .order_by(nodes.c.id)
+        )
+    else:
+        stmt = (
+            select(
+                edges.c.id,
+                edges.c.incoming_node_id,
+                edges.c.outgoing_node_id,
+                cast(edges.c.data, String),
+                edges.c.data_hash,
+            )
+            .where(tree._edge_filter())
+            .order_by(edges.c.id)
+        )
+    for chunk in session.execute(stmt.execution_options(yield_per=BULK_BATCH_SIZE)).partitions():
+        yield from chunk
+
+
+def _row_entry(kind, row):
+    *columns, data, data_hash = row
+    entry = dict(zip(("id",) if kind == "nodes" else ("id", "incoming_node_id", "outgoing_node_id"), columns))
+    entry.update(_payload_entry(None if data is None else json.loads(data), data_hash))
+    return entry
+
+
+def _diff_tree_rows(session, old_tree, new_tree, kind):
+    """
+    Yield ``(kind, change, old, new)`` for the ``nodes`` or ``edges`` that
+    differ between two trees, matching them by ID.
+    """
+    changes = _merge_diff(
+        kind, _stream_rows(session, old_tree, kind), _stream_rows(session, new_tree, kind), lambda row: row[0]
+    )
+    for chunk in _chunked(changes, BULK_BATCH_SIZE):
+        chunk = [
+            (kind, change, old and _row_entry(kind, old), new and _row_entry(kind, new))
+            for kind, change, old, new in chunk
+        ]
+        _resolve_payloads(session, [entry for _, _, old, new in chunk for entry in (old, new) if entry])
+        for change in chunk:
+            # Rows whose JSON text or payload form differed may still hold
+            # equal payloads.
+            if change[1] != "modified" or change[2] != change[3]:
+                yield change
+
+
+def _merge_diff(kind, old_entries, new_entries, key):
+    """
+    Walk two sequences of snapshot entries sorted by ``key`` side by side and
+    yield ``(kind, change, old, new)`` for every entry that differs.
+    """
+    old_entries, new_entries = iter(old_entries), iter(new_entries)
+    old, new = next(old_entries, None), next(new_entries, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and key(old) < key(new)):
+            yield kind, "removed", old, None
+            old = next(old_entries, None)
+        elif old is None or key(new) < key(old):
+            yield kind, "added", None, new
+            new = next(new_entries, None)
+        else:
+            if old != new:
+                yield kind, "modified", old, new
+            old, new = next(old_entries, None), next(new_entries, None)
+
+
+def _collect_diff(changes):
+    diff = {kind: {"added": [], "removed": [], "modified": []} for kind in ("nodes", "edges")}
+    for kind, change, old, new in changes:
+        if change == "added":
+            diff[kind]["added"].append(new)
+        elif change == "removed":
+            diff[kind]["removed"].append(old)
+        else:
+            diff[kind]["modified"].append((old, new))
+    return diff
+
+
+def _reach_depths(tree, start_node_id, upward=False):
+    """
+    Build a subquery of every node reachable from ``start_node_id`` with its
+    shortest distance, following the edges visible in ``tree`` downwards (or
+    upwards).
+
+    Depth is capped at the number of nodes visible in the tree, which bounds
+    the recursion even if the edges contain a cycle.
+
+    Returns:
+        Subquery: Rows of ``(node_id, depth)``, including the start node at 0.
+    """
+    if upward:
+        near_id, far_id = TreeEdge.outgoing_node_id, TreeEdge.incoming_node_id
+    else:
+        near_id, far_id = TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id
+
+    max_depth = select(func.count(TreeNode.id)).where(tree._node_filter()).scalar_subquery()
+
+    reach = (
+        select(TreeNode.id.label("node_id"), literal(0).label("depth"))
+        .where(TreeNode.id == start_node_id)
+        .cte("reach", recursive=True)
+    )
+    reach = reach.union(
+        select(far_id, reach.c.depth + 1)
+        .join(reach, near_id == reach.c.node_id)
+        .where(reach.c.depth < max_depth, tree._edge_filter())
+    )
+    return (
+        select(reach.c.node_id, func.min(reach.c.depth).label("depth"))
+        .group_by(reach.c.node_id)
+        .subquery()
+    )
+
+
+def _closure_add_node(session, tree_id, node_id):
+    session.execute(
+        insert(TreeClosure.__table__).values(
+            tree_id=tree_id, ancestor_id=node_id, descendant_id=node_id, depth=0
+        )
+    )
+
+
+def _closure_add_edge(session, tree_id, incoming_node_id, outgoing_node_id):
+    """
+    Connect every ancestor of ``incoming_node_id`` to every descendant of
+    ``outgoing_node_id`` in the closure table with one ``INSERT .. SELECT``.
+    Pairs that are already present keep the shorter of the two depths: the
+    new edge can be a shortcut, as ``a -> d`` next to ``a -> b -> c -> d``.
+    """
+    closure = TreeClosure.__table__
+    above = closure.alias("above")
+    below = closure.alias("below")
+    columns = ["tree_id", "ancestor_id", "descendant_id", "depth"]
+    pairs = (
+        select(
+            literal(tree_id),
+            above.c.ancestor_id,
+            below.c.descendant_id,
+            above.c.depth + below.c.depth + 1,
+        )
+        .select_from(above)
+        .join(below, below.c.ancestor_id == outgoing_node_id)
+        .where(above.c.descendant_id == incoming_node_id)
+    )
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name in UPSERT_DIALECTS:
+        stmt = UPSERT_DIALECTS[dialect_name](closure).from_select(columns, pairs)
+        shorter = case((stmt.excluded.depth < closure.c.depth, stmt.excluded.depth), else_=closure.c.depth)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[closure.c.ancestor_id, closure.c.descendant_id], set_={"depth": shorter}
+            )
+        )
+        return
+
+    new_depth = pairs.with_only_columns(above.c.depth + below.c.depth + 1).where(
+        above.c.ancestor_id == closure.c.ancestor_id, below.c.descendant_id == closure.c.descendant_id
+    )
+    session.execute(
+        update(closure)
+        .where(closure.c.tree_id == tree_id, new_depth.scalar_subquery() < closure.c.depth)
+        .values(depth=new_depth.scalar_subquery())
+    )
+    existing = closure.alias("existing")
+    session.execute(
+        insert(closure).from_select(
+            columns,
+            pairs.where(
+                ~exists().where(
+                    existing.c.ancestor_id == above.c.ancestor_id,
+                    existing.c.descendant_id == below.c.descendant_id,
+                )
+            ),
+        )
+    )
+
+
+def _closure_pairs(session, tree):
+    """
+    Build a query computing the closure of ``tree`` from its edges, as rows of
+    ``(ancestor_id, descendant_id, depth)``.
+    """
+    node_count = session.scalar(select(func.count(TreeNode.id)).where(TreeNode.tree_id == tree.id))
+    pairs = (
+        select(
+            TreeNode.id.label("ancestor_id"),
+            TreeNode.id.label("descendant_id"),
+            literal(0).label("depth"),
+        )
+        .where(TreeNode.tree_id == tree.id)
+        .cte("pairs", recursive=True)
+    )
+    pairs = pairs.union(
+        select(pairs.c.ancestor_id, TreeEdge.outgoing_node_id, pairs.c.depth + 1)
+        .join(pairs, TreeEdge.incoming_node_id == pairs.c.descendant_id)
+        .where(pairs.c.depth < node_count, tree._edge_filter())
+    )
+    return select(
+        pairs.c.ancestor_id, pairs.c.descendant_id, func.min(pairs.c.depth).label("depth")
+    ).group_by(pairs.c.ancestor_id, pairs.c.descendant_id)
+
+
+def _closure_rebuild(session, tree):
+    closure = TreeClosure.__table__
+    session.execute(closure.delete().where(closure.c.tree_id == tree.id))
+    pairs = _closure_pairs(session, tree).subquery()
+    session.execute(
+        insert(closure).from_select(
+            ["tree_id", "ancestor_id", "descendant_id", "depth"],
+            select(literal(tree.id), pairs.c.ancestor_id, pairs.c.descendant_id, pairs.c.depth),
+        )
+    )
+
+
+def _normalize_aggregates(aggregates):
+    """
+    Turn ``{name: "count" | "height" | ("sum", field)}`` declarations into the
+    ``{name: {"kind": ..., "field": ...}}`` form stored on the tree.
+    """
+    normalized = {}
+    for name, spec in (aggregates or {}).items():
+        if isinstance(spec, str):
+            kind, field = spec, None
+        elif isinstance(spec, dict):
+            kind, field = spec.get("kind"), spec.get("field")
+        else:
+            kind, field = spec
+        if kind not in AGGREGATE_KINDS:
+            raise ValueError(f"Unknown aggregate kind: {kind!r}. Expected one of {AGGREGATE_KINDS}.")
+        if (kind == "sum") != (field is not None):
+            raise ValueError(f"Aggregate '{name}': sum aggregates, and only they, take a field.")
+        normalized[name] = {"kind": kind, "field": field} if field is not None else {"kind": kind}
+    return normalized or None
+
+
+def _field_value(data, field):
+    value = data.get(field) if isinstance(data, dict) else None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def _own_aggregates(aggregates, data):
+    """
+    The aggregates of a node with nothing below it.
+    """
+    return {
+        name: _field_value(data, spec["field"]) if spec["kind"] == "sum" else 0
+        for name, spec in aggregates.items()
+    }
+
+
+def _insert_aggregates(session, tree_id, values):
+    """
+    Store ``{node_id: {name: value}}`` in tree_aggregate.
+    """
+    rows = (
+        {"tree_id": tree_id, "node_id": node_id, "name": name, "value": value}
+        for node_id, node_values in values.items()
+        for name, value in node_values.items()
+    )
+    for chunk in _chunked(rows, BULK_BATCH_SIZE):
+        session.execute(insert(TreeAggregate.__table__), chunk)
+
+
+def _cycle_edges(edge_rows):
+    """
+    Pick the edges that aggregates leave out, given as ``(edge_id,
+    incoming_node_id, outgoing_node_id)`` rows. Edges are taken in ID order,
+    and an edge is left out when its outgoing node already reaches its
+    incoming node through the edges kept before it. The incremental updates
+    and the rebuild both use this rule, so they agree on every graph.
+
+    Only edges inside a strongly connected component can close a cycle, so
+    the components are found first and only their edges are searched.
+
+    Returns:
+        set: The IDs of the edges left out.
+    """
+    children = {}
+    for _, incoming_node_id, outgoing_node_id in edge_rows:
+        children.setdefault(incoming_node_id, []).append(outgoing_node_id)
+
+    # Tarjan's algorithm, without recursion.
+    index, low, component = {}, {}, {}
+    stack, on_stack = [], set()
+    for root in children:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(children[root]))]
+        while work:
+            node_id, pending = work[-1]
+            for child_id in pending:
+                if child_id not in index:
+                    index[child_id] = low[child_id] = len(index)
+                    stack.append(child_id)
+                    on_stack.add(child_id)
+                    work.append((child_id, iter(children.get(child_id, ()))))
+                    break
+                if child_id in on_stack:
+                    low[node_id] = min(low[node_id], index[child_id])
+            else:
+                work.pop()
+                if work:
+                    parent_id = work[-1][0]
+                    low[parent_id] = min(low[parent_id], low[node_id])
+                if low[node_id] == index[node_id]:
+                    while True:
+                        member_id = stack.pop()
+                        on_stack.discard(member_id)
+                        component[member_id] = node_id
+                        if member_id == node_id:
+                            break
+
+    dropped = set()
+    kept = {}
+    internal = [row for row in edge_rows if component[row[1]] == component[row[2]]]
+    for edge_id, incoming_node_id, outgoing_node_id in sorted(internal):
+        reached = {outgoing_node_id}
+        queue = [outgoing_node_id]
+        while queue and incoming_node_id not in reached:
+            for child_id in kept.get(queue.pop(), ()):
+                if child_id not in reached:
+                    reached.add(child_id)
+                    queue.append(child_id)
+        if incoming_node_id in reached:
+            dropped.add(edge_id)
+        else:
+            kept.setdefault(incoming_node_id, []).append(outgoing_node_id)
+    return dropped
+
+
+def _aggregates_rebuild(session, tree):
+    """
+    Recompute every aggregate of ``tree`` in one depth-first pass over its
+    edges. Edges that close a cycle are left out, as picked by
+    ``_cycle_edges``.
+    """
+    table = TreeAggregate.__table__
+    session.execute(table.delete().where(table.c.tree_id == tree.id))
+    if not tree.aggregates:
+        return
+    with_data = any(spec["kind"] == "sum" for spec in tree.aggregates.values())
+    node_rows = session.execute(
+        select(TreeNode.id, TreeNode.data if with_data else literal(None))
+        .where(tree._node_filter())
+        .order_by(TreeNode.id)
+    )
+    own = {node_id: _own_aggregates(tree.aggregates, data) for node_id, data in node_rows}
+    edge_rows = [
+        (edge_id, incoming_node_id, outgoing_node_id)
+        for edge_id, incoming_node_id, outgoing_node_id in session.execute(
+            select(TreeEdge.id, TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id)
+            .where(tree._edge_filter())
+            .order_by(TreeEdge.id)
+        )
+        if incoming_node_id in own and outgoing_node_id in own
+    ]
+    dropped = _cycle_edges(edge_rows)
+    children = {}
+    for edge_id, incoming_node_id, outgoing_node_id in edge_rows:
+        if edge_id not in dropped:
+            children.setdefault(incoming_node_id, []).append(outgoing_node_id)
+
+    values = {}
+    for start in own:
+        if start in values:
+            continue
+        stack = [(start, iter(children.get(start, ())))]
+        while stack:
+            node_id, pending = stack[-1]
+            for child_id in pending:
+                if child_id not in values:
+                    stack.append((child_id, iter(children.get(child_id, ()))))
+                    break
+            else:
+                stack.pop()
+                node_values = dict(own[node_id])
+                for child_id in children.get(node_id, ()):
+                    for name, spec in tree.aggregates.items():
+                        if spec["kind"] == "count":
+                            node_values[name] += 1 + values[child_id][name]
+                        elif spec["kind"] == "height":
+                            node_values[name] = max(node_values[name], 1 + values[child_id][name])
+                        else:
+                            node_values[name] += values[child_id][name]
+                values[node_id] = node_values
+    _insert_aggregates(session, tree.id, values)
+
+
+def _paths_up(session, tree, node_id, excluded_edge_ids=()):
+    """
+    Count the paths from every ancestor of ``node_id`` down to it, and the
+    length of the longest, ignoring ``excluded_edge_ids`` and the edges
+    ``_cycle_edges`` leaves out. Every cycle through an ancestor runs
+    through ancestors only, so the edges between them are enough to tell.
+
+    Returns:
+        tuple: ``({ancestor_id: paths}, {ancestor_id: longest})``, both
+        including ``node_id`` itself.
+    """
+    ancestors = select(_reach_depths(tree, node_id, upward=True).c.node_id)
+    edge_rows = session.execute(
+        select(TreeEdge.id, TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id).where(
+            tree._edge_filter(),
+            TreeEdge.outgoing_node_id.in_(ancestors),
+            TreeEdge.incoming_node_id.in_(ancestors),
+        )
+    )
+    excluded = set(excluded_edge_ids)
+    edge_rows = [tuple(row) for row in edge_rows if row.id not in excluded]
+    dropped = _cycle_edges(edge_rows)
+    parents = {}
+    for edge_id, incoming_node_id, outgoing_node_id in edge_rows:
+        if edge_id not in dropped:
+            parents.setdefault(outgoing_node_id, []).append(incoming_node_id)
+
+    reached = {node_id}
+    queue = [node_id]
+    while queue:
+        for parent_id in parents.get(queue.pop(), ()):
+            if parent_id not in reached:
+                reached.add(parent_id)
+                queue.append(parent_id)
+    below = {}
+    for child_id, parent_ids in parents.items():
+        if child_id in reached:
+            for parent_id in parent_ids:
+                below[parent_id] = below.get(parent_id, 0) + 1
+
+    paths, longest = {node_id: 1}, {node_id: 0}
+    ready = [id for id in reached if not below.get(id)]
+    while ready:
+        child_id = ready.pop()
+        for parent_id in parents.get(child_id, ()):
+            paths[parent_id] = paths.get(parent_id, 0) + paths[child_id]
+            longest[parent_id] = max(longest.get(parent_id, 0), longest[child_id] + 1)
+            below[parent_id] -= 1
+            if below[parent_id] == 0:
+                ready.append(parent_id)
+    return paths, longest
+
+
+def _update_aggregates(session, tree_id, additions, maxima):
+    """
+    Add ``{(node_id, name): delta}`` to, and raise to at least
+    ``{(node_id, name): value}``, the stored aggregates.
+    """
+    table = TreeAggregate.__table__
+    where = (
+        table.c.tree_id == tree_id,
+        table.c.node_id == bindparam("target_node_id"),
+        table.c.name == bindparam("target_name"),
+    )
+    if additions:
+        session.connection().execute(
+            update(table).where(*where).values(value=table.c.value + bindparam("delta")),
+            [{"target_node_id": node_id, "target_name": name, "delta": delta} for (node_id, name), delta in additions.items()],
+        )
+    if maxima:
+        session.connection().execute(
+            update(table)
+            .where(*where)
+            .values(value=case((table.c.value < bindparam("candidate"), bindparam("candidate")), else_=table.c.value)),
+            [
+                {"target_node_id": node_id, "target_name": name, "candidate": value}
+                for (node_id, name), value in maxima.items()
+            ],
+        )
+
+
+def _aggregates_add_edge(session, tree, incoming_node_id, outgoing_node_id, excluded_edge_ids=()):
+    """
+    Add the subtree of ``outgoing_node_id`` to the aggregates of
+    ``incoming_node_id`` and of everything above it, once per path. The edge
+    must already be stored; ``excluded_edge_ids`` are edges stored alongside
+    it that have not been accounted for yet.
+    """
+    paths, longest = _paths_up(session, tree, incoming_node_id, excluded_edge_ids)
+    if outgoing_node_id in paths:
+        # The edge closes a cycle; being the newest, it is the one left out.
+        return
+    table = TreeAggregate.__table__
+    below = dict(
+        session.execute(
+            select(table.c.name, table.c.value).where(
+                table.c.tree_id == tree.id, table.c.node_id == outgoing_node_id
+            )
+        ).all()
+    )
+    additions, maxima = {}, {}
+    for ancestor_id, count in paths.items():
+        for name, spec in tree.aggregates.items():
+            if spec["kind"] == "count":
+                additions[ancestor_id, name] = count * (1 + below[name])
+            elif spec["kind"] == "height":
+                maxima[ancestor_id, name] = longest[ancestor_id] + 1 + below[name]
+            elif below[name]:
+                additions[ancestor_id, name] = count * below[name]
+    _update_aggregates(session, tree.id, additions, maxima)
+
+
+def _aggregates_change_payloads(session, tree, old_data, new_data):
+    """
+    Propagate changes of summed fields from updated node payloads to the nodes
+    above them.
+    """
+    sums = {name: spec["field"] for name, spec in tree.aggregates.items() if spec["kind"] == "sum"}
+    for node_id, data in new_data.items():
+        deltas = {
+            name: _field_value(data, field) - _field_value(old_data.get(node_id), field)
+            for name, field in sums.items()
+        }
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            continue
+        paths, _ = _paths_up(session, tree, node_id)
+        _update_aggregates(
+            session,
+            tree.id,
+            {(ancestor_id, name): count * delta for ancestor_id, count in paths.items() for name, delta in deltas.items()},
+            {},
+        )
+
+
+def _payload_path(key):
+    path = key.split("__")
+    if not all(PAYLOAD_KEY_PATTERN.fullmatch(part) for part in path):
+        raise ValueError(f"Invalid payload key: {key!r}.")
+    return path
+
+
+def _json_field(dialect_name, column, path):
+    """
+    Extract the value at ``path`` from a JSON column, written with the path
+    inlined so the expression matches the indexes of ``tree_manager.search``.
+    """
+    if dialect_name == "sqlite":
+        return func.json_extract(column, literal_column("'$." + ".".join(path) + "'"))
+    if dialect_name == "postgresql":
+        if len(path) == 1:
+            return column.op("->>")(literal_column(f"'{path[0]}'"))
+        return column.op("#>>")(literal_column("'{" + ",".join(path) + "}'"))
+    return column[tuple(path)].as_string()
+
+
+def _json_value(dialect_name, value):
+    # PostgreSQL's ->> returns the JSON text of the value.
+    if dialect_name == "postgresql" and not isinstance(value, str):
+        return json.dumps(value)
+    return value
+
+
+def _payload_match(dialect_name, column, criteria):
+    """
+    Conditions on a JSON column for ``find_nodes`` criteria: a value matches
+    equal values, a list or tuple any of its values, and ``None`` a missing
+    key or null.
+    """
+    conditions = []
+    for key, value in criteria.items():
+        field = _json_field(dialect_name, column, _payload_path(key))
+        if value is None:
+            conditions.append(field.is_(None))
+        elif isinstance(value, (list, tuple, set)):
+            conditions.append(field.in_([_json_value(dialect_name, item) for item in value]))
+        elif isinstance(value, dict):
+            raise ValueError(f"Criterion '{key}' compares a whole object; match its keys with '{key}__<key>'.")
+        else:
+            conditions.append(field == _json_value(dialect_name, value))
+    return conditions
+
+
+def _payload_condition(session, tree, model, criteria):
+    """
+    Match ``criteria`` against the payloads of ``model`` rows, including
+    those interned in tree_blob for trees that intern their payloads.
+    """
+    dialect_name = session.get_bind().dialect.name
+    table = model.__table__
+    inline = _payload_match(dialect_name, table.c.data, criteria)
+    if not tree.intern_payloads:
+        return and_(true(), *inline)
+    blobs = TreeBlob.__table__
+    interned = select(blobs.c.hash).where(*_payload_match(dialect_name, blobs.c.data, criteria))
+    return or_(and_(table.c.data_hash.is_(None), *inline), table.c.data_hash.in_(interned))
+
 
 class Tree(Base):
     __tablename__ = "tree"
@@ -22,162 +1396,1026 @@ class Tree(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     created_at = Column(TIMESTAMP, default=func.current_timestamp())
+    # Maintain ancestor/descendant pairs in tree_closure on every write.
+    closure_indexed = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Store node and edge payloads once in tree_blob and reference them by hash.
+    intern_payloads = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Record tags as version-ranged rows in tree_tag_node and tree_tag_edge
+    # instead of JSON snapshots.
+    row_snapshots = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Subtree aggregates kept in tree_aggregate on every write, as
+    # ``{name: {"kind": ..., "field": ...}}``; see ``enable_aggregates``.
+    aggregates = Column(JSON, nullable=True)
+    # Append every write to tree_change, for replicas and caches that apply
+    # deltas; see ``tree_manager.changelog``.
+    log_changes = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Copy-on-write branches see the rows of their base tree up to these IDs,
+    # plus their own.
+    base_tree_id = Column(Integer, ForeignKey("tree.id"), nullable=True)
+    base_max_node_id = Column(Integer, nullable=True)
+    base_max_edge_id = Column(Integer, nullable=True)
+    # The tree and tag a branch or restore was created from, for ``merge``.
+    # The tag is not a foreign key, as tree_tag already references tree.
+    origin_tree_id = Column(Integer, ForeignKey("tree.id"), nullable=True)
+    origin_tag_id = Column(Integer, nullable=True)
+
+    nodes = relationship("TreeNode", back_populates="tree", cascade="all, delete-orphan")
+    tags = relationship("TreeTag", back_populates="tree", cascade="all, delete-orphan")
+    base_tree = relationship("Tree", remote_side=[id], foreign_keys=[base_tree_id])
+
+    @classmethod
+    def get(cls, session, id):
+        return session.query(cls).filter_by(id=id).first()
+    
+    def get_by_tag(self, session, tag_name):
+        tag = session.query(TreeTag).filter_by(tag_name=tag_name).first()
+        return tag.tree if tag else None
+
+    def _scopes(self):
+        """
+        List the trees whose rows are visible in this tree, as ``(tree_id,
+        max_node_id, max_edge_id)``. The limits are ``None`` for the tree's own
+        rows and cap what a copy-on-write branch sees of each base tree.
+        """
+        scopes = [(self.id, None, None)]
+        tree, max_node_id, max_edge_id = self, None, None
+        while tree.base_tree_id is not None:
+            if max_node_id is None:
+                max_node_id, max_edge_id = tree.base_max_node_id, tree.base_max_edge_id
+            else:
+                max_node_id = min(max_node_id, tree.base_max_node_id)
+                max_edge_id = min(max_edge_id, tree.base_max_edge_id)
+            tree = tree.base_tree
+            scopes.append((tree.id, max_node_id, max_edge_id))
+        return scopes
+
+    def _node_filter(self):
+        """
+        SQL condition selecting the tree_node rows visible in this tree.
+        """
+        nodes = TreeNode.__table__
+        clauses = []
+        for tree_id, max_node_id, _ in self._scopes():
+            if max_node_id is None:
+                clauses.append(nodes.c.tree_id == tree_id)
+            else:
+                clauses.append(and_(nodes.c.tree_id == tree_id, nodes.c.id <= max_node_id))
+        return self._hide_overridden(or_(*clauses), "nodes", nodes)
+
+    def _edge_filter(self):
+        """
+        SQL condition selecting the tree_edge rows visible in this tree. On
+        its own it selects every edge of the tree through the
+        ``ix_tree_edge_tree_id`` index, without looking at the endpoints.
+        """
+        edges = TreeEdge.__table__
+        clauses = []
+        for tree_id, _, max_edge_id in self._scopes():
+            if max_edge_id is None:
+                clauses.append(edges.c.tree_id == tree_id)
+            else:
+                clauses.append(and_(edges.c.tree_id == tree_id, edges.c.id <= max_edge_id))
+        return self._hide_overridden(or_(*clauses), "edges", edges)
+
+    def _hide_overridden(self, condition, kind, table):
+        """
+        Narrow ``condition`` to the rows not replaced by a copy this tree
+        sees. Only copy-on-write branches have copies, so other trees get the
+        condition back unchanged.
+        """
+        if self.base_tree_id is None:
+            return condition
+        overrides = TreeOverride.__table__
+        position = 1 if kind == "nodes" else 2
+        copies = []
+        for scope in self._scopes():
+            clause = overrides.c.tree_id == scope[0]
+            if scope[position] is not None:
+                clause = and_(clause, overrides.c.copy_id <= scope[position])
+            copies.append(clause)
+        overridden = exists().where(overrides.c.kind == kind, overrides.c.row_id == table.c.id, or_(*copies))
+        return and_(condition, ~overridden)
+
+    def _shared_ids(self, session, kind, ids):
+        """
+        The IDs among ``ids``, nodes or edges of this tree's own, that a
+        copy-on-write branch of the tree (or a branch of one) still sees.
+        """
+        position = 0 if kind == "nodes" else 1
+        limit = session.execute(
+            select(
+                func.coalesce(func.max(Tree.base_max_node_id), 0), func.coalesce(func.max(Tree.base_max_edge_id), 0)
+            ).where(Tree.base_tree_id == self.id)
+        ).one()[position]
+        candidates = sorted(id for id in ids if id <= limit)
+        table = (TreeNode if kind == "nodes" else TreeEdge).__table__
+        shared = set()
+        frontier = [self.id] if candidates else []
+        while frontier and len(shared) < len(candidates):
+            branches = session.scalars(select(Tree).where(Tree.base_tree_id.in_(frontier))).all()
+            for branch in branches:
+                condition = branch._node_filter() if kind == "nodes" else branch._edge_filter()
+                for chunk in _chunked([id for id in candidates if id not in shared], BULK_BATCH_SIZE):
+                    shared.update(session.scalars(select(table.c.id).where(table.c.id.in_(chunk), condition)))
+            frontier = [branch.id for branch in branches]
+        return shared
+
+    def create_tag(self, session, tag_name, description=None):
+        try:
+            existing_tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
+            if existing_tag:
+                print(f"Tag '{tag_name}' already exists for this tree with description: '{existing_tag.description}'")
+                return f"Tag '{tag_name}' already exists for this tree with description: '{existing_tag.description}'"
+
+            snapshot = _tree_state(session, self)
+            tag = TreeTag(tree_id=self.id, tag_name=tag_name, description=description)
+
+            parent = (
+                session.query(TreeTag)
+                .filter_by(tree_id=self.id)
+                .order_by(TreeTag.id.desc())
+                .first()
+            )
+            # The state of the previous tag, which the change index compares
+            # against.
+            previous = None
+            if self.row_snapshots:
+                tag.snapshot_format = "rows"
+                tag.delta_depth = 0
+                tag.snapshot = json.dumps(None)
+                session.add(tag)
+                session.flush()
+                recorded = _record_tag_rows(session, tag, snapshot)
+                if parent is None or parent.snapshot_format == "rows":
+                    previous = recorded
+            elif parent is not None and parent.delta_depth + 1 < SNAPSHOT_KEYFRAME_INTERVAL:
+                previous = parent.load_snapshot(session, resolve_payloads=False)
+                tag.snapshot_format = "delta"
+                tag.parent_tag_id = parent.id
+                tag.delta_depth = parent.delta_depth + 1
+                tag.snapshot = json.dumps(_diff_states(previous, snapshot))
+            else:
+                tag.snapshot_format = "full"
+                tag.delta_depth = 0
+                tag.snapshot = json.dumps(snapshot)  # Serialize snapshot to JSON
+
+            if previous is None:
+                previous = (
+                    parent.load_snapshot(session, resolve_payloads=False)
+                    if parent is not None
+                    else {"nodes": [], "edges": []}
+                )
+            session.add(tag)
+            session.flush()
+            _record_tag_changes(session, tag, _node_changes(previous, snapshot))
+            session.commit()
+            return tag
+
+        except Exception as e:
+            session.rollback()
+            raise ValueError(f"Failed to create tag '{tag_name}': {e}")
+
+
+    def create_new_tree_version_from_tag(self, session, tag_name, copy_on_write=False):
+        """
+        Branch a new tree off this one.
+
+        With ``copy_on_write`` no rows are copied: the branch records how far
+        the node and edge IDs of this tree went and reads those rows in place,
+        while nodes and edges added afterwards (to either tree) stay private to
+        the tree they were added to. Updating a shared node in the branch
+        gives the branch its own copy of it; the nodes this tree shares with
+        its copy-on-write branches cannot be updated while they see them.
+        Copy-on-write branches are not closure indexed.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            tag_name: The tag the branch is named after.
+            copy_on_write: Share unchanged rows with this tree instead of
+                copying them.
+
+        Returns:
+            Tree: The new branch.
+        """
+        tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
+        if not tag:
+            return f"Tag '{tag_name}' does not exist."
+
+        if copy_on_write:
+            try:
+                new_tree = Tree(
+                    name=f"{self.name}_{tag_name}_branch",
+                    intern_payloads=self.intern_payloads,
+                    row_snapshots=self.row_snapshots,
+                    log_changes=self.log_changes,
+                    base_tree_id=self.id,
+                    origin_tree_id=self.id,
+                    origin_tag_id=tag.id,
+                    base_max_node_id=session.scalar(select(func.coalesce(func.max(TreeNode.id), 0))),
+                    base_max_edge_id=session.scalar(select(func.coalesce(func.max(TreeEdge.id), 0))),
+                )
+                session.add(new_tree)
+                session.flush()
+                _log_change(session, new_tree, "create_tree", _created_from(new_tree, "branch"))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            _invalidate_graph(new_tree.id)
+            return new_tree
+
+        try:
+            new_tree = Tree(
+                name=f"{self.name}_{tag_name}_branch",
+                closure_indexed=self.closure_indexed,
+                intern_payloads=self.intern_payloads,
+                row_snapshots=self.row_snapshots,
+                aggregates=self.aggregates,
+                log_changes=self.log_changes,
+                origin_tree_id=self.id,
+                origin_tag_id=tag.id,
+            )
+            session.add(new_tree)
+            session.flush()
+
+            _copy_tree_rows(session, self, new_tree.id)
+            if new_tree.closure_indexed:
+                _closure_rebuild(session, new_tree)
+            if new_tree.aggregates:
+                _aggregates_rebuild(session, new_tree)
+            _log_change(session, new_tree, "create_tree", _created_from(new_tree, "branch"))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        _invalidate_graph(new_tree.id)
+        return new_tree
+
+    def restore_from_tag(self, session, tag_name):
+        tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
+        if not tag:
+            raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+
+        snapshot = tag.load_snapshot(session, resolve_payloads=False)
+
+        try:
+            restored_tree = Tree(
+                name=f"{self.name}_rollback_to_{tag_name}",
+                closure_indexed=self.closure_indexed,
+                intern_payloads=self.intern_payloads,
+                row_snapshots=self.row_snapshots,
+                aggregates=self.aggregates,
+                log_changes=self.log_changes,
+                origin_tree_id=self.id,
+                origin_tag_id=tag.id,
+            )
+            session.add(restored_tree)
+            session.flush()
+
+            origins = _origin_ids(session, self, TreeNode, [node_data["id"] for node_data in snapshot["nodes"]])
+            new_ids = _bulk_insert_nodes(
+                session,
+                restored_tree.id,
+                [{"origin_id": origins[node_data["id"]], **_payload(node_data)} for node_data in snapshot["nodes"]],
+            )
+            node_mapping = {
+                node_data["id"]: new_id for node_data, new_id in zip(snapshot["nodes"], new_ids)
+            }
+
+            edge_origins = _origin_ids(
+                session, self, TreeEdge, [edge_data["id"] for edge_data in snapshot["edges"] if "id" in edge_data]
+            )
+            _bulk_insert_edges(
+                session,
+                (
+                    {
+                        "tree_id": restored_tree.id,
+                        "origin_id": edge_origins.get(edge_data.get("id")),
+                        "incoming_node_id": node_mapping[edge_data["incoming_node_id"]],
+                        "outgoing_node_id": node_mapping[edge_data["outgoing_node_id"]],
+                        **_payload(edge_data),
+                    }
+                    for edge_data in snapshot["edges"]
+                ),
+            )
+
+            if restored_tree.closure_indexed:
+                _closure_rebuild(session, restored_tree)
+            if restored_tree.aggregates:
+                _aggregates_rebuild(session, restored_tree)
+            _log_change(session, restored_tree, "create_tree", _created_from(restored_tree, "restore"))
+
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        _invalidate_graph(restored_tree.id)
+        return restored_tree
+
+    def merge(self, session, branch, base_tag=None, resolve=None):
+        """
+        Merge the changes a branch made since a tag of this tree back into
+        this tree, in one transaction. See ``tree_manager.merge``.
+
+        Nodes and edges are matched through ``origin_id``, so the branch can
+        be a full copy, a copy-on-write branch or a restore of this tree.
+        Changes only the branch made are applied; changes both sides made
+        differently are conflicts.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            branch: The ``Tree`` to merge.
+            base_tag: Name of the tag of this tree the branch started from;
+                defaults to the tag the branch was created from.
+            resolve: ``None`` to apply nothing if there are conflicts,
+                ``"source"`` to keep this tree's side of them, or
+                ``"branch"`` to take the branch's.
+
+        Returns:
+            dict: The number of nodes and edges ``added``, ``modified`` and
+            ``removed`` (under ``nodes`` and ``edges``), the ``conflicts``,
+            and whether the merge was ``applied``.
+        """
+        from tree_manager.merge import merge_branch
+
+        return merge_branch(session, self, branch, base_tag=base_tag, resolve=resolve)
+
+    def tag_view(self, session, tag_name):
+        """
+        Query the state recorded by a tag in place, without restoring it. See
+        ``tree_manager.tagview.TagView``.
+        """
+        from tree_manager.tagview import TagView
+
+        tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
+        if not tag:
+            raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+        return TagView(tag)
+
+    def node_history(self, session, node_id):
+        """
+        List how a node changed across the tags of this tree, oldest first.
+
+        Read from the change index ``create_tag`` maintains, so the cost
+        depends on the number of changes, not on the number of tags or the
+        size of the tree. Tags created before the index existed are indexed
+        on first use.
+
+        Returns:
+            list: ``{"tag", "change", "data"}`` dicts, one per tag that
+            ``"added"``, ``"modified"`` or ``"removed"`` the node. ``data`` is
+            the payload as of that tag, ``None`` once removed.
+        """
+        changes = TreeTagChange.__table__
+        history = self._tag_changes(session, changes.c.node_id == node_id)
+        for entry in history:
+            del entry["node_id"]
+        return history
+
+    def subtree_history(self, session, node_id):
+        """
+        Like ``node_history``, for a node and every node currently below it.
+
+        Returns:
+            list: ``{"tag", "node_id", "change", "data"}`` dicts ordered by tag,
+            then by node ID.
+        """
+        changes = TreeTagChange.__table__
+        return self._tag_changes(session, changes.c.node_id.in_(self._subtree(node_id, include_start=True)))
+
+    def _tag_changes(self, session, condition):
+        if session.scalar(
+            select(exists().where(TreeTag.tree_id == self.id, TreeTag.changes_indexed == false()))
+        ):
+            _index_tag_changes(session, self)
+
+        changes = TreeTagChange.__table__
+        tags = TreeTag.__table__
+        rows = session.execute(
+            select(tags.c.tag_name, changes.c.node_id, changes.c.change, changes.c.data, changes.c.data_hash)
+            .join(tags, tags.c.id == changes.c.tag_id)
+            .where(changes.c.tree_id == self.id, condition)
+            .order_by(changes.c.tag_id, changes.c.node_id)
+        )
+        entries = _resolve_payloads(
+            session,
+            [
+                {"tag": tag_name, "node_id": node_id, "change": change, **_payload_entry(data, data_hash)}
+                for tag_name, node_id, change, data, data_hash in rows
+            ],
+        )
+        # Interning a payload changes its stored form but not its value.
+        history = []
+        last = {}
+        for entry in entries:
+            if entry["change"] == "modified" and last.get(entry["node_id"]) == entry["data"]:
+                continue
+            last[entry["node_id"]] = entry["data"]
+            history.append(entry)
+        return history
+
+    def diff_tags(self, session, tag_a, tag_b):
+        """
+        Compare the states recorded by two tags of this tree.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            tag_a: Name of the tag to compare from.
+            tag_b: Name of the tag to compare to.
+
+        Returns:
+            dict: For ``nodes`` and ``edges``, the ``added`` entries (as of
+            ``tag_b``), the ``removed`` entries (as of ``tag_a``) and the
+            ``modified`` ones as ``(old, new)`` pairs.
+        """
+        return _collect_diff(self.iter_diff_tags(session, tag_a, tag_b))
+
+    def iter_diff_tags(self, session, tag_a, tag_b):
+        """
+        Like ``diff_tags``, but yield ``(kind, change, old, new)`` tuples one at
+        a time, where ``kind`` is ``"nodes"`` or ``"edges"`` and ``change`` is
+        ``"added"``, ``"removed"`` or ``"modified"``.
+        """
+        states = []
+        for tag_name in (tag_a, tag_b):
+            tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
+            if not tag:
+                raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+            states.append(tag.load_snapshot(session))
+        old, new = states
+
+        node_key = lambda node: node["id"]
+        edge_key = _edge_key
+        if any("id" not in edge for edge in old["edges"] + new["edges"]):
+            edge_key = lambda edge: (edge["incoming_node_id"], edge["outgoing_node_id"])
+        yield from _merge_diff(
+            "nodes", sorted(old["nodes"], key=node_key), sorted(new["nodes"], key=node_key), node_key
+        )
+        yield from _merge_diff(
+            "edges", sorted(old["edges"], key=edge_key), sorted(new["edges"], key=edge_key), edge_key
+        )
+
+    def diff_trees(self, session, other):
+        """
+        Compare the current state of this tree with that of ``other``.
+
+        Nodes and edges are matched by ID, so this compares a copy-on-write
+        branch with its base tree; a full copy has new IDs throughout.
+
+        Returns:
+            dict: The same structure as ``diff_tags``, going from this tree to
+            ``other``.
+        """
+        return _collect_diff(self.iter_diff_trees(session, other))
+
+    def iter_diff_trees(self, session, other):
+        """
+        Like ``diff_trees``, but yield ``(kind, change, old, new)`` tuples while
+        streaming both trees from the database in ID order, so memory use does
+        not grow with the size of the trees.
+        """
+        for kind in ("nodes", "edges"):
+            yield from _diff_tree_rows(session, self, other, kind)
+
+    def export(self, session, fp, format="ndjson", tag_name=None):
+        """
+        Stream this tree, or the state recorded by one of its tags, to a binary
+        file. See ``tree_manager.export.export_tree``.
+        """
+        from tree_manager.export import export_tree
+
+        return export_tree(session, self, fp, format=format, tag_name=tag_name)
+
+    @classmethod
+    def import_(cls, session, fp, name=None):
+        """
+        Create a new tree from a stream written by ``Tree.export``. See
+        ``tree_manager.export.import_tree``.
+        """
+        from tree_manager.export import import_tree
+
+        return import_tree(session, fp, name=name)
+
+    def add_node(self, session, data):
+        new_node = TreeNode(tree_id=self.id, data=data)
+        if self.intern_payloads:
+            new_node.intern_data(session)
+        session.add(new_node)
+        if self.closure_indexed:
+            session.flush()
+            _closure_add_node(session, self.id, new_node.id)
+        if self.aggregates:
+            session.flush()
+            _insert_aggregates(session, self.id, {new_node.id: _own_aggregates(self.aggregates, data)})
+        if self.log_changes:
+            session.flush()
+            _log_change(session, self, "add_node", {"id": new_node.id, "data": data})
+        session.commit()
+        return new_node
+
+    def add_edge(self, session, incoming_node_id, outgoing_node_id, data=None):
+        self._check_endpoints(session, {incoming_node_id, outgoing_node_id})
+        edge = TreeEdge(
+            tree_id=self.id,
+            incoming_node_id=incoming_node_id,
+            outgoing_node_id=outgoing_node_id,
+            data=data or {}
+        )
+        try:
+            if self.intern_payloads:
+                edge.intern_data(session)
+            session.add(edge)
+            if self.closure_indexed:
+                _closure_add_edge(session, self.id, incoming_node_id, outgoing_node_id)
+            if self.aggregates:
+                session.flush()
+                _aggregates_add_edge(session, self, incoming_node_id, outgoing_node_id)
+            if self.log_changes:
+                session.flush()
+                _log_change(
+                    session,
+                    self,
+                    "add_edge",
+                    {
+                        "id": edge.id,
+                        "incoming_node_id": incoming_node_id,
+                        "outgoing_node_id": outgoing_node_id,
+                        "data": data or {},
+                    },
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        _invalidate_graph(self.id)
+        return edge
+
+    def add_nodes(self, session, data):
+        """
+        Add several nodes in one transaction.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            data: Iterable of node payloads.
+
+        Returns:
+            list: The new node IDs, in the same order as ``data``.
+        """
+        return self.apply_changeset(session, {"nodes": data})["nodes"]
+
+    def add_edges(self, session, edges):
+        """
+        Add several edges in one transaction.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            edges: Iterable of ``(incoming_node_id, outgoing_node_id)`` or
+                ``(incoming_node_id, outgoing_node_id, data)`` tuples. Both
+                nodes must belong to this tree.
+
+        Returns:
+            list: The new edge IDs, in the same order as ``edges``.
+        """
+        return self.apply_changeset(session, {"edges": edges})["edges"]
 
-    nodes = relationship("TreeNode", back_populates="tree", cascade="all, delete-orphan")
-    tags = relationship("TreeTag", back_populates="tree", cascade="all, delete-orphan")
+    def apply_changeset(self, session, changeset):
+        """
+        Apply node updates, new nodes and new edges in one transaction.
 
-    @classmethod
-    def get(cls, session, id):
-        return session.query(cls).filter_by(id=id).first()
-    
-    def get_by_tag(self, session, tag_name):
-        tag = session.query(TreeTag).filter_by(tag_name=tag_name).first()
-        return tag.tree if tag else None
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            changeset: A dict with any of
+                ``updates``: ``{node_id: data}`` for nodes of this tree whose
+                payload is replaced. In a copy-on-write branch, nodes shared
+                with the base tree are replaced by copies with new IDs, and
+                nodes the branches of this tree share cannot be updated;
+                ``nodes``: payloads of the nodes to add;
+                ``edges``: tuples as accepted by ``add_edges``. A negative
+                endpoint refers to a node added by the same changeset:
+                ``-1`` is the first entry of ``nodes``, ``-2`` the second.
+                Edges to an updated node that was copied join the copy.
 
-    def create_tag(self, session, tag_name, description=None):
-        try:
-            existing_tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
-            if existing_tag:
-                print(f"Tag '{tag_name}' already exists for this tree with description: '{existing_tag.description}'")
-                return f"Tag '{tag_name}' already exists for this tree with description: '{existing_tag.description}'"
+        Returns:
+            dict: The new IDs of the ``nodes`` and ``edges``, in input order,
+            and ``copies``: ``{node_id: copy_id}`` for the updated nodes
+            that were copied.
+        """
+        updates = changeset.get("updates", {})
+        node_data = list(changeset.get("nodes", ()))
+        edges = [tuple(edge) for edge in changeset.get("edges", ())]
 
-            nodes = session.query(TreeNode).filter_by(tree_id=self.id).all()
-            edges = session.query(TreeEdge).filter(
-                TreeEdge.incoming_node_id.in_([node.id for node in nodes])
-            ).all()
+        copies, edge_copies = {}, {}
+        try:
+            if updates:
+                old_data = {}
+                if self.aggregates:
+                    for chunk in _chunked(list(updates), BULK_BATCH_SIZE):
+                        old_data.update(
+                            session.execute(select(TreeNode.id, TreeNode.data).where(TreeNode.id.in_(chunk))).all()
+                        )
+                copies, edge_copies = self._update_nodes(session, updates)
+                if copies:
+                    _log_change(
+                        session,
+                        self,
+                        "copy_on_write",
+                        {"nodes": sorted(copies.items()), "edges": sorted(edge_copies.items())},
+                    )
+                if self.aggregates:
+                    _aggregates_change_payloads(session, self, old_data, updates)
+            node_ids = _bulk_insert_nodes(
+                session, self.id, _new_payloads(session, node_data, self.intern_payloads)
+            )
+            if self.aggregates and node_ids:
+                _insert_aggregates(
+                    session,
+                    self.id,
+                    {id: _own_aggregates(self.aggregates, data) for id, data in zip(node_ids, node_data)},
+                )
+            if self.closure_indexed and node_ids:
+                session.execute(
+                    insert(TreeClosure.__table__),
+                    [
+                        {"tree_id": self.id, "ancestor_id": id, "descendant_id": id, "depth": 0}
+                        for id in node_ids
+                    ],
+                )
 
-            snapshot = {
-                "nodes": [{"id": node.id, "data": node.data} for node in nodes],
-                "edges": [
-                    {
-                        "incoming_node_id": edge.incoming_node_id,
-                        "outgoing_node_id": edge.outgoing_node_id,
-                        "data": edge.data,
-                    }
-                    for edge in edges
-                ],
-            }
+            def resolve(node_id):
+                if node_id >= 0:
+                    return copies.get(node_id, node_id)
+                if -node_id > len(node_ids):
+                    raise ValueError(f"Changeset has no new node {node_id}.")
+                return node_ids[-node_id - 1]
 
-            tag = TreeTag(
-                tree_id=self.id,
-                tag_name=tag_name,
-                description=description,
-                snapshot=json.dumps(snapshot),  # Serialize snapshot to JSON
+            endpoints = [(resolve(edge[0]), resolve(edge[1])) for edge in edges]
+            self._check_endpoints(session, {id for pair in endpoints for id in pair} - set(node_ids))
+            edge_data = [edge[2] if len(edge) > 2 and edge[2] else {} for edge in edges]
+            payloads = _new_payloads(session, edge_data, self.intern_payloads)
+            edge_ids = _insert_returning_ids(
+                session,
+                TreeEdge.__table__,
+                (
+                    {"tree_id": self.id, "incoming_node_id": incoming, "outgoing_node_id": outgoing, **payload}
+                    for (incoming, outgoing), payload in zip(endpoints, payloads)
+                ),
             )
-            session.add(tag)
+            if self.closure_indexed:
+                for incoming, outgoing in endpoints:
+                    _closure_add_edge(session, self.id, incoming, outgoing)
+            if self.aggregates and len(edge_ids) > AGGREGATE_BATCH_LIMIT:
+                _aggregates_rebuild(session, self)
+            elif self.aggregates:
+                for i, (incoming, outgoing) in enumerate(endpoints):
+                    _aggregates_add_edge(session, self, incoming, outgoing, edge_ids[i + 1:])
+            if updates or node_ids or edge_ids:
+                _log_change(
+                    session,
+                    self,
+                    "apply_changeset",
+                    {
+                        "updates": [{"id": copies.get(id, id), "data": data} for id, data in updates.items()],
+                        "nodes": [{"id": id, "data": data} for id, data in zip(node_ids, node_data)],
+                        "edges": [
+                            {"id": id, "incoming_node_id": incoming, "outgoing_node_id": outgoing, "data": data}
+                            for id, (incoming, outgoing), data in zip(edge_ids, endpoints, edge_data)
+                        ],
+                    },
+                )
             session.commit()
-            return tag
-
-        except Exception as e:
+        except Exception:
             session.rollback()
-            raise ValueError(f"Failed to create tag '{tag_name}': {e}")
+            raise
+        if edge_ids or copies:
+            _invalidate_graph(self.id)
+        return {"nodes": node_ids, "edges": edge_ids, "copies": copies}
 
+    def _check_endpoints(self, session, node_ids):
+        missing = set(node_ids)
+        for chunk in _chunked(list(missing), BULK_BATCH_SIZE):
+            missing.difference_update(
+                session.scalars(select(TreeNode.id).where(TreeNode.id.in_(chunk), self._node_filter()))
+            )
+        if missing:
+            raise ValueError(f"Node IDs not in this tree: {sorted(missing)}")
 
-    def create_new_tree_version_from_tag(self, session, tag_name):
-        tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
-        if not tag:
-            return f"Tag '{tag_name}' does not exist."
+    def _update_nodes(self, session, updates):
+        """
+        Replace the payloads of nodes visible in this tree. Nodes a
+        copy-on-write branch shares with its base tree are copied into the
+        branch first (see ``_copy_on_write``); nodes the copy-on-write
+        branches of this tree can see are not changed.
 
-        new_tree = Tree(name=f"{self.name}_{tag_name}_branch")
-        session.add(new_tree)
-        session.commit()
+        Returns:
+            tuple: The node and edge copies, as returned by ``_copy_on_write``.
+        """
+        nodes = TreeNode.__table__
+        node_ids = list(updates)
+        owners = {}
+        for chunk in _chunked(node_ids, BULK_BATCH_SIZE):
+            owners.update(
+                session.execute(
+                    select(nodes.c.id, nodes.c.tree_id).where(nodes.c.id.in_(chunk), self._node_filter())
+                ).all()
+            )
+        if len(owners) != len(node_ids):
+            raise ValueError(f"Node IDs not in this tree: {sorted(set(node_ids) - set(owners))}")
+        own = [id for id, tree_id in owners.items() if tree_id == self.id]
+        shared = sorted(self._shared_ids(session, "nodes", own))
+        if shared:
+            raise ValueError(f"Node IDs shared with a copy-on-write branch of this tree: {shared}")
 
-        node_mapping = {}
-        for old_node in self.nodes:
-            new_node = TreeNode(tree_id=new_tree.id, data=old_node.data)
-            session.add(new_node)
-            session.commit()  
-            node_mapping[old_node.id] = new_node.id
-
-        for old_node in self.nodes:
-            edges = session.query(TreeEdge).filter_by(incoming_node_id=old_node.id).all()
-            for old_edge in edges:
-                new_edge = TreeEdge(
-                    incoming_node_id=node_mapping[old_edge.incoming_node_id],
-                    outgoing_node_id=node_mapping[old_edge.outgoing_node_id],
-                    data=old_edge.data,
-                )
-                session.add(new_edge)
+        payloads = dict(zip(node_ids, _new_payloads(session, [updates[id] for id in node_ids], self.intern_payloads)))
+        inherited = {id: payloads.pop(id) for id in node_ids if owners[id] != self.id}
+        copies = _copy_on_write(session, self, inherited) if inherited else ({}, {})
+        stmt = (
+            update(nodes)
+            .where(nodes.c.id == bindparam("node_id"))
+            .values(data=bindparam("new_data"), data_hash=bindparam("new_hash"))
+        )
+        for chunk in _chunked(payloads.items(), BULK_BATCH_SIZE):
+            session.connection().execute(
+                stmt,
+                [
+                    {"node_id": id, "new_data": payload["data"], "new_hash": payload["data_hash"]}
+                    for id, payload in chunk
+                ],
+            )
+        return copies
 
+    def enable_closure_index(self, session):
+        """
+        Start maintaining the closure table for this tree, building it from the
+        current edges. Ancestor and subtree queries then become single indexed
+        lookups instead of recursive walks.
+        """
+        if self.base_tree_id is not None:
+            raise ValueError("Copy-on-write branches cannot be closure indexed.")
+        self.closure_indexed = True
+        _closure_rebuild(session, self)
         session.commit()
-        return new_tree
 
-    def restore_from_tag(self, session, tag_name):
-        tag = session.query(TreeTag).filter_by(tree_id=self.id, tag_name=tag_name).first()
-        if not tag:
-            raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+    def enable_aggregates(self, session, aggregates):
+        """
+        Declare the aggregates kept for every node of this tree, replacing any
+        declared before, and compute them.
 
-        snapshot = json.loads(tag.snapshot)
+        Aggregates cover everything below a node, following each path
+        separately: a node reached through two children is counted twice.
+        Edges that close a cycle are left out. They are updated along the
+        ancestors of each node, edge and payload written through ``Tree``,
+        so reading them with ``get_aggregates`` is a single indexed lookup.
 
-        restored_tree = Tree(name=f"{self.name}_rollback_to_{tag_name}")
-        session.add(restored_tree)
-        session.commit()
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            aggregates: ``{name: kind}``, where ``kind`` is ``"count"`` (nodes
+                below), ``"height"`` (edges on the longest path down) or
+                ``("sum", field)`` (sum of a numeric field of ``data`` over
+                the node and the nodes below; missing or non-numeric values
+                count as 0). An empty dict stops maintaining aggregates.
+        """
+        if self.base_tree_id is not None:
+            raise ValueError("Copy-on-write branches cannot maintain aggregates.")
+        self.aggregates = _normalize_aggregates(aggregates)
+        try:
+            _aggregates_rebuild(session, self)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
 
-        node_mapping = {}
-        for node_data in snapshot["nodes"]:
-            new_node = TreeNode(tree_id=restored_tree.id, data=node_data["data"])
-            session.add(new_node)
+    def recompute_aggregates(self, session):
+        """
+        Recompute the declared aggregates from the current nodes and edges,
+        e.g. after writing to the tables directly.
+        """
+        try:
+            _aggregates_rebuild(session, self)
             session.commit()
-            node_mapping[node_data["id"]] = new_node.id
+        except Exception:
+            session.rollback()
+            raise
+
+    def get_aggregates(self, session, node_id):
+        """
+        Read the declared aggregates of a node.
+
+        Returns:
+            dict: ``{name: value}``; empty if the tree declares none or the
+            node is not in it.
+        """
+        if not self.aggregates:
+            return {}
+        table = TreeAggregate.__table__
+        rows = session.execute(
+            select(table.c.name, table.c.value).where(table.c.tree_id == self.id, table.c.node_id == node_id)
+        )
+        return {
+            name: int(value) if self.aggregates[name]["kind"] != "sum" else value
+            for name, value in rows
+            if name in self.aggregates
+        }
 
-        for edge_data in snapshot["edges"]:
-            new_edge = TreeEdge(
-                incoming_node_id=node_mapping[edge_data["incoming_node_id"]],
-                outgoing_node_id=node_mapping[edge_data["outgoing_node_id"]],
-                data=edge_data["data"],
+    def get_ancestors(self, session, node_id, load=None, raw=False):
+        """
+        Retrieve every node above ``node_id``, nearest first.
+        """
+        if self.closure_indexed:
+            query = (
+                session.query(TreeNode)
+                .join(TreeClosure, TreeClosure.ancestor_id == TreeNode.id)
+                .filter(TreeClosure.descendant_id == node_id, TreeClosure.depth > 0)
+                .order_by(TreeClosure.depth, TreeNode.id)
+            )
+        else:
+            depths = _reach_depths(self, node_id, upward=True)
+            query = (
+                session.query(TreeNode)
+                .join(depths, depths.c.node_id == TreeNode.id)
+                .filter(depths.c.depth > 0)
+                .order_by(depths.c.depth, TreeNode.id)
             )
-            session.add(new_edge)
+        return _fetch(session, query, TreeNode, load, raw)
 
-        session.commit()
-        return restored_tree
+    def get_descendants(self, session, node_id, load=None, raw=False):
+        """
+        Retrieve every node below ``node_id``, nearest first.
+        """
+        if self.closure_indexed:
+            query = (
+                session.query(TreeNode)
+                .join(TreeClosure, TreeClosure.descendant_id == TreeNode.id)
+                .filter(TreeClosure.ancestor_id == node_id, TreeClosure.depth > 0)
+                .order_by(TreeClosure.depth, TreeNode.id)
+            )
+        else:
+            depths = _reach_depths(self, node_id)
+            query = (
+                session.query(TreeNode)
+                .join(depths, depths.c.node_id == TreeNode.id)
+                .filter(depths.c.depth > 0)
+                .order_by(depths.c.depth, TreeNode.id)
+            )
+        return _fetch(session, query, TreeNode, load, raw)
 
-    def add_node(self, session, data):
-        new_node = TreeNode(tree_id=self.id, data=data)
-        session.add(new_node)
-        session.commit()
-        return new_node
+    def get_subtree_size(self, session, node_id):
+        """
+        Count the nodes in the subtree rooted at ``node_id``, including itself.
+        """
+        if self.closure_indexed:
+            return session.scalar(
+                select(func.count()).where(TreeClosure.ancestor_id == node_id)
+            )
+        depths = _reach_depths(self, node_id)
+        return session.scalar(
+            select(func.count()).select_from(depths).join(TreeNode, TreeNode.id == depths.c.node_id)
+        )
 
-    def add_edge(self, session, incoming_node_id, outgoing_node_id, data=None):
-        incoming_node = session.query(TreeNode).get(incoming_node_id)
-        outgoing_node = session.query(TreeNode).get(outgoing_node_id)
+    def is_ancestor(self, session, ancestor_id, descendant_id):
+        """
+        Check whether ``ancestor_id`` lies above ``descendant_id``.
+        """
+        if self.closure_indexed:
+            return session.scalar(
+                select(
+                    exists().where(
+                        TreeClosure.ancestor_id == ancestor_id,
+                        TreeClosure.descendant_id == descendant_id,
+                        TreeClosure.depth > 0,
+                    )
+                )
+            )
+        depths = _reach_depths(self, descendant_id, upward=True)
+        return session.scalar(
+            select(exists().where(depths.c.node_id == ancestor_id, depths.c.depth > 0))
+        )
 
-        if not incoming_node or not outgoing_node:
-            raise ValueError(f"One or both node IDs are invalid: {incoming_node_id}, {outgoing_node_id}")
+    def _use_recursive_cte(self, session):
+        return session.get_bind().dialect.name in RECURSIVE_CTE_DIALECTS
 
-        edge = TreeEdge(
-            incoming_node_id=incoming_node_id,
-            outgoing_node_id=outgoing_node_id,
-            data=data or {}
+    def get_root_nodes(self, session, load=None, raw=False):
+        has_parent = exists().where(TreeEdge.outgoing_node_id == TreeNode.id, self._edge_filter())
+        query = session.query(TreeNode).filter(self._node_filter(), ~has_parent).order_by(TreeNode.id)
+        return _fetch(session, query, TreeNode, load, raw)
+
+    def get_node(self, session, node_id, load=None, raw=False):
+        nodes = _fetch(session, session.query(TreeNode).filter_by(id=node_id), TreeNode, load, raw)
+        return nodes[0] if nodes else None
+
+    def get_child_nodes(self, session, node_id, load=None, raw=False):
+        """
+        Retrieve the nodes at the end of the edges leaving ``node_id``, one per
+        edge, in edge order. The nodes are loaded with the edges, in one query.
+        """
+        return self._neighbours(session, TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id, node_id, load, raw)
+
+    def get_parent_nodes(self, session, node_id, load=None, raw=False):
+        """
+        Retrieve the nodes at the start of the edges reaching ``node_id``, one
+        per edge, in edge order.
+        """
+        return self._neighbours(session, TreeEdge.outgoing_node_id, TreeEdge.incoming_node_id, node_id, load, raw)
+
+    def _neighbours(self, session, near, far, node_id, load, raw):
+        if raw:
+            query = (
+                session.query(TreeNode)
+                .join(TreeEdge, far == TreeNode.id)
+                .filter(near == node_id, self._edge_filter())
+                .order_by(TreeEdge.id)
+            )
+            return _fetch(session, query, TreeNode, raw=True)
+        children = near is TreeEdge.incoming_node_id
+        if _graph_cache is not None and load is None:
+            if children:
+                return _graph_cache.get_child_nodes(session, self, node_id)
+            return _graph_cache.get_parent_nodes(session, self, node_id)
+        relationship = TreeEdge.outgoing_node if children else TreeEdge.incoming_node
+        edges = (
+            session.query(TreeEdge)
+            .filter(near == node_id, self._edge_filter())
+            .options(joinedload(relationship).options(*_loader_options(load)))
+            .order_by(TreeEdge.id)
+            .all()
         )
-        session.add(edge)
-        session.commit()
-        return edge
+        return [edge.outgoing_node if children else edge.incoming_node for edge in edges]
 
+    def get_node_edges(self, session, node_id, load=None, raw=False):
+        if _graph_cache is not None and load is None and not raw:
+            return _graph_cache.get_node_edges(session, self, node_id)
+        query = session.query(TreeEdge).filter(
+            (TreeEdge.incoming_node_id == node_id) | (TreeEdge.outgoing_node_id == node_id),
+            self._edge_filter(),
+        )
+        return _fetch(session, query.order_by(TreeEdge.id), TreeEdge, load, raw)
 
-    def get_root_nodes(self, session):
-        return [node for node in self.nodes if not node.has_incoming_edges(session)]
+    def _subtree(self, node_id, include_start):
+        if self.closure_indexed:
+            subtree = select(TreeClosure.descendant_id).where(TreeClosure.ancestor_id == node_id)
+            return subtree if include_start else subtree.where(TreeClosure.depth > 0)
+        reach = _reach_depths(self, node_id)
+        subtree = select(reach.c.node_id)
+        return subtree if include_start else subtree.where(reach.c.depth > 0)
 
-    def get_node(self, session, node_id):
-        return session.query(TreeNode).filter_by(id=node_id).first()
+    def find_nodes(self, session, under=None, load=None, raw=False, **criteria):
+        """
+        Find the nodes whose payload matches every criterion, in one query.
 
-    def get_child_nodes(self, session, node_id):
-        edges = session.query(TreeEdge).filter_by(incoming_node_id=node_id).all()
-        return [edge.outgoing_node for edge in edges]
+        Criteria name a key of ``data``, with ``__`` between the keys of
+        nested objects (``config__mode="fast"`` matches
+        ``{"config": {"mode": "fast"}}``). A value matches equal values, a
+        list or tuple any of its values, and ``None`` a missing key or null.
+        Keys indexed with ``tree_manager.search.create_payload_index`` are
+        looked up through the index. ``under``, ``load`` and ``raw`` cannot be
+        used as criteria.
 
-    def get_parent_nodes(self, session, node_id):
-        edges = session.query(TreeEdge).filter_by(outgoing_node_id=node_id).all()
-        return [edge.incoming_node for edge in edges]
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            under: Only search the nodes below this node.
+            load: Loader options for the nodes, e.g.
+                ``selectinload(TreeNode.outgoing_edges)``, or a list of them.
+            raw: Return ``NodeRow`` tuples instead of ORM objects.
+            **criteria: ``key=value`` pairs the payload must match.
 
-    def get_node_edges(self, session, node_id):
-        return session.query(TreeEdge).filter(
-            (TreeEdge.incoming_node_id == node_id) | (TreeEdge.outgoing_node_id == node_id)
-        ).all()
+        Returns:
+            list: The matching ``TreeNode`` objects, ordered by ID.
+        """
+        query = session.query(TreeNode).filter(
+            self._node_filter(), _payload_condition(session, self, TreeNode, criteria)
+        )
+        if under is not None:
+            query = query.filter(TreeNode.id.in_(self._subtree(under, include_start=False)))
+        return _fetch(session, query.order_by(TreeNode.id), TreeNode, load, raw)
+
+    def find_edges(self, session, under=None, load=None, raw=False, **criteria):
+        """
+        Like ``find_nodes``, for the payloads of edges.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            under: Only search the edges leaving this node or a node below it.
+            load: Loader options for the edges, or a list of them.
+            raw: Return ``EdgeRow`` tuples instead of ORM objects.
+            **criteria: ``key=value`` pairs the payload must match.
+
+        Returns:
+            list: The matching ``TreeEdge`` objects, ordered by ID.
+        """
+        query = session.query(TreeEdge).filter(
+            self._edge_filter(), _payload_condition(session, self, TreeEdge, criteria)
+        )
+        if under is not None:
+            query = query.filter(TreeEdge.incoming_node_id.in_(self._subtree(under, include_start=True)))
+        return _fetch(session, query.order_by(TreeEdge.id), TreeEdge, load, raw)
 
     def traverse_tree(self, session, start_node_id):
         """
         Traverse the tree starting from a given node and gather information about 
         all connected nodes and edges.
 
+        The walk is a single recursive query; each node is reported once, at its
+        shortest distance from the start node, in breadth-first order.
+
         Args:
             session: SQLAlchemy session to interact with the database.
             start_node_id: The ID of the starting node for traversal.
@@ -185,7 +2423,43 @@ class Tree(Base):
         Returns:
             dict: A dictionary containing information about the nodes and edges.
         """
-        def traverse(node_id, visited):
+        if not self._use_recursive_cte(session):
+            return self._traverse_tree_python(session, start_node_id)
+
+        depths = _reach_depths(self, start_node_id)
+        rows = session.execute(
+            select(
+                TreeNode.id,
+                TreeNode.data.label("node_data"),
+                depths.c.depth,
+                TreeEdge.id.label("edge_id"),
+                TreeEdge.incoming_node_id,
+                TreeEdge.outgoing_node_id,
+                TreeEdge.data.label("edge_data"),
+            )
+            .join(depths, depths.c.node_id == TreeNode.id)
+            .outerjoin(TreeEdge, and_(TreeEdge.incoming_node_id == TreeNode.id, self._edge_filter()))
+            .order_by(depths.c.depth, TreeNode.id, TreeEdge.id)
+        )
+
+        result = {"nodes": [], "edges": []}
+        node_info = None
+        for row in rows:
+            if node_info is None or node_info["id"] != row.id:
+                node_info = {"id": row.id, "data": row.node_data, "depth": row.depth, "edges": []}
+                result["nodes"].append(node_info)
+            if row.edge_id is not None:
+                edge_info = {
+                    "incoming_node_id": row.incoming_node_id,
+                    "outgoing_node_id": row.outgoing_node_id,
+                    "data": row.edge_data,
+                }
+                node_info["edges"].append(edge_info)
+                result["edges"].append(edge_info)
+        return result
+
+    def _traverse_tree_python(self, session, start_node_id):
+        def traverse(node_id, visited, depth):
             if node_id in visited:
                 return  
             visited.add(node_id)
@@ -194,10 +2468,12 @@ class Tree(Base):
             if not node:
                 return
             
-            node_info = {"id": node.id, "data": node.data, "edges": []}
+            node_info = {"id": node.id, "data": node.data, "depth": depth, "edges": []}
             result["nodes"].append(node_info)
 
-            outgoing_edges = session.query(TreeEdge).filter_by(incoming_node_id=node_id).all()
+            outgoing_edges = (
+                session.query(TreeEdge).filter_by(incoming_node_id=node_id).filter(self._edge_filter()).all()
+            )
             for edge in outgoing_edges:
                 edge_info = {
                     "incoming_node_id": edge.incoming_node_id,
@@ -207,19 +2483,44 @@ class Tree(Base):
                 node_info["edges"].append(edge_info)
                 result["edges"].append(edge_info)
 
-                traverse(edge.outgoing_node_id, visited)
+                traverse(edge.outgoing_node_id, visited, depth + 1)
 
         result = {"nodes": [], "edges": []}
         visited = set()  
 
-        traverse(start_node_id, visited)
+        traverse(start_node_id, visited, 0)
         return result
 
     def start_traversal(self, session):
         
         self.traverse_tree(session, rood_id = 1)
 
-    def get_nodes_at_depth(self, session, depth):
+    def get_nodes_at_depth(self, session, depth, load=None, raw=False):
+        if not self._use_recursive_cte(session):
+            nodes = self._get_nodes_at_depth_python(session, depth)
+            return [_as_row(node) for node in nodes] if raw else nodes
+
+        has_parent = exists().where(TreeEdge.outgoing_node_id == TreeNode.id, self._edge_filter())
+        levels = (
+            select(TreeNode.id.label("node_id"), literal(0).label("depth"))
+            .where(self._node_filter(), ~has_parent)
+            .cte("levels", recursive=True)
+        )
+        # UNION keeps one row per node and depth, however many paths reach it.
+        levels = levels.union(
+            select(TreeEdge.outgoing_node_id, levels.c.depth + 1)
+            .join(levels, TreeEdge.incoming_node_id == levels.c.node_id)
+            .where(levels.c.depth < depth, self._edge_filter())
+        )
+        query = (
+            session.query(TreeNode)
+            .join(levels, levels.c.node_id == TreeNode.id)
+            .filter(levels.c.depth == depth)
+            .order_by(TreeNode.id)
+        )
+        return _fetch(session, query, TreeNode, load, raw)
+
+    def _get_nodes_at_depth_python(self, session, depth):
         def traverse(node, current_depth):
             if current_depth == depth:
                 return [node]
@@ -235,7 +2536,165 @@ class Tree(Base):
             result.extend(traverse(root, 0))
         return result
 
-    def find_path(self, session, start_node_id, end_node_id):
+    def find_path(self, session, start_node_id, end_node_id, load=None, raw=False):
+        """
+        Find a path between two nodes, following edges in either direction.
+
+        The search is one statement of recursive queries that keep one row
+        per node, depth and edge it was reached through, breadth first: one
+        checks that the end node is reachable at all, one finds its distance,
+        stopping at the first row that reaches it, and one reads the rows up
+        to that distance. A last one walks the path back from the end node
+        through the lowest edge ID reaching each node, and the result joins
+        it to the nodes and edges. Loader options in ``load`` and interned
+        payloads with ``raw`` may add their own queries.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            start_node_id: The ID of the node the path starts from.
+            end_node_id: The ID of the node the path ends at.
+            load: Loader options for the nodes, or a list of them.
+            raw: Return ``NodeRow`` and ``EdgeRow`` tuples instead of ORM
+                objects.
+
+        Returns:
+            list: ``(node, edge)`` pairs from start to end, where ``edge`` leads
+            to the next node and is ``None`` for the last node. Empty if the
+            nodes are not connected.
+        """
+        if not self._use_recursive_cte(session):
+            path = self._find_path_python(session, start_node_id, end_node_id)
+            if raw:
+                return [(_as_row(node), edge and _as_row(edge)) for node, edge in path]
+            return path
+
+        def step(node_id):
+            # The other end of each visible edge touching ``node_id``. The tree
+            # filter is repeated in both branches of the OR so that each can
+            # be looked up through its endpoint index.
+            other_id = case(
+                (TreeEdge.incoming_node_id == node_id, TreeEdge.outgoing_node_id),
+                else_=TreeEdge.incoming_node_id,
+            )
+            touches = or_(
+                and_(TreeEdge.incoming_node_id == node_id, self._edge_filter()),
+                and_(TreeEdge.outgoing_node_id == node_id, self._edge_filter()),
+            )
+            return other_id, touches
+
+        # Each node reached once, so this is linear in the size of the tree.
+        component = (
+            select(TreeNode.id.label("node_id")).where(TreeNode.id == start_node_id).cte("component", recursive=True)
+        )
+        other_id, touches = step(component.c.node_id)
+        component = component.union(select(other_id).join(component, touches))
+        # SQLite 3.35+ otherwise computes a walk in full when the query reading
+        # it is materialized, before any EXISTS or LIMIT can stop it.
+        dialect = session.get_bind().dialect
+        hint = dialect.name == "sqlite" and dialect.server_version_info >= (3, 35)
+        if hint:
+            component = component.prefix_with("NOT MATERIALIZED")
+
+        def walks(name, max_depth):
+            # Rows of (node_id, depth, edge_id). Rows never step back over
+            # the edge they came through, and are only deduplicated per edge,
+            # so a node reached around a cycle again gets more rows; capping
+            # the depth keeps their number bounded.
+            rows = (
+                select(TreeNode.id.label("node_id"), literal(0).label("depth"), literal(0).label("edge_id"))
+                .where(TreeNode.id == start_node_id)
+                .cte(name, recursive=True)
+            )
+            other_id, touches = step(rows.c.node_id)
+            return rows.union(
+                select(other_id, rows.c.depth + 1, TreeEdge.id)
+                .join(rows, touches)
+                .where(
+                    rows.c.node_id != end_node_id,
+                    rows.c.depth < max_depth,
+                    TreeEdge.id != rows.c.edge_id,
+                )
+            )
+
+        # Breadth-first rows come out nearest first, so the first row reaching
+        # the end node has its distance, and the walk stops there. Its depth
+        # is capped by the size of the tree, or at 0 if the component shows
+        # the end node cannot be reached at all. (``+ 0`` keeps SQLite from
+        # indexing the whole component before looking the end node up.)
+        reachable = exists().where(component.c.node_id + 0 == end_node_id)
+        reach = walks(
+            "reach", select(func.count(TreeNode.id)).where(self._node_filter(), reachable).scalar_subquery()
+        )
+        if hint:
+            reach = reach.prefix_with("NOT MATERIALIZED")
+        distance = select(reach.c.depth).where(reach.c.node_id == end_node_id).limit(1).cte("distance")
+        walked = walks("walks", select(distance.c.depth).scalar_subquery())
+        # Of the edges reaching a node at a depth, the one with the lowest ID.
+        parents = (
+            select(walked.c.node_id, walked.c.depth, func.min(walked.c.edge_id).label("edge_id"))
+            .where(walked.c.depth > 0)
+            .group_by(walked.c.node_id, walked.c.depth)
+            .cte("parents")
+        )
+        # The path, walked back from the end node; each row holds the edge to
+        # the node after it.
+        path = select(
+            literal(end_node_id).label("node_id"), distance.c.depth, cast(literal(None), Integer).label("edge_id")
+        ).cte("path", recursive=True)
+        path = path.union_all(
+            select(
+                case(
+                    (TreeEdge.incoming_node_id == path.c.node_id, TreeEdge.outgoing_node_id),
+                    else_=TreeEdge.incoming_node_id,
+                ),
+                path.c.depth - 1,
+                parents.c.edge_id,
+            )
+            .join(parents, and_(parents.c.node_id == path.c.node_id, parents.c.depth == path.c.depth))
+            .join(TreeEdge, TreeEdge.id == parents.c.edge_id)
+        )
+
+        nodes = TreeNode.__table__
+        edges = TreeEdge.__table__
+        if not raw:
+            statement = (
+                select(TreeNode, TreeEdge)
+                .join(path, TreeNode.id == path.c.node_id)
+                .outerjoin(TreeEdge, TreeEdge.id == path.c.edge_id)
+                .order_by(path.c.depth)
+                .options(*_loader_options(load))
+            )
+            return [tuple(row) for row in session.execute(statement)]
+        rows = session.execute(
+            select(
+                nodes.c.id,
+                nodes.c.data,
+                nodes.c.data_hash,
+                edges.c.id,
+                edges.c.incoming_node_id,
+                edges.c.outgoing_node_id,
+                edges.c.data,
+                edges.c.data_hash,
+            )
+            .join(path, nodes.c.id == path.c.node_id)
+            .outerjoin(edges, edges.c.id == path.c.edge_id)
+            .order_by(path.c.depth)
+        ).all()
+        hashes = {digest for row in rows for digest in (row[2], row[7]) if digest is not None}
+        blobs = {}
+        for chunk in _chunked(list(hashes), BULK_BATCH_SIZE):
+            blobs.update(session.execute(select(TreeBlob.hash, TreeBlob.data).where(TreeBlob.hash.in_(chunk))).all())
+        return [
+            (
+                NodeRow(node_id, node_data if node_hash is None else blobs[node_hash]),
+                None
+                if edge_id is None
+                else EdgeRow(edge_id, incoming, outgoing, edge_data if edge_hash is None else blobs[edge_hash]),
+            )
+            for node_id, node_data, node_hash, edge_id, incoming, outgoing, edge_data, edge_hash in rows
+        ]
+
+    def _find_path_python(self, session, start_node_id, end_node_id):
         visited = set()
         path = []
 
@@ -259,6 +2718,29 @@ class Tree(Base):
         return path
 
 
+def _instrumented(method):
+    name = method.__name__
+
+    @functools.wraps(method)
+    def call(self, session, *args, **kwargs):
+        if _instrumentation is None:
+            return method(self, session, *args, **kwargs)
+        return _instrumentation.measure(name, self, lambda: method(self, session, *args, **kwargs))
+
+    return call
+
+
+# Route every public Tree method through the installed instrumentation.
+# Generator methods are left alone: their work happens as they are consumed.
+for _name, _attribute in list(vars(Tree).items()):
+    if _name.startswith("_"):
+        continue
+    if isinstance(_attribute, classmethod):
+        setattr(Tree, _name, classmethod(_instrumented(_attribute.__func__)))
+    elif inspect.isfunction(_attribute) and not inspect.isgeneratorfunction(_attribute):
+        setattr(Tree, _name, _instrumented(_attribute))
+
+
 class TreeTag(Base):
     __tablename__ = "tree_tag"
 
@@ -268,20 +2750,255 @@ class TreeTag(Base):
     description = Column(String)
     snapshot = Column(JSON, nullable=False)  # Store the tree state as JSON
     created_at = Column(TIMESTAMP, default=func.current_timestamp())
+    # "full" snapshots hold the whole tree; "delta" snapshots hold only the
+    # changes since ``parent_tag_id``, ``delta_depth`` tags after a full one.
+    snapshot_format = Column(String, nullable=False, default="full", server_default="full")
+    parent_tag_id = Column(Integer, ForeignKey("tree_tag.id"), nullable=True)
+    delta_depth = Column(Integer, nullable=False, default=0, server_default="0")
+    # Whether the tag's node changes are in tree_tag_change. Tags created
+    # before the change index existed are indexed by the first history query.
+    changes_indexed = Column(Boolean, nullable=False, default=False, server_default=false())
 
     tree = relationship("Tree", back_populates="tags")
+    parent_tag = relationship("TreeTag", remote_side=[id])
 
-    __table_args__ = (UniqueConstraint("tree_id", "tag_name", name="unique_tree_tag_per_tree"),)
+    # The unique constraint also indexes (tree_id, tag_name) lookups;
+    # ``get_by_tag`` looks tags up by name alone. AUTOINCREMENT keeps SQLite
+    # from reusing the IDs of deleted tags, which TagView caches by.
+    __table_args__ = (
+        UniqueConstraint("tree_id", "tag_name", name="unique_tree_tag_per_tree"),
+        Index("ix_tree_tag_tag_name", "tag_name"),
+        {"sqlite_autoincrement": True},
+    )
 
-class TreeNode(Base):
-    __tablename__ = "tree_node"
+    def load_snapshot(self, session, resolve_payloads=True, node_ids=None):
+        """
+        Reconstruct the tree state recorded by this tag, replaying deltas on
+        top of the nearest full snapshot.
+
+        Args:
+            session: SQLAlchemy session to interact with the database.
+            resolve_payloads: Replace ``data_hash`` references to interned
+                payloads with the payloads themselves.
+            node_ids: Only return these nodes and the edges between them. For
+                ``"rows"`` tags, only those rows are read.
+
+        Returns:
+            dict: The ``nodes`` and ``edges`` of the tree at tagging time.
+        """
+        chain = []
+        tag = self
+        while tag.snapshot_format == "delta":
+            chain.append(tag)
+            tag = tag.parent_tag
+        if tag.snapshot_format == "rows":
+            state = {kind: _tag_rows(session, tag, kind, node_ids) for kind in ("nodes", "edges")}
+        else:
+            state = json.loads(tag.snapshot)
+        if chain:
+            state = _apply_deltas(state, [json.loads(delta_tag.snapshot) for delta_tag in reversed(chain)])
+        if node_ids is not None:
+            state = _state_subset(state, node_ids)
+        if resolve_payloads:
+            state["nodes"] = _resolve_payloads(session, [dict(entry) for entry in state["nodes"]])
+            state["edges"] = _resolve_payloads(session, [dict(entry) for entry in state["edges"]])
+        return state
+
+    def get_node(self, session, node_id):
+        """
+        The snapshot entry (``{"id", "data"}``) of a node as of this tag, or
+        ``None`` if the node did not exist then. For ``"rows"`` tags this reads
+        a single row.
+        """
+        if self.snapshot_format == "rows":
+            entries = _resolve_payloads(session, _tag_rows(session, self, "nodes", [node_id]))
+        else:
+            entries = self.load_snapshot(session, node_ids=[node_id])["nodes"]
+        return entries[0] if entries else None
+
+
+class TreeTagChange(Base):
+    """
+    A node that a tag added, modified or removed relative to the previous tag
+    of its tree, with its payload as of the tag.
+    """
+    __tablename__ = "tree_tag_change"
+
+    id = Column(Integer, primary_key=True)
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=False)
+    tag_id = Column(Integer, ForeignKey("tree_tag.id"), nullable=False)
+    node_id = Column(Integer, nullable=False)
+    change = Column(String, nullable=False)
+    data = Column(JSON, nullable=True)
+    data_hash = Column(String(64), ForeignKey("tree_blob.hash"), nullable=True)
+
+    __table_args__ = (Index("ix_tree_tag_change_node_id", "tree_id", "node_id", "tag_id"),)
+
+
+class TreeTagNode(Base):
+    """
+    A node as recorded by the ``"rows"`` tags of a tree: from tag
+    ``valid_from`` up to, but not including, tag ``valid_to``, which is
+    ``None`` while the tree's latest tag still records it.
+    """
+    __tablename__ = "tree_tag_node"
+
+    id = Column(Integer, primary_key=True)
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=False)
+    node_id = Column(Integer, nullable=False)
+    valid_from = Column(Integer, ForeignKey("tree_tag.id"), nullable=False)
+    valid_to = Column(Integer, ForeignKey("tree_tag.id"), nullable=True)
+    data = Column(JSON, nullable=True)
+    data_hash = Column(String(64), ForeignKey("tree_blob.hash"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_tree_tag_node_node_id", "tree_id", "node_id", "valid_from"),
+        Index("ix_tree_tag_node_valid_to", "tree_id", "valid_to"),
+    )
+
+
+class TreeTagEdge(Base):
+    """
+    An edge as recorded by the ``"rows"`` tags of a tree; see ``TreeTagNode``.
+    """
+    __tablename__ = "tree_tag_edge"
 
     id = Column(Integer, primary_key=True)
     tree_id = Column(Integer, ForeignKey("tree.id"), nullable=False)
+    edge_id = Column(Integer, nullable=False)
+    incoming_node_id = Column(Integer, nullable=False)
+    outgoing_node_id = Column(Integer, nullable=False)
+    valid_from = Column(Integer, ForeignKey("tree_tag.id"), nullable=False)
+    valid_to = Column(Integer, ForeignKey("tree_tag.id"), nullable=True)
+    data = Column(JSON, nullable=True)
+    data_hash = Column(String(64), ForeignKey("tree_blob.hash"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_tree_tag_edge_incoming_node_id", "tree_id", "incoming_node_id", "valid_from"),
+        Index("ix_tree_tag_edge_valid_to", "tree_id", "valid_to"),
+    )
+
+class TreeChange(Base):
+    """
+    One write to a tree with ``log_changes`` set, appended in the transaction
+    of the write. ``seq`` only grows, so consumers resume after the last one
+    they applied; see ``tree_manager.changelog``.
+    """
+    __tablename__ = "tree_change"
+
+    seq = Column(Integer, primary_key=True)
+    # NULL for the markers left by ``compact_changes``.
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=True)
+    op = Column(String, nullable=False)
+    payload = Column(JSON, nullable=True)
+    created_at = Column(TIMESTAMP, default=func.current_timestamp())
+
+    # AUTOINCREMENT keeps SQLite from reusing the sequence numbers of
+    # compacted changes.
+    __table_args__ = (Index("ix_tree_change_tree_id", "tree_id", "seq"), {"sqlite_autoincrement": True})
+
+
+class TreeClosure(Base):
+    """
+    Every (ancestor, descendant) pair of a closure-indexed tree, including each
+    node paired with itself at depth 0.
+    """
+    __tablename__ = "tree_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("tree_node.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("tree_node.id"), primary_key=True)
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=False, index=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_tree_closure_descendant", "descendant_id", "depth"),)
+
+
+class TreeAggregate(Base):
+    """
+    The value of one aggregate declared with ``Tree.enable_aggregates`` for
+    the subtree below a node.
+    """
+    __tablename__ = "tree_aggregate"
+
+    tree_id = Column(Integer, ForeignKey("tree.id"), primary_key=True)
+    node_id = Column(Integer, ForeignKey("tree_node.id"), primary_key=True)
+    name = Column(String, primary_key=True)
+    value = Column(Float, nullable=False)
+
+
+class TreeOverride(Base):
+    """
+    A node or edge a copy-on-write branch replaced with a copy of its own
+    when it changed it. The row stays in place for the trees sharing it and is
+    hidden from the branch, and from later branches of the branch that see
+    the copy.
+    """
+    __tablename__ = "tree_override"
+
+    # "nodes" or "edges".
+    kind = Column(String, primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    tree_id = Column(Integer, ForeignKey("tree.id"), primary_key=True)
+    copy_id = Column(Integer, nullable=False)
+
+
+class TreeBlob(Base):
+    """
+    A node or edge payload stored once, keyed by the SHA-256 of its canonical
+    JSON.
+    """
+    __tablename__ = "tree_blob"
+
+    hash = Column(String(64), primary_key=True)
     data = Column(JSON, nullable=True)
+
+
+class _InternedPayload:
+    """
+    ``data`` for rows whose payload is either inline or interned in tree_blob.
+    """
+
+    @hybrid_property
+    def data(self):
+        if self.data_hash is not None:
+            return self.blob.data
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.data_hash = None
+
+    @data.expression
+    def data(cls):
+        interned = select(TreeBlob.data).where(TreeBlob.hash == cls.data_hash).scalar_subquery()
+        return func.coalesce(interned, cls._data, type_=JSON)
+
+    def intern_data(self, session):
+        """
+        Move this row's payload into tree_blob, keeping only its hash.
+        """
+        if self.data_hash is None:
+            digest = _store_blobs(session, [self._data])[0]
+            self._data = None
+            self.data_hash = digest
+            self.blob = session.get(TreeBlob, digest)
+
+
+class TreeNode(_InternedPayload, Base):
+    __tablename__ = "tree_node"
+
+    id = Column(Integer, primary_key=True)
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=False)
+    # The node this row was copied from by a branch, restore or merge, so the
+    # copies of a node can be matched across trees; ``None`` for originals.
+    origin_id = Column(Integer, nullable=True)
+    _data = Column("data", JSON, nullable=True)
+    data_hash = Column(String(64), ForeignKey("tree_blob.hash"), nullable=True)
     created_at = Column(TIMESTAMP, default=func.current_timestamp())
 
     tree = relationship("Tree", back_populates="nodes")
+    blob = relationship("TreeBlob", lazy="selectin")
     incoming_edges = relationship(
         "TreeEdge", foreign_keys="[TreeEdge.incoming_node_id]", back_populates="incoming_node"
     )
@@ -289,18 +3006,51 @@ class TreeNode(Base):
         "TreeEdge", foreign_keys="[TreeEdge.outgoing_node_id]", back_populates="outgoing_node"
     )
 
+    # AUTOINCREMENT keeps SQLite from reusing the IDs of deleted rows, which
+    # copy-on-write branches of the node's tree would otherwise see.
+    __table_args__ = (Index("ix_tree_node_tree_id", "tree_id"), {"sqlite_autoincrement": True})
+
     def has_incoming_edges(self, session):
         return session.query(TreeEdge).filter_by(outgoing_node_id=self.id).first() is not None
 
 
-class TreeEdge(Base):
+class TreeEdge(_InternedPayload, Base):
     __tablename__ = "tree_edge"
 
     id = Column(Integer, primary_key=True)
+    # The tree the edge was added to. Filled in from the incoming node when not
+    # given; edges written before the column existed are backfilled by
+    # ``tree_manager.migrations.upgrade``.
+    tree_id = Column(Integer, ForeignKey("tree.id"), nullable=True)
     incoming_node_id = Column(Integer, ForeignKey("tree_node.id"), nullable=False)
     outgoing_node_id = Column(Integer, ForeignKey("tree_node.id"), nullable=False)
-    data = Column(JSON, nullable=True)
+    # The edge this row was copied from, as for ``TreeNode.origin_id``.
+    origin_id = Column(Integer, nullable=True)
+    _data = Column("data", JSON, nullable=True)
+    data_hash = Column(String(64), ForeignKey("tree_blob.hash"), nullable=True)
     created_at = Column(TIMESTAMP, default=func.current_timestamp())
 
+    blob = relationship("TreeBlob", lazy="selectin")
+
     incoming_node = relationship("TreeNode", foreign_keys=[incoming_node_id])
     outgoing_node = relationship("TreeNode", foreign_keys=[outgoing_node_id])
+
+    __table_args__ = (
+        Index("ix_tree_edge_tree_id", "tree_id"),
+        # Lookups by endpoint also filter on tree_id; matching both columns
+        # keeps SQLite from scanning the whole tree through ix_tree_edge_tree_id.
+        Index("ix_tree_edge_incoming_node_id", "incoming_node_id", "tree_id"),
+        Index("ix_tree_edge_outgoing_node_id", "outgoing_node_id", "tree_id"),
+        # As for tree_node.
+        {"sqlite_autoincrement": True},
+    )
+
+
+@event.listens_for(TreeEdge, "before_insert")
+def _default_edge_tree(mapper, connection, edge):
+    # Edges created directly, e.g. ``TreeEdge(incoming_node_id=..., ...)``,
+    # belong to the tree of their incoming node.
+    if edge.tree_id is None and edge.incoming_node_id is not None:
+        edge.tree_id = connection.scalar(
+            select(TreeNode.tree_id).where(TreeNode.id == edge.incoming_node_id)
+        )
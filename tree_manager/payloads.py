@@ -0,0 +1,92 @@
+"""
+Content-addressed payload storage for node and edge ``data``.
+
+Trees with ``intern_payloads`` set store each distinct payload once in
+tree_blob and reference it by hash from tree_node, tree_edge and tag
+snapshots. To switch a tree of an existing database over (run
+``python -m tree_manager.migrations`` first):
+
+    python -m tree_manager.payloads intern <tree_id> [database_url]
+"""
+import sys
+
+from sqlalchemy import bindparam, create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+
+from tree_manager.models import (
+    BULK_BATCH_SIZE,
+    Tree,
+    TreeEdge,
+    TreeNode,
+    _chunked,
+    _store_blobs,
+)
+
+
+def _intern_rows(session, table, rows):
+    count = 0
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(data=None, data_hash=bindparam("row_hash"))
+    )
+    for chunk in _chunked(rows, BULK_BATCH_SIZE):
+        hashes = _store_blobs(session, [data for _, data in chunk])
+        session.connection().execute(
+            stmt, [{"row_id": id, "row_hash": digest} for (id, _), digest in zip(chunk, hashes)]
+        )
+        count += len(chunk)
+    return count
+
+
+def intern_tree_payloads(session, tree_id):
+    """
+    Move the inline payloads of a tree's nodes and edges into tree_blob and
+    enable ``intern_payloads`` for it, so later writes are interned too.
+
+    Returns:
+        dict: The number of ``nodes`` and ``edges`` whose payload was moved.
+    """
+    tree = Tree.get(session, tree_id)
+    if not tree:
+        raise ValueError(f"No tree found with ID: {tree_id}.")
+
+    nodes = TreeNode.__table__
+    edges = TreeEdge.__table__
+    try:
+        node_rows = session.execute(
+            select(nodes.c.id, nodes.c.data).where(nodes.c.tree_id == tree_id, nodes.c.data_hash.is_(None))
+        ).all()
+        edge_rows = session.execute(
+            select(edges.c.id, edges.c.data).where(edges.c.tree_id == tree_id, edges.c.data_hash.is_(None))
+        ).all()
+        counts = {
+            "nodes": _intern_rows(session, nodes, node_rows),
+            "edges": _intern_rows(session, edges, edge_rows),
+        }
+        tree.intern_payloads = True
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return counts
+
+
+def main(argv):
+    if len(argv) not in (2, 3) or argv[0] != "intern":
+        print("Usage: python -m tree_manager.payloads intern <tree_id> [database_url]")
+        return 1
+
+    tree_id = int(argv[1])
+    url = argv[2] if len(argv) == 3 else "sqlite:///database.db"
+    session = sessionmaker(bind=create_engine(url))()
+    try:
+        counts = intern_tree_payloads(session, tree_id)
+    finally:
+        session.close()
+    print(f"Interned payloads of tree {tree_id}: {counts['nodes']} nodes, {counts['edges']} edges.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+"""
+Expression indexes on payload keys searched often with ``Tree.find_nodes``
+and ``Tree.find_edges``.
+
+    from tree_manager.search import create_payload_index
+
+    create_payload_index(engine, "node", "setting")
+    tree.find_nodes(session, under=node_id, setting="experimental")   # one indexed query
+
+Each index covers ``(tree_id, <value at the key>)`` on tree_node or tree_edge,
+plus the value at the key on tree_blob for trees that intern their payloads.
+The indexes are not part of the models, so ``create_all`` and
+``tree_manager.migrations`` leave them alone; create them once per database:
+
+    python -m tree_manager.search index {node|edge} <key> [database_url]
+    python -m tree_manager.search drop {node|edge} <key> [database_url]
+
+Keys of nested objects are joined with ``__``, as in the search criteria.
+"""
+import sys
+
+from sqlalchemy import Index, MetaData, create_engine, inspect
+
+from tree_manager.models import TreeBlob, TreeEdge, TreeNode, _json_field, _payload_path
+
+# Tables whose payloads can be indexed, by the name used in the API.
+PAYLOAD_TABLES = {"node": TreeNode.__table__, "edge": TreeEdge.__table__}
+
+
+def payload_indexes(dialect_name, kind, key):
+    """
+    Build the indexes behind searches on ``key`` of node or edge payloads,
+    on copies of the tables so they don't become part of the models.
+
+    Returns:
+        list: The ``Index`` on tree_node or tree_edge, then the one on
+        tree_blob.
+    """
+    if kind not in PAYLOAD_TABLES:
+        raise ValueError(f"Unknown payload kind: {kind!r}. Expected one of {tuple(PAYLOAD_TABLES)}.")
+    path = _payload_path(key)
+    metadata = MetaData()
+    table = PAYLOAD_TABLES[kind].to_metadata(metadata)
+    blobs = TreeBlob.__table__.to_metadata(metadata)
+    return [
+        Index(f"ix_{table.name}_data_{key}", table.c.tree_id, _json_field(dialect_name, table.c.data, path)),
+        Index(f"ix_tree_blob_data_{key}", _json_field(dialect_name, blobs.c.data, path)),
+    ]
+
+
+def _index_exists(connection, table, name):
+    if connection.dialect.name == "sqlite":
+        # SQLAlchemy does not reflect expression indexes on SQLite.
+        return connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+        ).first() is not None
+    return any(index["name"] == name for index in inspect(connection).get_indexes(table.name))
+
+
+def create_payload_index(engine, kind, key):
+    """
+    Index ``key`` of node or edge payloads, if it isn't already.
+
+    Returns:
+        list: The names of the indexes.
+    """
+    with engine.begin() as connection:
+        indexes = payload_indexes(connection.dialect.name, kind, key)
+        for index in indexes:
+            if not _index_exists(connection, index.table, index.name):
+                index.create(connection)
+    return [index.name for index in indexes]
+
+
+def drop_payload_index(engine, kind, key):
+    """
+    Drop the index on ``key`` of node or edge payloads. The tree_blob index
+    is shared by nodes and edges and is kept while the other kind still
+    indexes the key.
+
+    Returns:
+        list: The names of the indexes dropped.
+    """
+    dropped = []
+    with engine.begin() as connection:
+        own, shared = payload_indexes(connection.dialect.name, kind, key)
+        others = [
+            payload_indexes(connection.dialect.name, other, key)[0] for other in PAYLOAD_TABLES if other != kind
+        ]
+        if any(_index_exists(connection, other.table, other.name) for other in others):
+            shared = None
+        for index in (own, shared):
+            if index is not None and _index_exists(connection, index.table, index.name):
+                index.drop(connection)
+                dropped.append(index.name)
+    return dropped
+
+
+def main(argv):
+    if len(argv) not in (3, 4) or argv[0] not in ("index", "drop"):
+        print("Usage: python -m tree_manager.search {index|drop} {node|edge} <key> [database_url]")
+        return 1
+
+    command, kind, key = argv[:3]
+    url = argv[3] if len(argv) == 4 else "sqlite:///database.db"
+    engine = create_engine(url)
+    if command == "index":
+        names = create_payload_index(engine, kind, key)
+        print(f"Indexed with {', '.join(names)}")
+    else:
+        names = drop_payload_index(engine, kind, key)
+        print(f"Dropped {', '.join(names) or 'nothing'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,195 @@
+"""
+Read-only access to the tree state recorded by a tag, without restoring it.
+
+    view = tree.tag_view(session, "v1")
+    view.get_node(session, node_id)
+    view.get_child_nodes(session, node_id)
+
+``TagView`` offers the read methods of ``Tree`` with the same arguments and
+results, answered from the tag's snapshot instead of the live tables. Nodes
+and edges come back as ``TagNode`` and ``TagEdge`` tuples, which have the
+attributes of ``TreeNode`` and ``TreeEdge`` that a snapshot records.
+
+Nothing is read until the first query. The snapshot is then loaded once
+(replaying deltas and resolving interned payloads) and indexed in memory.
+The index is shared by every view of the same tag, and the
+``TAG_VIEW_CACHE_SIZE`` most recently used indexes are kept per engine. Tags
+never change after they are created, so cached indexes never go stale. They
+are keyed by more than the tag's ID, which SQLite can hand to a new tag once
+the old one is deleted in databases created before tree_tag used
+AUTOINCREMENT.
+"""
+import threading
+import weakref
+from collections import OrderedDict, deque, namedtuple
+
+TagNode = namedtuple("TagNode", "id data")
+TagEdge = namedtuple("TagEdge", "id incoming_node_id outgoing_node_id data")
+
+# Snapshot indexes kept per engine before the least recently used is dropped.
+TAG_VIEW_CACHE_SIZE = 16
+
+# {engine: OrderedDict((tag_id, tree_id, tag_name, created_at): _SnapshotIndex)}
+_indexes = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+class _SnapshotIndex:
+    """Nodes of a snapshot by ID, and their edges by endpoint."""
+
+    def __init__(self, state):
+        self.nodes = {entry["id"]: TagNode(entry["id"], entry.get("data")) for entry in state["nodes"]}
+        self.children = {}
+        self.parents = {}
+        for entry in state["edges"]:
+            edge = TagEdge(
+                entry.get("id"), entry["incoming_node_id"], entry["outgoing_node_id"], entry.get("data")
+            )
+            self.children.setdefault(edge.incoming_node_id, []).append(edge)
+            self.parents.setdefault(edge.outgoing_node_id, []).append(edge)
+        self.roots = sorted(id for id in self.nodes if id not in self.parents)
+
+
+def _load_index(session, tag):
+    engine = session.get_bind()
+    key = (tag.id, tag.tree_id, tag.tag_name, tag.created_at)
+    with _lock:
+        cached = _indexes.setdefault(engine, OrderedDict())
+        index = cached.get(key)
+        if index is not None:
+            cached.move_to_end(key)
+            return index
+
+    index = _SnapshotIndex(tag.load_snapshot(session))
+
+    with _lock:
+        cached[key] = index
+        cached.move_to_end(key)
+        while len(cached) > TAG_VIEW_CACHE_SIZE:
+            cached.popitem(last=False)
+    return index
+
+
+def clear_tag_views():
+    """Drop every cached snapshot index."""
+    with _lock:
+        _indexes.clear()
+
+
+class TagView:
+    """
+    The tree state recorded by ``tag``, queried in place.
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.tag_id = tag.id
+        self.tag_name = tag.tag_name
+        self.tree_id = tag.tree_id
+        self._index = None
+
+    def __repr__(self):
+        return f"TagView({self.tree_id!r}, {self.tag_name!r})"
+
+    def _nodes(self, session):
+        if self._index is None:
+            self._index = _load_index(session, self.tag)
+        return self._index
+
+    def get_node(self, session, node_id):
+        return self._nodes(session).nodes.get(node_id)
+
+    def get_root_nodes(self, session):
+        index = self._nodes(session)
+        return [index.nodes[id] for id in index.roots]
+
+    def get_child_nodes(self, session, node_id):
+        index = self._nodes(session)
+        return [index.nodes[edge.outgoing_node_id] for edge in index.children.get(node_id, ())]
+
+    def get_parent_nodes(self, session, node_id):
+        index = self._nodes(session)
+        return [index.nodes[edge.incoming_node_id] for edge in index.parents.get(node_id, ())]
+
+    def get_node_edges(self, session, node_id):
+        index = self._nodes(session)
+        return index.children.get(node_id, []) + index.parents.get(node_id, [])
+
+    def get_nodes_at_depth(self, session, depth):
+        """
+        Retrieve the nodes reachable from a root in exactly ``depth`` steps,
+        ordered by ID.
+        """
+        index = self._nodes(session)
+        level = set(index.roots)
+        for _ in range(depth):
+            level = {edge.outgoing_node_id for id in level for edge in index.children.get(id, ())}
+        return [index.nodes[id] for id in sorted(level)]
+
+    def traverse_tree(self, session, start_node_id):
+        """
+        Walk down from ``start_node_id`` breadth first, reporting each node
+        once at its shortest distance, in the format of ``Tree.traverse_tree``.
+        """
+        index = self._nodes(session)
+        result = {"nodes": [], "edges": []}
+        if start_node_id not in index.nodes:
+            return result
+        depths = {start_node_id: 0}
+        level = [start_node_id]
+        while level:
+            next_level = []
+            for node_id in sorted(level):
+                node_info = {
+                    "id": node_id,
+                    "data": index.nodes[node_id].data,
+                    "depth": depths[node_id],
+                    "edges": [],
+                }
+                result["nodes"].append(node_info)
+                for edge in index.children.get(node_id, ()):
+                    edge_info = {
+                        "incoming_node_id": edge.incoming_node_id,
+                        "outgoing_node_id": edge.outgoing_node_id,
+                        "data": edge.data,
+                    }
+                    node_info["edges"].append(edge_info)
+                    result["edges"].append(edge_info)
+                    if edge.outgoing_node_id not in depths:
+                        depths[edge.outgoing_node_id] = depths[node_id] + 1
+                        next_level.append(edge.outgoing_node_id)
+            level = next_level
+        return result
+
+    def find_path(self, session, start_node_id, end_node_id):
+        """
+        Find a shortest path between two nodes, following edges in either
+        direction.
+
+        Returns:
+            list: ``(node, edge)`` pairs from start to end, where ``edge``
+            leads to the next node and is ``None`` for the last node. Empty if
+            the nodes are not connected.
+        """
+        index = self._nodes(session)
+        if start_node_id not in index.nodes or end_node_id not in index.nodes:
+            return []
+        previous = {start_node_id: None}
+        queue = deque([start_node_id])
+        while queue and end_node_id not in previous:
+            node_id = queue.popleft()
+            for edge in index.children.get(node_id, []) + index.parents.get(node_id, []):
+                next_id = edge.outgoing_node_id if edge.incoming_node_id == node_id else edge.incoming_node_id
+                if next_id not in previous:
+                    previous[next_id] = (node_id, edge)
+                    queue.append(next_id)
+        if end_node_id not in previous:
+            return []
+
+        path = [(index.nodes[end_node_id], None)]
+        node_id = end_node_id
+        while previous[node_id] is not None:
+            node_id, edge = previous[node_id]
+            path.append((index.nodes[node_id], edge))
+        path.reverse()
+        return path
@@ -1,54 +1,348 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+"""
+Render a tree, one of its tags, or the subtree below a node to PNG or SVG.
+
+    python visualize_tree.py <tree_id> [--tag v1] [--root <node_id>] [--output tree.svg]
+                             [--max-nodes 500] [--max-depth 6] [--show]
+
+Nodes are placed by a layered tree layout computed in one pass over the
+adjacency: leaves are spread left to right and every parent is centred over
+its children, one row per depth. A node with several parents is drawn under
+the first one reached, with its other incoming edges drawn as extra lines.
+
+Large trees are drawn at a lower level of detail: levels are expanded from the
+roots down while at most ``max_nodes`` nodes are shown (and down to
+``max_depth``), and every node whose children did not fit is drawn as a
+collapsed node labelled with the number of nodes hidden below it. Labels are
+only drawn when at most ``LABEL_LIMIT`` nodes are shown.
+
+Rendering uses matplotlib's Agg backend, so no display is needed; ``--show``
+also opens the figure in a window.
+"""
+import argparse
+import os
 import sys
-from tree_manager import Tree, TreeNode, TreeEdge, init_db, SessionLocal
+from collections import deque
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+from matplotlib.collections import LineCollection  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from tree_manager import Tree, TreeEdge, TreeNode, TreeTag, init_db, SessionLocal  # noqa: E402
+
+# Nodes drawn before the rest of the tree is collapsed.
+DEFAULT_MAX_NODES = 500
+
+# Node and edge labels are left out above this many drawn nodes.
+LABEL_LIMIT = 200
+
+# Figure size bounds, in inches.
+MIN_FIGURE_SIZE = (8, 6)
+MAX_FIGURE_SIZE = (60, 40)
+
+
+def _label(data, key, default):
+    if isinstance(data, dict) and data.get(key) is not None:
+        return str(data[key])
+    return default
+
+
+def load_graph(session, tree, tag_name=None):
+    """
+    Read the nodes and edges of a tree, or of the state recorded by one of its
+    tags, without loading ORM objects.
+
+    Returns:
+        tuple: ``(labels, edges)``, where ``labels`` maps node IDs to their
+        labels and ``edges`` lists ``(incoming_node_id, outgoing_node_id,
+        label)`` in edge ID order.
+    """
+    if tag_name is not None:
+        tag = session.query(TreeTag).filter_by(tree_id=tree.id, tag_name=tag_name).first()
+        if not tag:
+            raise ValueError(f"Tag '{tag_name}' does not exist for this tree.")
+        state = tag.load_snapshot(session)
+        node_rows = [(node["id"], node.get("data")) for node in state["nodes"]]
+        edge_rows = [
+            (edge["incoming_node_id"], edge["outgoing_node_id"], edge.get("data"))
+            for edge in sorted(state["edges"], key=lambda edge: edge.get("id", 0))
+        ]
+    else:
+        node_rows = session.execute(
+            select(TreeNode.id, TreeNode.data).where(tree._node_filter()).order_by(TreeNode.id)
+        ).all()
+        edge_rows = session.execute(
+            select(TreeEdge.incoming_node_id, TreeEdge.outgoing_node_id, TreeEdge.data)
+            .where(tree._edge_filter())
+            .order_by(TreeEdge.id)
+        ).all()
+
+    labels = {node_id: _label(data, "name", f"Node {node_id}") for node_id, data in node_rows}
+    edges = [
+        (incoming_node_id, outgoing_node_id, _label(data, "relation", ""))
+        for incoming_node_id, outgoing_node_id, data in edge_rows
+        if incoming_node_id in labels and outgoing_node_id in labels
+    ]
+    return labels, edges
+
+
+def spanning_forest(labels, edges, root_id=None):
+    """
+    Pick one parent for every node reachable from the roots (or from
+    ``root_id``), visiting nodes breadth first.
+
+    Returns:
+        tuple: ``(roots, children, depth)``: the root IDs, each node's children
+        in the forest, and each node's depth. Nodes only reachable through a
+        cycle are treated as extra roots.
+    """
+    adjacency = {}
+    has_parent = set()
+    for incoming_node_id, outgoing_node_id, _ in edges:
+        adjacency.setdefault(incoming_node_id, []).append(outgoing_node_id)
+        has_parent.add(outgoing_node_id)
+
+    if root_id is not None:
+        if root_id not in labels:
+            raise ValueError(f"Node {root_id} is not in this tree.")
+        starts = [root_id]
+    else:
+        starts = [node_id for node_id in labels if node_id not in has_parent]
+
+    roots, children, depth = [], {}, {}
+
+    def visit(start):
+        roots.append(start)
+        depth[start] = 0
+        queue = deque([start])
+        while queue:
+            node_id = queue.popleft()
+            for child_id in adjacency.get(node_id, ()):
+                if child_id not in depth:
+                    depth[child_id] = depth[node_id] + 1
+                    children.setdefault(node_id, []).append(child_id)
+                    queue.append(child_id)
+
+    for start in starts:
+        visit(start)
+    if root_id is None:
+        for node_id in labels:
+            if node_id not in depth:
+                visit(node_id)
+    return roots, children, depth
 
-def visualize_tree_by_id(session, tree_id):
+
+def _subtree_sizes(roots, children):
+    sizes = {}
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if expanded:
+                sizes[node_id] = 1 + sum(sizes[child_id] for child_id in children.get(node_id, ()))
+            else:
+                stack.append((node_id, True))
+                stack.extend((child_id, False) for child_id in children.get(node_id, ()))
+    return sizes
+
+
+def collapse(roots, children, max_nodes=DEFAULT_MAX_NODES, max_depth=None):
+    """
+    Choose the nodes to draw: levels are expanded from the roots down as long
+    as the total stays within ``max_nodes`` and the depth within
+    ``max_depth``.
+
+    Returns:
+        tuple: ``(shown, hidden)``: the children drawn under each expanded
+        node, and the number of nodes hidden below each collapsed one.
+    """
+    sizes = _subtree_sizes(roots, children)
+    shown, hidden = {}, {}
+    count = len(roots)
+    level = list(roots)
+    depth = 0
+    while level:
+        next_level = []
+        for node_id in level:
+            node_children = children.get(node_id, [])
+            if not node_children:
+                continue
+            if (max_depth is not None and depth >= max_depth) or count + len(node_children) > max_nodes:
+                hidden[node_id] = sizes[node_id] - 1
+                continue
+            shown[node_id] = node_children
+            count += len(node_children)
+            next_level.extend(node_children)
+        level = next_level
+        depth += 1
+    return shown, hidden
+
+
+def tree_layout(roots, shown):
+    """
+    Place the drawn nodes: each leaf takes the next column, each parent is
+    centred over its first and last child, and the row is the depth.
+
+    Returns:
+        dict: ``{node_id: (x, y)}`` with ``y`` going down from 0.
+    """
+    positions = {}
+    next_column = 0
+    for root in roots:
+        stack = [(root, 0, False)]
+        while stack:
+            node_id, depth, expanded = stack.pop()
+            node_children = shown.get(node_id)
+            if not node_children:
+                positions[node_id] = (next_column, -depth)
+                next_column += 1
+            elif expanded:
+                first, last = positions[node_children[0]][0], positions[node_children[-1]][0]
+                positions[node_id] = ((first + last) / 2, -depth)
+            else:
+                stack.append((node_id, depth, True))
+                stack.extend((child_id, depth + 1, False) for child_id in reversed(node_children))
+    return positions
+
+
+def render(labels, edges, roots, shown, hidden, output, title=None, show=False):
+    """
+    Draw the laid out nodes and every edge between two drawn nodes, and save
+    the figure to ``output`` (its extension picks PNG or SVG).
+    """
+    positions = tree_layout(roots, shown)
+    drawn = [(u, v, label) for u, v, label in edges if u in positions and v in positions]
+    with_labels = len(positions) <= LABEL_LIMIT
+
+    width = max(position[0] for position in positions.values()) + 1 if positions else 1
+    height = -min(position[1] for position in positions.values()) + 1 if positions else 1
+    figsize = (
+        min(max(width * (1.2 if with_labels else 0.15), MIN_FIGURE_SIZE[0]), MAX_FIGURE_SIZE[0]),
+        min(max(height * (1.2 if with_labels else 0.6), MIN_FIGURE_SIZE[1]), MAX_FIGURE_SIZE[1]),
+    )
+    figure, axes = plt.subplots(figsize=figsize)
+    axes.add_collection(
+        LineCollection([(positions[u], positions[v]) for u, v, _ in drawn], colors="gray", linewidths=0.8, zorder=1)
+    )
+    node_ids = list(positions)
+    axes.scatter(
+        [positions[node_id][0] for node_id in node_ids],
+        [positions[node_id][1] for node_id in node_ids],
+        s=[600 if with_labels else 12 for _ in node_ids],
+        c=["orange" if node_id in hidden else "skyblue" for node_id in node_ids],
+        zorder=2,
+    )
+    if with_labels:
+        for node_id in node_ids:
+            label = labels[node_id]
+            if node_id in hidden:
+                label = f"{label}\n(+{hidden[node_id]})"
+            axes.annotate(label, positions[node_id], ha="center", va="center", fontsize=8, zorder=3)
+        for u, v, label in drawn:
+            if label:
+                (x1, y1), (x2, y2) = positions[u], positions[v]
+                axes.annotate(label, ((x1 + x2) / 2, (y1 + y2) / 2), ha="center", fontsize=7, color="dimgray")
+
+    axes.autoscale()
+    axes.margins(0.05)
+    axes.set_axis_off()
+    if title:
+        axes.set_title(title)
+    figure.tight_layout()
+    figure.savefig(output)
+    if show:
+        plt.show()
+    plt.close(figure)
+    return output
+
+
+def visualize_tree_by_id(
+    session,
+    tree_id,
+    output=None,
+    tag_name=None,
+    root_id=None,
+    max_nodes=DEFAULT_MAX_NODES,
+    max_depth=None,
+    show=False,
+):
+    """
+    Render a tree to ``output`` (``tree_figures/tree_visualization_<id>.png``
+    by default).
+
+    Args:
+        session: SQLAlchemy session to interact with the database.
+        tree_id: The tree to draw.
+        output: Path of the PNG or SVG file to write.
+        tag_name: Draw the state recorded by this tag.
+        root_id: Only draw the subtree below this node.
+        max_nodes: Collapse subtrees beyond this many drawn nodes.
+        max_depth: Collapse subtrees below this depth.
+        show: Also open the figure in a window.
+
+    Returns:
+        str: The path written, or ``None`` if rendering failed.
+    """
     try:
         tree = session.query(Tree).filter_by(id=tree_id).first()
         if not tree:
             print(f"No tree found with ID: {tree_id}.")
-            return
-        
+            return None
+
         print(f"Visualizing Tree ID: {tree.id}, Name: {tree.name}")
-        
-        G = nx.DiGraph()
-        
-        nodes = session.query(TreeNode).filter_by(tree_id=tree.id).all()
-        for node in nodes:
-            G.add_node(node.id, label=node.data.get("name", f"Node {node.id}"))
-        
-        edges = session.query(TreeEdge).join(TreeNode, TreeEdge.incoming_node_id == TreeNode.id).filter(TreeNode.tree_id == tree.id).all()
-        for edge in edges:
-            G.add_edge(
-                edge.incoming_node_id,
-                edge.outgoing_node_id,
-                label=edge.data.get("relation", "Edge")
-            )
-        
-        node_labels = {node: data["label"] for node, data in G.nodes(data=True)}
-        edge_labels = {(u, v): data["label"] for u, v, data in G.edges(data=True)}
-
-        plt.figure(figsize=(12, 8))
-        pos = nx.spring_layout(G) 
-        nx.draw(G, pos, with_labels=True, labels=node_labels, node_size=3000, node_color="skyblue", font_size=10)
-        nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_size=9)
-        plt.title(f"Visualization of Tree ID {tree.id}: {tree.name}")
-        plt.savefig(f"tree_figures/tree_visualization_{tree.id}.png")
-        plt.show()
+        if output is None:
+            output = f"tree_figures/tree_visualization_{tree.id}.png"
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        labels, edges = load_graph(session, tree, tag_name=tag_name)
+        roots, children, _ = spanning_forest(labels, edges, root_id=root_id)
+        shown, hidden = collapse(roots, children, max_nodes=max_nodes, max_depth=max_depth)
+        title = f"Visualization of Tree ID {tree.id}: {tree.name}"
+        if tag_name is not None:
+            title += f" at {tag_name}"
+        return render(labels, edges, roots, shown, hidden, output, title=title, show=show)
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        return None
     finally:
         session.close()
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python visualize.py <tree_id>")
-        sys.exit(1)
 
-    tree_id = int(sys.argv[1])
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python visualize_tree.py", description="Render a tree to PNG or SVG.")
+    parser.add_argument("tree_id", type=int)
+    parser.add_argument("--tag", help="draw the state recorded by this tag")
+    parser.add_argument("--root", type=int, help="only draw the subtree below this node")
+    parser.add_argument("--output", help="PNG or SVG file to write")
+    parser.add_argument("--max-nodes", type=int, default=DEFAULT_MAX_NODES)
+    parser.add_argument("--max-depth", type=int)
+    parser.add_argument("--show", action="store_true", help="also open the figure in a window")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        plt.switch_backend(matplotlib.rcParamsDefault["backend"])
     init_db()
     session = SessionLocal()
+    output = visualize_tree_by_id(
+        session,
+        tree_id=args.tree_id,
+        output=args.output,
+        tag_name=args.tag,
+        root_id=args.root,
+        max_nodes=args.max_nodes,
+        max_depth=args.max_depth,
+        show=args.show,
+    )
+    if output is None:
+        return 1
+    print(f"Wrote {output}")
+    return 0
 
-    visualize_tree_by_id(session, tree_id=tree_id)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))